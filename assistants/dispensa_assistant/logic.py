@@ -1,56 +1,391 @@
 # assistants/dispensa_assistant/logic.py
 # Contém a lógica de negócio principal para o assistente de dispensa.
 
+import asyncio
 import fitz  # PyMuPDF
+import hashlib
 import httpx
 import json
-from langchain_community.vectorstores import FAISS
+import os
+import re
+import time
+
+import metrics
+from text_normalize import normalize
 
 # Importa as peças específicas deste assistente
-from .schema import get_schema
-from .prompt import get_prompt
+from .schema import get_schema, get_field_groups, get_dependent_schema, FIELD_GROUPS, POLICY_GROUP
+from .prompt import get_prompt, get_shard_prompt, get_reanalysis_prompt, DECISION_TEXT_LIMIT
+
+# Parâmetros da recuperação (RAG); fazem parte da versão do cache.
+RAG_QUERY_CHARS = 2000
+RAG_TOP_K = 3
+# Dos RAG_TOP_K chunks, quantos podem ser fixados (secções e exceções usadas diretamente pelo prompt)
+RAG_MAX_PINNED = 2
+# Secções da política citadas no prompt: o melhor chunk de cada uma entra sempre no contexto.
+PINNED_SECTIONS = ["Anexo I – Hipóteses de Autodispensa Obrigatória"]
+# Exceções do PASSO 1 do prompt: se a decisão as menciona, o item da política que as trata é fixado.
+EXCEPTION_TERMS = ["PASEP", "FIES", "MCMV", "Minha Casa Minha Vida", "Cédula Rural", "Superendividamento"]
+
+# Parâmetros da extração. Só é lido o texto que o prompt e o RAG usam (o resto das páginas nem é extraído).
+EXTRACTION_CHAR_BUDGET = max(DECISION_TEXT_LIMIT, RAG_QUERY_CHARS)
+# Páginas mais lentas do que isto são registadas no log (PDFs patológicos)
+SLOW_PAGE_MS = float(os.getenv("SLOW_PAGE_MS", "500"))
+# Linhas mais curtas não são comparadas entre páginas (evita remover "Ante o exposto," e afins)
+BOILERPLATE_MIN_CHARS = 12
+PAGE_NUMBER_LINE = re.compile(r"^(p[aá]gina|p[aá]g\.?|fls?\.?)?\s*\d+\s*((de|/)\s*\d+)?$", re.IGNORECASE)
+
 
-def run_analysis(form_type: str, file_content: bytes, vector_store: FAISS, gemini_url: str):
+# Modo de extração pelo LLM:
+#   - "single" (padrão): todos os campos numa só chamada (também usado se alguma chamada em paralelo falhar).
+#   - "sharded": o schema é dividido em grupos de campos (FIELD_GROUPS), pedidos em chamadas concorrentes;
+#     o tempo do job passa a ser o do grupo mais lento, mas cada job gasta uma chamada por grupo da quota
+#     LLM_REQUESTS_PER_MINUTE (e o grupo da fundamentação leva o prompt completo, pelo que os tokens não descem).
+EXTRACTION_MODE = os.getenv("EXTRACTION_MODE", "single").lower()
+# Valor dos campos que o modelo não devolveu (o mesmo que o prompt pede para dados ausentes)
+MISSING_VALUE = "Não consta na decisão"
+
+
+# --- Etapas do fluxo (funções de módulo para poderem correr num pool de processos) ---
+
+def open_pdf(source):
     """
-    Executa o fluxo completo de análise para o assistente de dispensa.
-    Retorna um dicionário com os dados extraídos e o contexto RAG.
+    Abre o PDF a partir do caminho (upload em spool) ou dos bytes em memória.
     """
-    # 1. Extrair texto do PDF
-    with fitz.open(stream=file_content, filetype="pdf") as doc:
-        decision_text = "".join(page.get_text() for page in doc)
+    if isinstance(source, (bytes, bytearray)):
+        return fitz.open(stream=source, filetype="pdf")
+    return fitz.open(source)
+
+
+def iter_pages(doc):
+    """
+    Gera (nº da página, texto, ms de extração) página a página, sem extrair as seguintes antes de serem pedidas.
+    """
+    for page in doc:
+        started = time.perf_counter()
+        text = page.get_text()
+        yield page.number + 1, text, (time.perf_counter() - started) * 1000
+
+
+def _boilerplate_key(line: str) -> str:
+    # Números variam entre páginas ("Página 3 de 20", "fls. 45"): são ignorados na comparação.
+    return re.sub(r"\d+", "#", " ".join(line.split()).lower())
+
+
+def extract_decision(source, char_budget: int = EXTRACTION_CHAR_BUDGET):
+    """
+    Extrai o texto da decisão página a página até cumprir `char_budget` caracteres. Etapa CPU-bound.
+    Remove numeração de páginas e linhas que se repetem de página para página (cabeçalhos, rodapés,
+    assinaturas). Retorna (texto, estatísticas da extração com os tempos das páginas mais lentas).
+    """
+    started = time.perf_counter()
+    last_seen_on = {}
+    parts = []
+    chars = 0
+    skipped_lines = 0
+    timings = []
+    with open_pdf(source) as doc:
+        page_count = len(doc)
+        for page_number, text, elapsed_ms in iter_pages(doc):
+            timings.append((page_number, round(elapsed_ms, 1)))
+            if elapsed_ms > SLOW_PAGE_MS:
+                print(f"AVISO: a página {page_number} do PDF demorou {elapsed_ms:.0f} ms a extrair.")
+            kept = []
+            for line in text.splitlines(keepends=True):
+                stripped = line.strip()
+                if stripped and PAGE_NUMBER_LINE.match(stripped):
+                    skipped_lines += 1
+                    continue
+                if len(stripped) >= BOILERPLATE_MIN_CHARS:
+                    key = _boilerplate_key(stripped)
+                    previous_page = last_seen_on.get(key)
+                    last_seen_on[key] = page_number
+                    if previous_page is not None and previous_page != page_number:
+                        skipped_lines += 1
+                        continue
+                kept.append(line)
+            page_text = "".join(kept)
+            parts.append(page_text)
+            chars += len(page_text)
+            if chars >= char_budget:
+                break
+
+    decision_text = "".join(parts)
     if not decision_text.strip():
         raise ValueError("O arquivo PDF está vazio ou não contém texto extraível.")
+    stats = {
+        "pages_total": page_count,
+        "pages_read": len(timings),
+        "chars": len(decision_text),
+        "boilerplate_lines": skipped_lines,
+        "extract_ms": round((time.perf_counter() - started) * 1000, 1),
+        "slowest_pages": sorted(timings, key=lambda timing: timing[1], reverse=True)[:3],
+    }
+    return decision_text, stats
 
-    # 2. Recuperar contexto da base de vetores (RAG)
-    query_text = decision_text[:2000]
-    relevant_docs = vector_store.similarity_search(query=query_text, k=3)
-    rag_context = "\n\n---\n\n".join([doc.page_content for doc in relevant_docs])
 
-    # 3. Construir o prompt e obter o schema
-    prompt_text = get_prompt(decision_text, rag_context)
-    json_schema = get_schema(form_type)
+def extract_text(source) -> str:
+    """
+    Extrai o texto da decisão (caminho ou bytes do PDF), limitado ao que o prompt e o RAG usam.
+    """
+    return extract_decision(source)[0]
 
-    if not prompt_text or not json_schema:
-        raise ValueError(f"Não foi possível encontrar prompt ou schema para o formulário '{form_type}'.")
 
-    # 4. Chamar a API do modelo de linguagem (LLM)
-    payload = {
+def mentioned_exceptions(decision_text: str) -> list:
+    normalized = f" {normalize(decision_text)} "
+    return [term for term in EXCEPTION_TERMS if f" {normalize(term)} " in normalized]
+
+
+def format_context(chunks) -> str:
+    parts = []
+    for chunk in chunks:
+        section, page = chunk.metadata.get("section"), chunk.metadata.get("page")
+        label = " | ".join(part for part in (section, f"p. {page}" if page else "") if part)
+        parts.append(f"[{label}]\n{chunk.page_content}" if label else chunk.page_content)
+    return "\n\n---\n\n".join(parts)
+
+
+def policy_query(decision_text: str) -> dict:
+    """
+    Parâmetros da pesquisa híbrida (BM25 + FAISS), com as secções do Anexo I e as exceções mencionadas fixadas.
+    """
+    return dict(
+        query_text=decision_text[:RAG_QUERY_CHARS], k=RAG_TOP_K,
+        pin_sections=PINNED_SECTIONS, pin_terms=mentioned_exceptions(decision_text), max_pinned=RAG_MAX_PINNED
+    )
+
+
+def retrieve_context(retriever, decision_text: str) -> str:
+    """
+    Recupera o contexto da Política Recursal na base de vetores (RAG).
+    `retriever` é um LocalRetriever ou RemoteRetriever (retrieval.py).
+    """
+    return format_context(retriever.search_sync(**policy_query(decision_text)))
+
+
+async def retrieve_context_async(retriever, decision_text: str) -> str:
+    """
+    Igual a `retrieve_context`, sem bloquear o event loop (o embedding da consulta é agrupado
+    com o de outros jobs concorrentes e a pesquisa corre fora do loop ou no serviço de recuperação).
+    """
+    return format_context(await retriever.search(**policy_query(decision_text)))
+
+
+def make_payload(prompt_text: str, json_schema: dict) -> dict:
+    return {
         "contents": [{"parts": [{"text": prompt_text}]}],
         "generationConfig": {
             "responseMimeType": "application/json",
             "responseSchema": {"type": "OBJECT", "properties": json_schema}
         }
     }
-    
-    response = httpx.post(gemini_url, json=payload, timeout=120.0)
-    response.raise_for_status()
-    
-    result = response.json()
-    if 'candidates' in result and result['candidates']:
-        extracted_data = json.loads(result['candidates'][0]['content']['parts'][0]['text'])
+
+
+def build_payload(form_type: str, decision_text: str, rag_context: str) -> dict:
+    """
+    Constrói o pedido para a API do Gemini a partir do prompt e do schema do formulário.
+    """
+    with metrics.stage("prompt_build"):
+        prompt_text = get_prompt(decision_text, rag_context)
+        json_schema = get_schema(form_type)
+
+    if not prompt_text or not json_schema:
+        raise ValueError(f"Não foi possível encontrar prompt ou schema para o formulário '{form_type}'.")
+
+    return make_payload(prompt_text, json_schema)
+
+
+def build_shard_payloads(form_type: str, decision_text: str, rag_context: str) -> dict:
+    """
+    Um pedido por grupo de campos do formulário: o grupo da fundamentação leva o prompt completo
+    (regras e Política Recursal), os restantes um prompt curto só com a decisão.
+    """
+    with metrics.stage("prompt_build"):
+        groups = get_field_groups(form_type)
+        if not groups:
+            raise ValueError(f"Não foi possível encontrar o schema para o formulário '{form_type}'.")
         return {
-            "extracted_data": extracted_data,
-            "rag_context": rag_context
+            group: make_payload(
+                get_prompt(decision_text, rag_context) if group == POLICY_GROUP else get_shard_prompt(group, decision_text),
+                fields
+            )
+            for group, fields in groups.items()
         }
+
+
+def parse_response(result: dict) -> dict:
+    """
+    Extrai o JSON gerado pelo modelo da resposta da API do Gemini.
+    """
+    if 'candidates' in result and result['candidates']:
+        return json.loads(result['candidates'][0]['content']['parts'][0]['text'])
+    raise ValueError(f"Resposta inesperada da API Gemini: {result}")
+
+
+def validate_fields(data: dict, json_schema: dict) -> dict:
+    """
+    Resultado na ordem do schema e só com os seus campos; os campos em falta ficam com MISSING_VALUE.
+    """
+    missing = [field for field in json_schema if data.get(field) is None]
+    if missing:
+        print(f"AVISO: o modelo não devolveu os campos {', '.join(missing)}.")
+    return {field: MISSING_VALUE if data.get(field) is None else str(data[field]) for field in json_schema}
+
+
+async def extract_sharded(form_type: str, decision_text: str, rag_context: str, engine, gemini_url: str) -> dict:
+    """
+    Pede os grupos de campos em paralelo e junta as respostas, validadas contra o schema completo.
+    Se uma das chamadas falhar, as restantes são canceladas.
+    """
+    payloads = build_shard_payloads(form_type, decision_text, rag_context)
+
+    async def extract_group(group: str, payload: dict) -> dict:
+        with metrics.stage(f"llm_shard_{group}"):
+            result = parse_response(await engine.llm.generate(gemini_url, payload))
+        # Cada grupo só pode preencher os seus campos.
+        fields = payload["generationConfig"]["responseSchema"]["properties"]
+        return {field: value for field, value in result.items() if field in fields}
+
+    async with asyncio.TaskGroup() as group_tasks:
+        tasks = [group_tasks.create_task(extract_group(group, payload)) for group, payload in payloads.items()]
+    merged = {}
+    for task in tasks:
+        merged.update(task.result())
+    return validate_fields(merged, get_schema(form_type))
+
+
+async def extract_fields(form_type: str, decision_text: str, rag_context: str, engine, gemini_url: str) -> dict:
+    """
+    Extrai os campos do formulário segundo o EXTRACTION_MODE, com a chamada única como alternativa.
+    """
+    if EXTRACTION_MODE == "sharded":
+        try:
+            return await extract_sharded(form_type, decision_text, rag_context, engine, gemini_url)
+        except Exception as e:
+            errors = e.exceptions if isinstance(e, ExceptionGroup) else [e]
+            print(f"AVISO: extração em paralelo falhou ({'; '.join(map(str, errors))}); a repetir numa só chamada.")
+
+    payload = build_payload(form_type, decision_text, rag_context)
+    # Cliente partilhado: limites de quota, novas tentativas em 429/5xx e cancelamento com o job.
+    # Validado como no modo em paralelo: ambos os caminhos devolvem os campos do schema, na mesma ordem.
+    return validate_fields(parse_response(await engine.llm.generate(gemini_url, payload)), get_schema(form_type))
+
+
+def get_stage_params() -> str:
+    """
+    Hash dos parâmetros da extração e do RAG (parte das chaves de cache).
+    """
+    material = json.dumps([
+        EXTRACTION_CHAR_BUDGET, BOILERPLATE_MIN_CHARS, PAGE_NUMBER_LINE.pattern,
+        RAG_QUERY_CHARS, RAG_TOP_K, RAG_MAX_PINNED, PINNED_SECTIONS, EXCEPTION_TERMS
+    ], ensure_ascii=False)
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()[:12]
+
+
+def get_stage_key(file_hash: str, vector_store_version: str) -> str:
+    """
+    Chave do texto extraído e do contexto RAG de um PDF no cache de etapas.
+    """
+    return f"{file_hash}:{vector_store_version}:{get_stage_params()}"
+
+
+def get_cache_version(form_type: str) -> str:
+    """
+    Hash do template do prompt, do schema do formulário, do modo de extração e dos parâmetros do RAG.
+    Qualquer alteração a estes invalida os resultados guardados em cache para este formulário.
+    """
+    prompt_template = get_prompt("{decision_text}", "{policy_context}")
+    schema = json.dumps(get_schema(form_type), sort_keys=True, ensure_ascii=False)
+    material = [prompt_template, schema, str(DECISION_TEXT_LIMIT), get_stage_params(), EXTRACTION_MODE]
+    if EXTRACTION_MODE == "sharded":
+        material += [json.dumps(FIELD_GROUPS, sort_keys=True)]
+        material += [get_shard_prompt(group, "{decision_text}") for group in get_field_groups(form_type) or {}
+                     if group != POLICY_GROUP]
+    material = "\n".join(material)
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()[:16]
+
+
+# --- Pontos de entrada ---
+
+def run_analysis(form_type: str, file_path: str, vector_store, gemini_url: str):
+    """
+    Executa o fluxo completo de análise para o assistente de dispensa (sempre numa única chamada ao LLM).
+    Retorna um dicionário com os dados extraídos, o contexto RAG e as estatísticas da extração.
+    """
+    # 1. Extrair texto do PDF (só as páginas necessárias)
+    with metrics.stage("pdf_extraction"):
+        decision_text, extraction = extract_decision(file_path)
+
+    # 2. Recuperar contexto da base de vetores (RAG)
+    rag_context = retrieve_context(vector_store, decision_text)
+
+    # 3. Construir o prompt e obter o schema
+    payload = build_payload(form_type, decision_text, rag_context)
+
+    # 4. Chamar a API do modelo de linguagem (LLM)
+    with metrics.stage("llm_call"):
+        response = httpx.post(gemini_url, json=payload, timeout=120.0)
+        response.raise_for_status()
+
+    return {
+        "extracted_data": parse_response(response.json()),
+        "rag_context": rag_context,
+        "extraction": extraction
+    }
+
+
+async def run_analysis_async(form_type: str, file_path: str, vector_store, gemini_url: str, engine,
+                             cache=None, file_hash: str | None = None, vector_store_version: str = ""):
+    """
+    Versão não bloqueante de `run_analysis`, usada pelo orquestrador.
+    A extração corre no pool de processos, o RAG pela interface de recuperação (retrieval.py) e o LLM
+    via cliente partilhado (llm_client.py).
+    Com `cache`, o texto extraído e o contexto RAG (independentes do formulário) são reaproveitados.
+    """
+    stage = None
+    stage_key = None
+    extraction = None
+    if cache is not None and file_hash:
+        stage_key = get_stage_key(file_hash, vector_store_version)
+        stage = await engine.run_io(cache.get, "stage", stage_key)
+
+    if stage is not None:
+        decision_text, rag_context = stage["decision_text"], stage["rag_context"]
     else:
-        raise ValueError(f"Resposta inesperada da API Gemini: {result}")
\ No newline at end of file
+        # O processo do pool abre o PDF pelo caminho: os bytes não atravessam a fronteira entre processos.
+        with metrics.stage("pdf_extraction"):
+            decision_text, extraction = await engine.run_cpu(extract_decision, file_path)
+        rag_context = await retrieve_context_async(vector_store, decision_text)
+        if stage_key is not None:
+            await engine.run_io(cache.set, "stage", stage_key, {"decision_text": decision_text, "rag_context": rag_context})
+
+    extracted_data = await extract_fields(form_type, decision_text, rag_context, engine, gemini_url)
+
+    return {
+        "extracted_data": extracted_data,
+        "rag_context": rag_context,
+        "extraction": extraction
+    }
+
+
+async def run_reanalysis_async(form_type: str, corrections: dict, gemini_url: str, engine, cache,
+                               file_hash: str, vector_store_version: str = "") -> dict | None:
+    """
+    Reanálise incremental: depois de o analista corrigir factos (ex: valor_condenacao), deriva de novo
+    só os campos que deles dependem (FIELD_DEPENDENCIES), numa chamada com o sub-schema reduzido.
+    O texto da decisão e o contexto RAG vêm do cache de etapas da análise original (sem reabrir o PDF).
+    Retorna os campos recalculados, ou None se o texto da decisão já não estiver em cache.
+    """
+    json_schema = get_dependent_schema(form_type, corrections)
+    if not json_schema:
+        return {}
+
+    stage = await engine.run_io(cache.get, "stage", get_stage_key(file_hash, vector_store_version))
+    if stage is None:
+        return None
+
+    with metrics.stage("prompt_build"):
+        prompt_text = get_reanalysis_prompt(stage["decision_text"], stage["rag_context"], corrections)
+    with metrics.stage("llm_reanalysis"):
+        result = await engine.llm.generate(gemini_url, make_payload(prompt_text, json_schema))
+    return validate_fields(parse_response(result), json_schema)
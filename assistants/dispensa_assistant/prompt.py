@@ -1,6 +1,9 @@
 # assistants/dispensa_assistant/prompt.py
 # Contém o prompt de IA específico para a tarefa de análise de súmulas.
 
+# Nº de caracteres da decisão incluídos no prompt
+DECISION_TEXT_LIMIT = 14000
+
 def get_prompt(decision_text: str, policy_context: str) -> str:
     """
     Constrói e retorna o prompt de IA para o assistente de dispensa.
@@ -36,9 +39,48 @@ def get_prompt(decision_text: str, policy_context: str) -> str:
 
     **2. DECISÃO JUDICIAL (Fonte dos Fatos):**
     ---
-    {decision_text[:14000]}
+    {decision_text[:DECISION_TEXT_LIMIT]}
     ---
 
     **TAREFA FINAL:**
     Seguindo rigorosamente a ORDEM DE ANÁLISE OBRIGATÓRIA, analise os documentos e preencha o esquema JSON a seguir.
-    """
\ No newline at end of file
+    """
+
+# Instruções de cada grupo de campos na extração em paralelo (ver FIELD_GROUPS em schema.py).
+# O grupo da fundamentação usa o prompt completo (get_prompt), com a Política Recursal.
+SHARD_INSTRUCTIONS = {
+    "identificacao": "Extraia os dados de identificação: datas de publicação e prazo, números do processo, NPJ, contrato e operação, partes, tipo de ação, órgão de tramitação, advogado/escritório e a decisão ou recurso em causa.",
+    "valores": "Extraia os valores monetários exatamente como aparecem na decisão (valor da causa, valor pretendido, condenação total e custas recursais).",
+    "liminar_multa": "Verifique se houve liminar (deferida e cumprida), cominação de multa (valor diário e limite), litispendência ou coisa julgada, documentos anexados e obrigação de fazer.",
+    "subsidios": "Verifique os subsídios pedidos e enviados para a defesa (descrição, rastreamento e uso na defesa) e se há precedente sobre a matéria.",
+}
+
+def get_shard_prompt(group: str, decision_text: str) -> str:
+    """
+    Prompt curto para um grupo de campos factuais (sem o contexto da Política Recursal).
+    """
+    return f"""
+    Você é um assistente jurídico sênior. Preencha apenas os campos do esquema JSON a seguir a partir da decisão judicial.
+
+    **TAREFA:** {SHARD_INSTRUCTIONS[group]}
+
+    **Dados Ausentes:** Se uma informação não estiver na decisão, preencha o campo com **"Não consta na decisão"**. NÃO INVENTE DADOS.
+
+    **DECISÃO JUDICIAL:**
+    ---
+    {decision_text[:DECISION_TEXT_LIMIT]}
+    ---
+    """
+
+
+def get_reanalysis_prompt(decision_text: str, policy_context: str, confirmed_facts: dict) -> str:
+    """
+    Prompt completo com os factos confirmados pelo analista, para derivar de novo só os campos dependentes.
+    """
+    facts = "\n".join(f"    * {field}: {value}" for field, value in confirmed_facts.items())
+    return get_prompt(decision_text, policy_context) + f"""
+    **FACTOS CONFIRMADOS PELO ANALISTA (prevalecem sobre o que estiver na decisão):**
+{facts}
+
+    Refaça a análise com estes factos e preencha apenas os campos do esquema JSON a seguir.
+    """
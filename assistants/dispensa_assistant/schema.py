@@ -1,6 +1,45 @@
 # assistants/dispensa_assistant/schema.py
 # Contém a definição da estrutura (schema) para os formulários do assistente de dispensa.
 
+# Grupos de campos independentes, para a extração em paralelo (EXTRACTION_MODE=sharded em logic.py).
+# Cada grupo é pedido ao LLM numa chamada própria, com um prompt mais curto; só o grupo da
+# fundamentação (POLICY_GROUP) recebe o contexto da Política Recursal e as regras de análise.
+FIELD_GROUPS = {
+    "identificacao": [
+        "data_publicacao", "prazo_fatal", "npj", "contrato_lide", "operacao_numero", "data_vencimento_operacao",
+        "autor_es", "reu_s", "tipo_acao", "numero_processo", "orgao_tramitacao", "escritorio_advogado_contato",
+        "recurso_objeto", "tipo_recurso", "decisao_objeto_autodispensa", "andamento_registrado",
+    ],
+    "valores": ["valor_causa", "valor_pretendido", "valor_condenacao", "valor_custas_recursais"],
+    "liminar_multa": [
+        "liminar_deferida", "liminar_cumprida", "cominacao_multa", "multa_valor_diario", "multa_limite",
+        "litispendencia_coisa_julgada", "documentos_anexados_check", "obrigacao_fazer_cumprida_descricao",
+    ],
+    "subsidios": [
+        "solicitado_subsidio", "subsidio_atendido", "subsidio_descricao", "subsidio_rastreamento",
+        "subsidio_utilizado_defesa", "subsidio_nao_utilizado_justificativa", "precedente_materia_julgados",
+    ],
+    "fundamentacao": [
+        "descricao_sucinta", "materias_discutidas", "fundamento_autodispensa", "fundamentacao_relatorio",
+        "parecer_fundamentado_autodispensa", "teses_defesa", "fundamentacao_dispensa", "fundamentacao_autorizacao",
+    ],
+}
+POLICY_GROUP = "fundamentacao"
+
+# Campos da fundamentação que dependem de factos que o analista pode corrigir (reanálise incremental).
+# Ex: a regra do PASSO 2 do prompt compara a condenação com o limite do Juizado Especial ou da Justiça Comum.
+_FUNDAMENTACAO = ["fundamento_autodispensa", "parecer_fundamentado_autodispensa",
+                  "fundamentacao_dispensa", "fundamentacao_autorizacao"]
+FIELD_DEPENDENCIES = {
+    "valor_condenacao": _FUNDAMENTACAO,
+    "tipo_acao": _FUNDAMENTACAO,
+    "orgao_tramitacao": _FUNDAMENTACAO,
+    "materias_discutidas": _FUNDAMENTACAO,
+    "recurso_objeto": ["parecer_fundamentado_autodispensa"],
+    "tipo_recurso": ["fundamentacao_dispensa", "fundamentacao_autorizacao"],
+    "teses_defesa": ["fundamentacao_dispensa", "fundamentacao_autorizacao"],
+}
+
 def get_schema(form_type: str):
     """
     Retorna o esquema de campos para um determinado tipo de súmula.
@@ -68,4 +107,30 @@ def get_schema(form_type: str):
         
         return shared_schema
     
-    return None
\ No newline at end of file
+    return None
+
+
+def get_field_groups(form_type: str):
+    """
+    Divide o schema do formulário pelos FIELD_GROUPS (só os grupos com campos neste formulário).
+    Campos sem grupo ficam na fundamentação, que usa o prompt completo.
+    """
+    schema = get_schema(form_type)
+    if not schema:
+        return None
+    group_of = {field: group for group, fields in FIELD_GROUPS.items() for field in fields}
+    groups = {}
+    for field, spec in schema.items():
+        groups.setdefault(group_of.get(field, POLICY_GROUP), {})[field] = spec
+    return {group: groups[group] for group in FIELD_GROUPS if group in groups}
+
+
+def get_dependent_schema(form_type: str, corrected_fields):
+    """
+    Sub-schema dos campos a derivar de novo após correções aos `corrected_fields`.
+    Campos que o próprio analista corrigiu não são recalculados.
+    """
+    schema = get_schema(form_type) or {}
+    corrected = set(corrected_fields)
+    dependents = {field for corrected_field in corrected for field in FIELD_DEPENDENCIES.get(corrected_field, [])}
+    return {field: spec for field, spec in schema.items() if field in dependents and field not in corrected}
@@ -0,0 +1,3 @@
+# benchmarks/
+# Benchmark de ponta a ponta da API (análise -> estado -> geração) sem rede nem modelos reais.
+# Ver benchmarks/run.py.
@@ -0,0 +1,59 @@
+# benchmarks/compare.py
+# Compara dois resultados do benchmark (JSON de benchmarks/run.py): débito e percentis por etapa.
+#
+# Exemplo:
+#   python -m benchmarks.compare benchmarks/results/antes.json benchmarks/results/depois.json
+
+import argparse
+import json
+from typing import Any, Dict
+
+
+def _delta(before: float | None, after: float | None) -> str:
+    if before is None or after is None:
+        return ""
+    if before == 0:
+        return "n/a"
+    return f"{(after - before) / before * 100:+.1f}%"
+
+
+def _print_stages(title: str, before: Dict[str, Any], after: Dict[str, Any], metrics=("p50", "p95", "p99")):
+    print(f"\n{title}")
+    for stage in sorted(set(before) | set(after)):
+        cells = []
+        for metric in metrics:
+            old = before.get(stage, {}).get(metric)
+            new = after.get(stage, {}).get(metric)
+            old_text = f"{old:.3f}" if old is not None else "-"
+            new_text = f"{new:.3f}" if new is not None else "-"
+            cells.append(f"{metric} {old_text} -> {new_text} {_delta(old, new):>7}")
+        print(f"  {stage:<28} " + " | ".join(cells))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compara dois resultados do benchmark.")
+    parser.add_argument("before")
+    parser.add_argument("after")
+    args = parser.parse_args()
+    with open(args.before, encoding="utf-8") as f:
+        before = json.load(f)
+    with open(args.after, encoding="utf-8") as f:
+        after = json.load(f)
+
+    print(f"Antes:  {before['timestamp']} {before['git_commit']} {before.get('label', '')}")
+    print(f"Depois: {after['timestamp']} {after['git_commit']} {after.get('label', '')}")
+    old, new = before["summary"]["throughput_per_second"], after["summary"]["throughput_per_second"]
+    print(f"Débito: {old} -> {new} pedidos/s ({_delta(old, new)})")
+    if before["config"] != after["config"]:
+        changed = {key for key in set(before["config"]) | set(after["config"])
+                   if before["config"].get(key) != after["config"].get(key)}
+        print(f"AVISO: configurações diferentes ({', '.join(sorted(changed))}).")
+
+    _print_stages("Etapas (cliente):", before["client_stages"], after["client_stages"])
+    for service in sorted(set(before["server_stages"]) | set(after["server_stages"])):
+        _print_stages(f"Etapas internas ({service}):", before["server_stages"].get(service, {}),
+                      after["server_stages"].get(service, {}))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,36 @@
+# benchmarks/embedding_stub.py
+# Sidecar de embeddings com a mesma interface do embedding_service.py (POST /embed), mas com o
+# embedder por hashing do benchmark: sem modelo para descarregar e com latência desprezável.
+#
+# Para rodar isoladamente:
+#   uvicorn benchmarks.embedding_stub:app --port 8010
+# e, na API: EMBEDDING_SERVICE_URL=http://127.0.0.1:8010
+
+from typing import List
+
+from fastapi import FastAPI
+from pydantic import BaseModel
+
+import metrics
+from benchmarks.fixtures import HASH_EMBED_MODEL, hash_embed
+
+app = FastAPI(
+    title="Monster Factory - Embedding Stub",
+    description="Embeddings por hashing para benchmarks offline.",
+    version="1.0.0"
+)
+metrics.install(app)
+
+
+class EmbedRequest(BaseModel):
+    texts: List[str]
+
+
+@app.get("/")
+def read_root():
+    return {"message": "Stub de embeddings está ativo.", "model": HASH_EMBED_MODEL}
+
+
+@app.post("/embed")
+def embed(request: EmbedRequest):
+    return {"embeddings": [hash_embed(text) for text in request.texts]}
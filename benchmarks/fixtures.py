@@ -0,0 +1,120 @@
+# benchmarks/fixtures.py
+# Dados sintéticos do benchmark, gerados de forma determinística (mesma semente -> mesmos ficheiros):
+#   - hash_embed: embedder por "hashing" de termos (sem modelo), usado no índice e nas consultas;
+#   - build_policy_index: pequena base vetorial da política no formato do vector_index.py;
+#   - build_corpus: decisões em PDF de vários tamanhos (nº de páginas).
+
+import datetime
+import hashlib
+import os
+import random
+from typing import Dict, List, Sequence
+
+import fitz  # PyMuPDF
+import numpy as np
+
+from text_normalize import tokenize
+from vector_index import write_index
+
+HASH_EMBED_DIM = 384
+HASH_EMBED_MODEL = "benchmark-hash-embedder"
+
+_VOCABULARY = (
+    "recurso apelação sentença acórdão condenação valor dano moral material contrato financiamento operação "
+    "banco autor réu juros correção monetária honorários sucumbência prescrição revisão cláusula abusiva "
+    "tarifa seguro prestamista cédula crédito rural consignado cartão benefício previdenciário restituição "
+    "indébito dobro repetição tutela antecipada liminar busca apreensão veículo execução título penhora "
+    "jurisprudência súmula tribunal superior precedente vinculante autodispensa dispensa autorização "
+    "parecer fundamentado alçada limite política recursal hipótese exceção"
+).split()
+
+_POLICY_SECTIONS = [
+    "1. Disposições Gerais",
+    "2. Alçadas de Dispensa",
+    "3. Hipóteses de Recurso Obrigatório",
+    "Anexo I – Hipóteses de Autodispensa Obrigatória",
+    "Anexo II – Exceções",
+]
+_EXCEPTION_TERMS = ["PASEP", "FIES", "Minha Casa Minha Vida", "Cédula Rural", "Superendividamento"]
+
+
+def hash_embed(text: str, dim: int = HASH_EMBED_DIM) -> List[float]:
+    """
+    Vetor normalizado em que cada termo soma ±1 numa posição dada pelo seu hash.
+    Textos com termos em comum ficam próximos, o que chega para exercitar o FAISS.
+    """
+    vector = np.zeros(dim, dtype="float32")
+    for token in tokenize(text):
+        digest = hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest()
+        value = int.from_bytes(digest, "little")
+        vector[value % dim] += 1.0 if (value >> 32) & 1 else -1.0
+    norm = float(np.linalg.norm(vector))
+    if norm > 0:
+        vector /= norm
+    return vector.tolist()
+
+
+def _sentence(rng: random.Random, words: int) -> str:
+    return " ".join(rng.choice(_VOCABULARY) for _ in range(words)).capitalize() + "."
+
+
+def build_policy_index(directory: str, chunks_per_section: int = 40, seed: int = 7) -> Dict[str, int]:
+    """
+    Grava em `directory` uma base vetorial sintética da política (secções numeradas e anexos).
+    """
+    rng = random.Random(seed)
+    texts, metadatas = [], []
+    for page, section in enumerate(_POLICY_SECTIONS, start=1):
+        for i in range(chunks_per_section):
+            text = f"{section}\n" + " ".join(_sentence(rng, rng.randint(12, 25)) for _ in range(6))
+            if section.startswith("Anexo II") and i < len(_EXCEPTION_TERMS):
+                text += f" Excetuam-se as operações de {_EXCEPTION_TERMS[i]}."
+            texts.append(text)
+            metadatas.append({"source": "politica_sintetica.pdf", "page": page, "section": section})
+    vectors = np.array([hash_embed(text) for text in texts], dtype="float32")
+    write_index(directory, vectors, texts, metadatas, HASH_EMBED_MODEL)
+    return {"chunks": len(texts), "dimension": HASH_EMBED_DIM}
+
+
+def _decision_header(rng: random.Random, number: int) -> str:
+    published = datetime.date.today() - datetime.timedelta(days=rng.randint(0, 20))
+    lines = [
+        "PODER JUDICIÁRIO",
+        "TRIBUNAL DE JUSTIÇA DO ESTADO",
+        f"Processo nº {number:07d}-{rng.randint(10, 99)}.2024.8.26.{rng.randint(1000, 9999)}",
+        f"Autor: {rng.choice(['Maria', 'João', 'Ana', 'Pedro'])} {rng.choice(['Silva', 'Souza', 'Costa'])}",
+        "Réu: Banco do Brasil S.A.",
+        f"Publicado no DJe em {published:%d/%m/%Y}",
+    ]
+    if rng.random() < 0.5:
+        lines.append(f"Prazo fatal: {published + datetime.timedelta(days=rng.randint(5, 25)):%d/%m/%Y}")
+    return "\n".join(lines)
+
+
+def build_corpus(directory: str, page_counts: Sequence[int] = (1, 5, 20, 80), per_size: int = 2,
+                 seed: int = 11) -> List[str]:
+    """
+    Gera `per_size` decisões em PDF para cada nº de páginas de `page_counts`. Retorna os caminhos.
+    """
+    rng = random.Random(seed)
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for pages in page_counts:
+        for copy in range(per_size):
+            doc = fitz.open()
+            for page_number in range(pages):
+                page = doc.new_page()
+                body = []
+                if page_number == 0:
+                    body.append(_decision_header(rng, len(paths) + 1))
+                    if rng.random() < 0.3:
+                        body.append(f"Trata-se de operação vinculada ao {rng.choice(_EXCEPTION_TERMS)}.")
+                    body.append(f"Valor da condenação: R$ {rng.randint(1000, 90000):,}.{rng.randint(0, 99):02d}".replace(",", "."))
+                body.extend(_sentence(rng, rng.randint(15, 30)) for _ in range(12))
+                page.insert_textbox(fitz.Rect(50, 50, 545, 800), "\n".join(body), fontsize=9)
+                page.insert_text((280, 820), f"Página {page_number + 1} de {pages}", fontsize=8)
+            path = os.path.join(directory, f"decisao_{pages:03d}p_{copy}.pdf")
+            doc.save(path)
+            doc.close()
+            paths.append(path)
+    return paths
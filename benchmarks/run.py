@@ -0,0 +1,409 @@
+# benchmarks/run.py
+# Benchmark / teste de carga de ponta a ponta, offline, com substitutos locais de tudo o que é externo:
+#   - Gemini: gemini_stub.py (JSON válido segundo o schema do formulário, latência configurável);
+#   - embeddings: benchmarks/embedding_stub.py (hashing, sem modelo);
+#   - política: base vetorial sintética; decisões: PDFs gerados de vários tamanhos.
+# A API, o serviço de recuperação e o gerador são os serviços reais, arrancados com uvicorn numa pasta de trabalho temporária.
+#
+# Cada pedido faz POST /api/v1/analysis -> GET status (long-poll) -> POST /api/v1/generate.
+# O relatório tem o débito e os percentis p50/p95/p99 de cada etapa vista pelo cliente e das etapas
+# internas (histogramas de /metrics da API, do serviço de recuperação e do gerador). O resultado fica em JSON para comparar
+# execuções ao longo do tempo (ver benchmarks/compare.py).
+#
+# Exemplo (a partir da raiz do repositório):
+#   python -m benchmarks.run --requests 200 --concurrency 16 --llm-latency-ms 800
+#
+# Sem LibreOffice (soffice) no PATH, a geração é pedida em DOCX (sem conversão para PDF).
+
+import argparse
+import asyncio
+import datetime
+import json
+import math
+import os
+import platform
+import re
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from typing import Any, Dict, List, Tuple
+
+import httpx
+
+from benchmarks.fixtures import build_corpus, build_policy_index
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(REPO_ROOT, "benchmarks", "results")
+SERVICE_STARTUP_TIMEOUT = 120.0
+STATUS_WAIT_SECONDS = 30
+
+
+# --- Serviços locais ---
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class Service:
+    def __init__(self, name: str, app: str, workdir: str, env: Dict[str, str], workers: int = 1):
+        self.name = name
+        self.port = free_port()
+        self.url = f"http://127.0.0.1:{self.port}"
+        self.log_path = os.path.join(workdir, f"{name}.log")
+        command = [sys.executable, "-m", "uvicorn", app, "--host", "127.0.0.1", "--port", str(self.port),
+                   "--log-level", "warning", "--workers", str(workers)]
+        self._log = open(self.log_path, "wb")
+        self.process = subprocess.Popen(command, cwd=workdir, env=env, stdout=self._log, stderr=subprocess.STDOUT)
+
+    def wait_ready(self, path: str = "/"):
+        deadline = time.monotonic() + SERVICE_STARTUP_TIMEOUT
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"O serviço '{self.name}' terminou no arranque (ver {self.log_path}).")
+            try:
+                if httpx.get(self.url + path, timeout=1.0).status_code == 200:
+                    return
+            except httpx.HTTPError:
+                pass
+            time.sleep(0.2)
+        raise RuntimeError(f"O serviço '{self.name}' não ficou pronto em {SERVICE_STARTUP_TIMEOUT}s (ver {self.log_path}).")
+
+    def stop(self):
+        if self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+        self._log.close()
+
+
+def start_services(args, workdir: str) -> Dict[str, Service]:
+    base_env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [REPO_ROOT, os.environ.get("PYTHONPATH")])))
+    services = {}
+    try:
+        services["gemini"] = Service("gemini_stub", "gemini_stub:app", workdir, dict(
+            base_env, STUB_LATENCY_MS=str(args.llm_latency_ms), STUB_LATENCY_JITTER=str(args.llm_jitter),
+            STUB_LATENCY_PER_FIELD_MS=str(args.llm_per_field_ms),
+            STUB_ERROR_RATE=str(args.llm_error_rate), STUB_RATE_LIMIT_RATE=str(args.llm_rate_limit_rate)
+        ))
+        services["embeddings"] = Service("embedding_stub", "benchmarks.embedding_stub:app", workdir, base_env)
+        services["generator"] = Service("generator", "generator_service:app", workdir, base_env)
+        services["retrieval"] = Service("retrieval", "retrieval_service:app", workdir, dict(
+            base_env, EMBEDDING_SERVICE_URL=services["embeddings"].url
+        ))
+        for service in services.values():
+            service.wait_ready("/health/ready" if service.name == "retrieval" else "/")
+        services["api"] = Service("api", "main:app", workdir, dict(
+            base_env,
+            GEMINI_API_URL=f"{services['gemini'].url}/v1beta/models/gemini-stub:generateContent",
+            RETRIEVAL_SERVICE_URL=services["retrieval"].url,
+            GENERATOR_SERVICE_URL=services["generator"].url,
+            GENERATOR_PUBLIC_URL=services["generator"].url,
+            MAX_CONCURRENT_JOBS=str(args.max_concurrent_jobs),
+            EXTRACTION_MODE=args.extraction_mode,
+            SCHEDULER_MAX_QUEUE=str(max(args.requests, 1000)),
+            # A quota real não se aplica ao stub: o limitador não deve ser o gargalo medido.
+            LLM_REQUESTS_PER_MINUTE="1000000", LLM_TOKENS_PER_MINUTE="1000000000",
+            LLM_BACKOFF_BASE="0.1", LLM_BACKOFF_MAX="1",
+        ), workers=args.api_workers)
+        services["api"].wait_ready("/health/ready")
+    except BaseException:
+        for service in services.values():
+            service.stop()
+        raise
+    return services
+
+
+# --- Carga ---
+
+def unique_pdf(pdf_bytes: bytes, nonce: int) -> bytes:
+    # Um comentário depois do %%EOF muda o hash do ficheiro sem o invalidar: sem acertos no cache de resultados.
+    return pdf_bytes + f"\n%benchmark-{nonce}\n".encode("ascii")
+
+
+async def run_one(client: httpx.AsyncClient, index: int, name: str, pdf_bytes: bytes, args) -> Dict[str, Any]:
+    timings: Dict[str, float] = {}
+    record: Dict[str, Any] = {"index": index, "file": name, "status": "ok", "timings": timings}
+    started = time.perf_counter()
+    body = pdf_bytes if args.cache_hits else unique_pdf(pdf_bytes, index)
+
+    while True:
+        t0 = time.perf_counter()
+        response = await client.post(
+            "/api/v1/analysis",
+            files={"file": (name, body, "application/pdf")},
+            data={"assistant_type": "analise_sumula", "form_type": args.form_type},
+        )
+        if response.status_code != 429:
+            break
+        # Admissão recusada: espera o Retry-After, como um cliente bem-comportado.
+        record["rejected"] = record.get("rejected", 0) + 1
+        await asyncio.sleep(float(response.headers.get("retry-after", "1")))
+    timings["upload"] = time.perf_counter() - t0
+    if response.status_code != 202:
+        record.update(status="upload_failed", error=f"HTTP {response.status_code}: {response.text[:200]}")
+        return record
+    job_id = response.json()["job_id"]
+
+    t0 = time.perf_counter()
+    while True:
+        response = await client.get(f"/api/v1/analysis/{job_id}/status", params={"wait": STATUS_WAIT_SECONDS})
+        job = response.json()
+        if response.status_code != 200 or job["status"] in ("ready", "failed"):
+            break
+    timings["analysis"] = time.perf_counter() - t0
+    if job.get("status") != "ready":
+        record.update(status="analysis_failed", error=str(job.get("data") or job)[:200])
+        return record
+
+    if args.generate_output != "none":
+        data = dict(job["data"])
+        rag_context = data.pop("rag_context", None)
+        t0 = time.perf_counter()
+        response = await client.post("/api/v1/generate", json={
+            "job_id": job_id, "form_data": data, "original_data": data,
+            "rag_context": rag_context, "output": args.generate_output,
+        })
+        await response.aread()
+        timings["generate"] = time.perf_counter() - t0
+        if response.status_code != 200:
+            record.update(status="generate_failed", error=f"HTTP {response.status_code}: {response.text[:200]}")
+            return record
+
+    timings["end_to_end"] = time.perf_counter() - started
+    return record
+
+
+async def run_load(api_url: str, corpus: List[Tuple[str, bytes]], args) -> Tuple[List[Dict[str, Any]], float]:
+    queue: asyncio.Queue = asyncio.Queue()
+    for index in range(args.requests):
+        queue.put_nowait(index)
+    records = []
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    timeout = httpx.Timeout(STATUS_WAIT_SECONDS + 60.0)
+
+    async with httpx.AsyncClient(base_url=api_url, limits=limits, timeout=timeout) as client:
+        async def worker():
+            while not queue.empty():
+                index = queue.get_nowait()
+                name, pdf_bytes = corpus[index % len(corpus)]
+                try:
+                    records.append(await run_one(client, index, name, pdf_bytes, args))
+                except httpx.HTTPError as e:
+                    records.append({"index": index, "file": name, "status": "error", "error": repr(e), "timings": {}})
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+        return records, time.perf_counter() - started
+
+
+# --- Estatísticas ---
+
+def percentiles(samples: List[float]) -> Dict[str, float]:
+    if not samples:
+        return {"count": 0}
+    ordered = sorted(samples)
+
+    def pick(fraction: float) -> float:
+        # Método "nearest rank"
+        return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+    return {
+        "count": len(ordered),
+        "mean": round(sum(ordered) / len(ordered), 4),
+        "p50": round(pick(0.50), 4),
+        "p95": round(pick(0.95), 4),
+        "p99": round(pick(0.99), 4),
+        "max": round(ordered[-1], 4),
+    }
+
+
+_SAMPLE_LINE = re.compile(r'^(\w+)_bucket\{(.*)\} (\S+)$')
+
+
+def scrape_histograms(url: str) -> Dict[Tuple[str, str], Dict[float, float]]:
+    """
+    Lê os histogramas de /metrics: (métrica, etiquetas sem 'le') -> {limite: contagem acumulada}.
+    """
+    histograms: Dict[Tuple[str, str], Dict[float, float]] = defaultdict(dict)
+    try:
+        text = httpx.get(url + "/metrics", timeout=10.0).text
+    except httpx.HTTPError:
+        return histograms
+    for line in text.splitlines():
+        match = _SAMPLE_LINE.match(line)
+        if not match:
+            continue
+        labels = dict(re.findall(r'(\w+)="((?:[^"\\]|\\.)*)"', match.group(2)))
+        bound = labels.pop("le")
+        key = ",".join(f"{name}={value}" for name, value in sorted(labels.items()))
+        histograms[(match.group(1), key)][float("inf") if bound == "+Inf" else float(bound)] = float(match.group(3))
+    return histograms
+
+
+def histogram_quantile(buckets: Dict[float, float], fraction: float) -> float | None:
+    """
+    Quantil estimado por interpolação linear dentro do bucket (como o histogram_quantile do Prometheus).
+    """
+    bounds = sorted(buckets)
+    total = buckets[bounds[-1]] if bounds else 0
+    if total <= 0:
+        return None
+    rank = fraction * total
+    previous_bound, previous_count = 0.0, 0.0
+    for bound in bounds:
+        count = buckets[bound]
+        if count >= rank:
+            if math.isinf(bound):
+                return previous_bound
+            if count == previous_count:
+                return bound
+            return previous_bound + (bound - previous_bound) * (rank - previous_count) / (count - previous_count)
+        previous_bound, previous_count = bound, count
+    return previous_bound
+
+
+def server_stages(before, after) -> Dict[str, Dict[str, Any]]:
+    """
+    Percentis de cada etapa interna durante a execução (diferença entre as duas recolhas).
+    """
+    report = {}
+    for (metric, labels), buckets in sorted(after.items()):
+        previous = before.get((metric, labels), {})
+        delta = {bound: count - previous.get(bound, 0.0) for bound, count in buckets.items()}
+        count = delta.get(float("inf"), 0.0)
+        if count <= 0:
+            continue
+        name = labels.split("=", 1)[1] if metric.endswith("_stage_seconds") else f"{metric}[{labels}]"
+        report[name] = {
+            "count": int(count),
+            **{key: round(value, 4) for key, value in (
+                ("p50", histogram_quantile(delta, 0.50)),
+                ("p95", histogram_quantile(delta, 0.95)),
+                ("p99", histogram_quantile(delta, 0.99)),
+            ) if value is not None},
+        }
+    return report
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+# --- Execução ---
+
+def prepare_workdir(args) -> Tuple[str, List[Tuple[str, bytes]]]:
+    workdir = tempfile.mkdtemp(prefix="monsterfactory-bench-")
+    # Os serviços usam caminhos relativos (templates/, output/, vector_store/, *.db) a partir da pasta de trabalho.
+    os.symlink(os.path.join(REPO_ROOT, "templates"), os.path.join(workdir, "templates"))
+    build_policy_index(os.path.join(workdir, "vector_store"))
+    page_counts = [int(value) for value in args.pages.split(",")]
+    paths = build_corpus(os.path.join(workdir, "corpus"), page_counts, per_size=args.per_size)
+    corpus = []
+    for path in paths:
+        with open(path, "rb") as f:
+            corpus.append((os.path.basename(path), f.read()))
+    return workdir, corpus
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de ponta a ponta da Monster Factory (offline).")
+    parser.add_argument("--requests", type=int, default=100, help="Nº total de pedidos (análise + geração).")
+    parser.add_argument("--concurrency", type=int, default=8, help="Nº de clientes em simultâneo.")
+    parser.add_argument("--pages", default="1,5,20,80", help="Tamanhos (nº de páginas) das decisões geradas.")
+    parser.add_argument("--per-size", type=int, default=2, help="Nº de PDFs diferentes por tamanho.")
+    parser.add_argument("--form-type", default="autodispensa", choices=["autodispensa", "dispensa", "autorizacao"])
+    parser.add_argument("--generate-output", default=None, choices=["links", "docx", "pdf", "zip", "none"],
+                        help="Saída pedida ao /api/v1/generate (padrão: 'links' com soffice, 'docx' sem).")
+    parser.add_argument("--llm-latency-ms", type=float, default=500, help="Latência média do stub do Gemini.")
+    parser.add_argument("--llm-per-field-ms", type=float, default=0,
+                        help="Latência adicional do stub por campo pedido (simula respostas mais longas).")
+    parser.add_argument("--llm-jitter", type=float, default=0.3, help="Variação da latência do stub (fração).")
+    parser.add_argument("--llm-error-rate", type=float, default=0.0, help="Fração de respostas 503 do stub.")
+    parser.add_argument("--llm-rate-limit-rate", type=float, default=0.0, help="Fração de respostas 429 do stub.")
+    parser.add_argument("--max-concurrent-jobs", type=int, default=4, help="MAX_CONCURRENT_JOBS da API.")
+    parser.add_argument("--extraction-mode", default="single", choices=["sharded", "single"],
+                        help="EXTRACTION_MODE da API (campos em paralelo ou numa só chamada).")
+    parser.add_argument("--api-workers", type=int, default=1, help="Nº de workers uvicorn da API.")
+    parser.add_argument("--cache-hits", action="store_true", help="Reenvia os mesmos PDFs (mede o cache de resultados).")
+    parser.add_argument("--label", default="", help="Etiqueta guardada no resultado (ex: nome do ramo).")
+    parser.add_argument("--output", default=None, help="Ficheiro JSON do resultado (padrão: benchmarks/results/).")
+    parser.add_argument("--keep-workdir", action="store_true", help="Não apaga a pasta de trabalho (logs dos serviços).")
+    args = parser.parse_args()
+    if args.generate_output is None:
+        args.generate_output = "links" if shutil.which("soffice") else "docx"
+
+    workdir, corpus = prepare_workdir(args)
+    print(f"Pasta de trabalho: {workdir} ({len(corpus)} PDFs)")
+    services = start_services(args, workdir)
+    try:
+        before = {name: scrape_histograms(services[name].url) for name in ("api", "retrieval", "generator")}
+        print(f"A executar {args.requests} pedidos com {args.concurrency} clientes em simultâneo...")
+        records, elapsed = asyncio.run(run_load(services["api"].url, corpus, args))
+        after = {name: scrape_histograms(services[name].url) for name in ("api", "retrieval", "generator")}
+    finally:
+        for service in services.values():
+            service.stop()
+
+    client_stages: Dict[str, List[float]] = defaultdict(list)
+    by_size: Dict[str, List[float]] = defaultdict(list)
+    errors: Dict[str, int] = defaultdict(int)
+    for record in records:
+        if record["status"] != "ok":
+            errors[record["status"]] += 1
+            continue
+        for stage, seconds in record["timings"].items():
+            client_stages[stage].append(seconds)
+        by_size[record["file"].split("_")[1]].append(record["timings"]["end_to_end"])
+
+    completed = sum(1 for record in records if record["status"] == "ok")
+    result = {
+        "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+        "label": args.label,
+        "git_commit": git_commit(),
+        "environment": {"python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count()},
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "keep_workdir")},
+        "summary": {
+            "requests": len(records),
+            "completed": completed,
+            "errors": dict(errors),
+            "rejected_429": sum(record.get("rejected", 0) for record in records),
+            "elapsed_seconds": round(elapsed, 3),
+            "throughput_per_second": round(completed / elapsed, 3) if elapsed > 0 else 0.0,
+        },
+        "client_stages": {stage: percentiles(samples) for stage, samples in client_stages.items()},
+        "end_to_end_by_size": {size: percentiles(samples) for size, samples in sorted(by_size.items())},
+        "server_stages": {name: server_stages(before[name], after[name]) for name in before},
+    }
+
+    output = args.output or os.path.join(RESULTS_DIR, f"{datetime.datetime.now():%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+
+    summary = result["summary"]
+    print(f"Concluídos: {summary['completed']}/{summary['requests']} em {summary['elapsed_seconds']}s "
+          f"({summary['throughput_per_second']} pedidos/s); erros: {summary['errors'] or 'nenhum'}")
+    for stage, stats in result["client_stages"].items():
+        print(f"  {stage:<12} p50={stats['p50']:.3f}s p95={stats['p95']:.3f}s p99={stats['p99']:.3f}s")
+    print(f"Resultado gravado em {output}")
+
+    if args.keep_workdir:
+        print(f"Logs dos serviços em {workdir}")
+    else:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,52 +1,223 @@
+# create_vector_store.py
+# Ingestão das políticas (manuais e anexos em PDF) para a base vetorial nativa (vector_index.py).
+#
+# Uso:
+#   python create_vector_store.py                        -> ingere o "Política Recursal.pdf"
+#   python create_vector_store.py politicas/ anexo.pdf   -> ingere todos os PDFs das pastas (recursivo) e ficheiros indicados
+#   python create_vector_store.py politicas/ --full      -> ignora a base existente e recalcula tudo
+#
+# A reindexação é incremental:
+#   - PDFs cujo hash não mudou reaproveitam os chunks já existentes (não são lidos de novo);
+#   - os restantes são extraídos página a página num pool de processos;
+#   - só os chunks com texto novo são enviados ao modelo de embeddings (em batches grandes);
+#     os vetores dos outros são recuperados do índice atual.
+
+import argparse
+import hashlib
 import os
-import pickle
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, Tuple
+
 import fitz  # PyMuPDF
-from langchain.docstore.document import Document
+import numpy as np
 from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_community.embeddings import HuggingFaceEmbeddings
-from langchain_community.vectorstores import FAISS
+
+from vector_index import MANIFEST_FILE, VectorIndex, write_index
 
 # --- Configurações ---
 POLICY_DOC_PATH = "Política Recursal.pdf"
-VECTOR_STORE_PATH = "vector_store.pkl"
+VECTOR_STORE_DIR = "vector_store"
 EMBEDDING_MODEL = "rufimelo/Legal-BERTimbau-sts-large"
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 100
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "64"))
+# Nº de páginas extraídas por cada tarefa do pool de processos
+PAGES_PER_TASK = 8
+# Títulos numerados da política (ex: "13.1.3 Anexo I – Hipóteses de Autodispensa...")
+SECTION_HEADING = re.compile(r"^[ \t]*(\d+(?:\.\d+)+\.?[ \t]+\S.*)$", re.MULTILINE)
+
+Chunks = List[Tuple[str, Dict[str, Any]]]
+
+
+def find_pdfs(paths: List[str]) -> List[Tuple[str, str]]:
+    """
+    Lista (nome da fonte, caminho) dos PDFs indicados. Nas pastas, o nome é o caminho relativo à pasta.
+    """
+    pdfs = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for file_name in sorted(files):
+                    if file_name.lower().endswith(".pdf"):
+                        file_path = os.path.join(root, file_name)
+                        pdfs.append((os.path.relpath(file_path, path), file_path))
+        elif os.path.isfile(path):
+            pdfs.append((os.path.basename(path), path))
+        else:
+            raise FileNotFoundError(f"Ficheiro ou pasta '{path}' não encontrado.")
+    return pdfs
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def extract_pages(path: str, start: int, end: int) -> List[Tuple[int, str]]:
+    """
+    Extrai o texto das páginas [start, end) de um PDF (executado nos processos do pool).
+    """
+    with fitz.open(path) as doc:
+        return [(number + 1, doc[number].get_text()) for number in range(start, end)]
+
+
+def extract_documents(pdfs: List[Tuple[str, str]], workers: int | None) -> Dict[str, List[Tuple[int, str]]]:
+    pages: Dict[str, List[Tuple[int, str]]] = {source: [] for source, _ in pdfs}
+    if not pdfs:
+        return pages
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        tasks = []
+        for source, path in pdfs:
+            with fitz.open(path) as doc:
+                page_count = len(doc)
+            for start in range(0, page_count, PAGES_PER_TASK):
+                tasks.append((source, pool.submit(extract_pages, path, start, min(start + PAGES_PER_TASK, page_count))))
+        for source, task in tasks:
+            pages[source].extend(task.result())
+    return pages
+
 
-def create_and_save_vector_store():
+def chunk_document(source: str, pages: List[Tuple[int, str]], splitter: RecursiveCharacterTextSplitter) -> Chunks:
     """
-    Lê o PDF da política, cria os embeddings e salva a base de vetores em um ficheiro .pkl.
+    Divide o documento em chunks página a página, com a página e a secção (último título numerado) em metadados.
     """
-    print(f"A ler o documento: {POLICY_DOC_PATH}")
-    if not os.path.exists(POLICY_DOC_PATH):
-        print(f"ERRO: Ficheiro '{POLICY_DOC_PATH}' não encontrado.")
-        return
+    chunks = []
+    section = ""
+    for page_number, text in pages:
+        if not text.strip():
+            continue
+        headings = [(match.start(), match.group(1).strip()) for match in SECTION_HEADING.finditer(text)]
+        position = 0
+        for piece in splitter.split_text(text):
+            start = text.find(piece, position)
+            if start < 0:
+                start = position
+            position = start + 1
+            while headings and headings[0][0] <= start:
+                section = headings.pop(0)[1]
+            chunks.append((piece, {"source": source, "page": page_number, "section": section}))
+        if headings:
+            section = headings[-1][1]
+    return chunks
+
+
+def load_previous(directory: str, model_name: str) -> VectorIndex | None:
+    if not os.path.exists(os.path.join(directory, MANIFEST_FILE)):
+        return None
+    try:
+        previous = VectorIndex.load(directory)
+    except Exception as e:
+        print(f"AVISO: base vetorial existente ignorada ({e}).")
+        return None
+    if previous.model_name != model_name:
+        print(f"O modelo mudou ({previous.model_name} -> {model_name}): todos os chunks serão recalculados.")
+        return None
+    return previous
+
+
+def embed_texts(texts: List[str], model_name: str) -> np.ndarray:
+    from sentence_transformers import SentenceTransformer
 
-    # Extrai o texto do PDF
-    with fitz.open(POLICY_DOC_PATH) as doc:
-        policy_text = "".join(page.get_text() for page in doc)
-    
-    docs = [Document(page_content=policy_text)]
+    print(f"A carregar o modelo de embeddings: {model_name}...")
+    model = SentenceTransformer(model_name)
+    return model.encode(texts, batch_size=EMBED_BATCH_SIZE, convert_to_numpy=True, show_progress_bar=True).astype("float32")
 
-    # Divide o texto em pedaços (chunks)
-    print("A dividir o texto em chunks...")
-    text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=100)
-    chunks = text_splitter.split_documents(docs)
+
+def create_and_save_vector_store(paths: List[str] = None, directory: str = VECTOR_STORE_DIR,
+                                 model_name: str = EMBEDDING_MODEL, workers: int | None = None, full: bool = False):
+    """
+    Lê os PDFs das políticas, calcula os embeddings dos chunks novos e atualiza a base vetorial nativa.
+    """
+    started = time.perf_counter()
+    pdfs = find_pdfs(paths or [POLICY_DOC_PATH])
+    if not pdfs:
+        print("ERRO: nenhum PDF encontrado.")
+        return None
+    previous = None if full else load_previous(directory, model_name)
+    previous_sources = previous.manifest.get("sources", {}) if previous else {}
+
+    # 1. Só os PDFs novos ou alterados são lidos; os outros reaproveitam os chunks da base atual.
+    sources = {source: file_sha256(path) for source, path in pdfs}
+    changed = [(source, path) for source, path in pdfs if previous_sources.get(source) != sources[source]]
+    reused: Dict[str, Chunks] = {}
+    if previous is not None:
+        for i in range(len(previous)):
+            metadata = previous.metadatas[i]
+            source = metadata.get("source")
+            if source in sources and previous_sources.get(source) == sources[source]:
+                reused.setdefault(source, []).append((previous.get_text(i), metadata))
+
+    print(f"{len(pdfs)} PDFs, {len(changed)} novos ou alterados. A extrair as páginas...")
+    pages = extract_documents(changed, workers)
+    splitter = RecursiveCharacterTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
+    chunks: Chunks = []
+    for source, _ in pdfs:
+        chunks.extend(reused.get(source) or chunk_document(source, pages.get(source, []), splitter))
     print(f"Texto dividido em {len(chunks)} chunks.")
+    if not chunks:
+        print("ERRO: nenhum texto extraído dos PDFs.")
+        return None
+
+    # 2. Só os chunks com texto novo são enviados ao modelo; os outros reaproveitam o vetor atual.
+    texts = [text for text, _ in chunks]
+    known: Dict[str, np.ndarray] = {}
+    if previous is not None:
+        previous_vectors = previous.get_vectors()
+        for i in range(len(previous)):
+            known.setdefault(text_hash(previous.get_text(i)), previous_vectors[i])
+    hashes = [text_hash(text) for text in texts]
+    missing, pending = [], set()
+    for i, h in enumerate(hashes):
+        if h not in known and h not in pending:
+            pending.add(h)
+            missing.append(i)
+
+    if previous is not None and not missing and len(texts) == len(previous) \
+            and all(previous.get_text(i) == text for i, text in enumerate(texts)) \
+            and previous_sources == sources:
+        print(f"✅ Sem alterações: a base vetorial (versão {previous.version}) já está atualizada.")
+        return previous.manifest
 
-    # Carrega o modelo de embeddings (pode demorar um pouco na primeira vez)
-    print(f"A carregar o modelo de embeddings: {EMBEDDING_MODEL}...")
-    embeddings = HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL)
-    print("Modelo carregado.")
+    print(f"{len(texts) - len(missing)} chunks reaproveitados, {len(missing)} a calcular.")
+    if missing:
+        for i, vector in zip(missing, embed_texts([texts[i] for i in missing], model_name)):
+            known[hashes[i]] = vector
+    vectors = np.vstack([known[h] for h in hashes])
 
-    # Cria a base de vetores FAISS
-    print("A criar a base de dados vetorial (FAISS)...")
-    vector_store = FAISS.from_documents(chunks, embedding=embeddings)
-    print("Base de dados criada com sucesso.")
+    # 3. Grava a nova versão (substituição atómica, manifest por último).
+    manifest = write_index(directory, vectors, texts, [metadata for _, metadata in chunks], model_name,
+                           extra={"sources": sources})
+    print(f"✅ Base de dados vetorial (versão {manifest['version']}) salva em {directory}/ "
+          f"em {time.perf_counter() - started:.1f}s.")
+    return manifest
 
-    # Salva a base de vetores no ficheiro
-    with open(VECTOR_STORE_PATH, "wb") as f:
-        pickle.dump(vector_store, f)
-    
-    print(f"✅ Base de dados vetorial salva com sucesso em: {VECTOR_STORE_PATH}")
 
 if __name__ == "__main__":
-    create_and_save_vector_store()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Ingere os PDFs das políticas na base vetorial.")
+    parser.add_argument("paths", nargs="*", default=[POLICY_DOC_PATH], help="PDFs ou pastas com PDFs.")
+    parser.add_argument("--output", default=VECTOR_STORE_DIR, help="Pasta da base vetorial.")
+    parser.add_argument("--model", default=EMBEDDING_MODEL, help="Modelo de embeddings (sentence-transformers).")
+    parser.add_argument("--workers", type=int, default=None, help="Nº de processos para a extração das páginas.")
+    parser.add_argument("--full", action="store_true", help="Ignora a base existente e recalcula todos os embeddings.")
+    args = parser.parse_args()
+    create_and_save_vector_store(args.paths, args.output, args.model, args.workers, args.full)
@@ -0,0 +1,257 @@
+# embedding_service.py
+# Serviço de embeddings de consultas com micro-batching e cache LRU.
+#
+# Pode ser usado de duas formas:
+#   1. Dentro do processo da API (padrão): uma única instância do modelo por processo; pedidos
+#      concorrentes são agrupados num só forward pass.
+#   2. Como sidecar partilhado: `uvicorn embedding_service:app --port 8003` e, na API,
+#      EMBEDDING_SERVICE_URL=http://embeddings:8003.
+#
+# Configuração via variáveis de ambiente:
+#   EMBEDDING_MODEL        -> modelo sentence-transformers (na API, o padrão é o do manifest da base vetorial)
+#   EMBEDDING_MAX_BATCH    -> tamanho máximo de cada batch
+#   EMBEDDING_MAX_WAIT_MS  -> tempo máximo que um pedido espera por companhia antes do forward pass
+#   EMBEDDING_CACHE_SIZE   -> nº de embeddings de consulta guardados na cache LRU
+#   EMBEDDING_SERVICE_URL  -> se definido, a API usa o sidecar em vez de carregar o modelo
+
+import asyncio
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+
+import httpx
+from fastapi import FastAPI
+from pydantic import BaseModel
+
+import metrics
+
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "rufimelo/Legal-BERTimbau-sts-large")
+EMBEDDING_MAX_BATCH = int(os.getenv("EMBEDDING_MAX_BATCH", "32"))
+EMBEDDING_MAX_WAIT_MS = float(os.getenv("EMBEDDING_MAX_WAIT_MS", "10"))
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", "2048"))
+EMBEDDING_SERVICE_URL = os.getenv("EMBEDDING_SERVICE_URL", "")
+
+
+class _LRUCache:
+    """
+    Cache LRU de embeddings, indexada pelo hash do texto da consulta.
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._data: OrderedDict[str, List[float]] = OrderedDict()
+        # Partilhada pela thread do modelo (batches) e pelos chamadores de embed_sync noutras threads
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(text: str) -> str:
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> List[float] | None:
+        with self._lock:
+            vector = self._data.get(key)
+            if vector is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._data.move_to_end(key)
+            return vector
+
+    def put(self, key: str, vector: List[float]):
+        with self._lock:
+            self._data[key] = vector
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+
+class QueryEmbedder:
+    """
+    Embeddings de consultas com um único modelo por processo.
+    Os pedidos concorrentes são agrupados em batches (até `max_batch_size` textos ou `max_wait_ms`).
+    """
+
+    def __init__(self, model_name: str = EMBEDDING_MODEL, max_batch_size: int = EMBEDDING_MAX_BATCH,
+                 max_wait_ms: float = EMBEDDING_MAX_WAIT_MS, cache_size: int = EMBEDDING_CACHE_SIZE):
+        self.model_name = model_name
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.cache = _LRUCache(cache_size)
+        self.model = None
+        # Uma única thread: o modelo faz um forward pass de cada vez.
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="embedding")
+        self._queue: asyncio.Queue | None = None
+        self._worker: asyncio.Task | None = None
+        self.batches = 0
+
+    def _load_model(self):
+        from sentence_transformers import SentenceTransformer
+        self.model = SentenceTransformer(self.model_name)
+
+    def _encode(self, texts: List[str]) -> List[List[float]]:
+        with metrics.stage("embedding_model"):
+            return self.model.encode(texts, batch_size=len(texts), convert_to_numpy=True).tolist()
+
+    async def start(self):
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self._executor, self._load_model)
+        self._queue = asyncio.Queue()
+        self._worker = asyncio.create_task(self._batch_loop())
+
+    async def close(self):
+        if self._worker is not None:
+            self._worker.cancel()
+            self._worker = None
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    async def embed(self, text: str) -> List[float]:
+        key = self.cache.key(text)
+        vector = self.cache.get(key)
+        if vector is not None:
+            return vector
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((key, text, future))
+        return await future
+
+    def embed_sync(self, text: str) -> List[float]:
+        """
+        Versão síncrona (sem batching) para código que corre fora do event loop.
+        Também passa pela thread do modelo, para nunca correr ao mesmo tempo que um batch.
+        """
+        key = self.cache.key(text)
+        vector = self.cache.get(key)
+        if vector is None:
+            vector = self._executor.submit(self._encode, [text]).result()[0]
+            self.cache.put(key, vector)
+        return vector
+
+    async def _batch_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout=remaining))
+                except asyncio.TimeoutError:
+                    break
+
+            # Textos repetidos dentro do mesmo batch são calculados uma só vez.
+            pending = {}
+            for key, text, future in batch:
+                pending.setdefault(key, (text, []))[1].append(future)
+            keys = list(pending)
+            try:
+                vectors = await loop.run_in_executor(self._executor, self._encode, [pending[k][0] for k in keys])
+            except Exception as e:
+                for key in keys:
+                    for future in pending[key][1]:
+                        if not future.done():
+                            future.set_exception(e)
+                continue
+            self.batches += 1
+            for key, vector in zip(keys, vectors):
+                self.cache.put(key, vector)
+                for future in pending[key][1]:
+                    if not future.done():
+                        future.set_result(vector)
+
+    def stats(self) -> dict:
+        return {
+            "model": self.model_name,
+            "batches": self.batches,
+            "cache_hits": self.cache.hits,
+            "cache_misses": self.cache.misses,
+        }
+
+
+class RemoteQueryEmbedder:
+    """
+    Cliente do sidecar de embeddings (mesma interface do QueryEmbedder), com cache LRU local.
+    """
+
+    def __init__(self, base_url: str = EMBEDDING_SERVICE_URL, cache_size: int = EMBEDDING_CACHE_SIZE):
+        self.base_url = base_url.rstrip("/")
+        self.cache = _LRUCache(cache_size)
+        self._client: httpx.AsyncClient | None = None
+
+    async def start(self):
+        self._client = httpx.AsyncClient(base_url=self.base_url, timeout=60.0)
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def embed(self, text: str) -> List[float]:
+        key = self.cache.key(text)
+        vector = self.cache.get(key)
+        if vector is None:
+            response = await self._client.post("/embed", json={"texts": [text]})
+            response.raise_for_status()
+            vector = response.json()["embeddings"][0]
+            self.cache.put(key, vector)
+        return vector
+
+    def embed_sync(self, text: str) -> List[float]:
+        key = self.cache.key(text)
+        vector = self.cache.get(key)
+        if vector is None:
+            response = httpx.post(f"{self.base_url}/embed", json={"texts": [text]}, timeout=60.0)
+            response.raise_for_status()
+            vector = response.json()["embeddings"][0]
+            self.cache.put(key, vector)
+        return vector
+
+    def stats(self) -> dict:
+        return {"service_url": self.base_url, "cache_hits": self.cache.hits, "cache_misses": self.cache.misses}
+
+
+def create_query_embedder(model_name: str = EMBEDDING_MODEL):
+    """
+    Usa o sidecar se EMBEDDING_SERVICE_URL estiver definido; caso contrário, carrega o modelo neste processo.
+    """
+    if EMBEDDING_SERVICE_URL:
+        return RemoteQueryEmbedder(EMBEDDING_SERVICE_URL)
+    return QueryEmbedder(model_name)
+
+
+# --- Sidecar HTTP ---
+app = FastAPI(
+    title="Monster Factory - Embedding Service",
+    description="Serviço de embeddings de consultas com micro-batching e cache LRU.",
+    version="1.0.0"
+)
+
+sidecar_embedder: QueryEmbedder | None = None
+metrics.install(app)
+
+class EmbedRequest(BaseModel):
+    texts: List[str]
+
+@app.on_event("startup")
+async def startup_event():
+    global sidecar_embedder
+    sidecar_embedder = QueryEmbedder()
+    await sidecar_embedder.start()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await sidecar_embedder.close()
+
+@app.get("/")
+def read_root():
+    return {"message": "Serviço de Embeddings está ativo.", **sidecar_embedder.stats()}
+
+@app.post("/embed")
+async def embed(request: EmbedRequest):
+    embeddings = await asyncio.gather(*[sidecar_embedder.embed(text) for text in request.texts])
+    return {"embeddings": embeddings}
@@ -0,0 +1,78 @@
+# execution_engine.py
+# Motor de execução dos assistentes: tira o trabalho pesado do event loop do uvicorn.
+#
+# - Etapas CPU-bound (ex: extração de texto do PDF) correm num pool de processos.
+# - Etapas bloqueantes que libertam o GIL (ex: FAISS, embeddings) correm num pool de threads.
+# - As chamadas ao LLM usam um cliente partilhado (llm_client.py: pool HTTP/2, limites de quota, retries).
+# - O número de jobs em simultâneo por worker é controlado pelo escalonador (scheduler.py).
+#
+# Configuração via variáveis de ambiente:
+#   ANALYSIS_PROCESS_WORKERS  -> nº de processos para etapas CPU-bound (0 = usar threads)
+#   ANALYSIS_THREAD_WORKERS   -> nº de threads para etapas bloqueantes
+#   (configuração do cliente do LLM: ver llm_client.py)
+
+import asyncio
+import functools
+import multiprocessing
+import os
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable
+
+from llm_client import LLMClient
+
+PROCESS_WORKERS = int(os.getenv("ANALYSIS_PROCESS_WORKERS", str(min(os.cpu_count() or 1, 4))))
+THREAD_WORKERS = int(os.getenv("ANALYSIS_THREAD_WORKERS", "8"))
+
+
+class ExecutionEngine:
+    """
+    Agrupa os executores e o cliente do LLM usados pelas análises.
+    Deve ser iniciado no startup da aplicação e encerrado no shutdown.
+    """
+
+    def __init__(
+        self,
+        process_workers: int = PROCESS_WORKERS,
+        thread_workers: int = THREAD_WORKERS,
+    ):
+        self.process_workers = process_workers
+        self.thread_workers = thread_workers
+        self._process_pool: Executor | None = None
+        self._thread_pool: Executor | None = None
+        self.llm = LLMClient()
+
+    def start(self):
+        self._thread_pool = ThreadPoolExecutor(max_workers=self.thread_workers, thread_name_prefix="analysis")
+        if self.process_workers > 0:
+            # 'spawn' evita herdar threads do FAISS/torch do processo pai (fork não é seguro aqui).
+            self._process_pool = ProcessPoolExecutor(
+                max_workers=self.process_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        else:
+            self._process_pool = self._thread_pool
+        self.llm.start()
+
+    async def shutdown(self):
+        await self.llm.close()
+        if self._process_pool is not None and self._process_pool is not self._thread_pool:
+            self._process_pool.shutdown(wait=False, cancel_futures=True)
+        if self._thread_pool is not None:
+            self._thread_pool.shutdown(wait=False, cancel_futures=True)
+        self._process_pool = None
+        self._thread_pool = None
+
+    async def run_cpu(self, func: Callable[..., Any], *args, **kwargs) -> Any:
+        """
+        Executa uma função CPU-bound no pool de processos.
+        A função e os argumentos têm de ser serializáveis (funções de módulo, bytes, str...).
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._process_pool, functools.partial(func, *args, **kwargs))
+
+    async def run_io(self, func: Callable[..., Any], *args, **kwargs) -> Any:
+        """
+        Executa uma função bloqueante no pool de threads.
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._thread_pool, functools.partial(func, *args, **kwargs))
@@ -0,0 +1,229 @@
+# feedback_writer.py
+# Escrita do feedback (correções humanas) na base de dados SQLite, fora do caminho do pedido.
+#
+# - Os pedidos apenas colocam o feedback numa fila em memória; uma única tarefa escritora
+#   agrupa os registos e grava-os em lote, numa só transação, numa thread dedicada.
+# - A base de dados usa WAL e índices em form_type/timestamp.
+# - O rag_context é guardado uma única vez por conteúdo (tabela rag_contexts, indexada pelo hash)
+#   e, da resposta corrigida, guarda-se apenas a diferença campo a campo face à original.
+#
+# Este módulo só usa a biblioteca padrão: é partilhado com o serviço de treino (training_service.py).
+
+import asyncio
+import datetime
+import hashlib
+import json
+import os
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List
+
+import metrics
+
+FEEDBACK_BATCH_SIZE = int(os.getenv("FEEDBACK_BATCH_SIZE", "200"))
+# Tempo máximo que um registo espera por outros antes de o lote ser gravado
+FEEDBACK_FLUSH_MS = float(os.getenv("FEEDBACK_FLUSH_MS", "50"))
+FEEDBACK_QUEUE_SIZE = int(os.getenv("FEEDBACK_QUEUE_SIZE", "10000"))
+
+FEEDBACK_SCHEMA = """
+CREATE TABLE IF NOT EXISTS feedback (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    timestamp TEXT NOT NULL,
+    form_type TEXT NOT NULL,
+    rag_context TEXT,
+    original_response TEXT NOT NULL,
+    corrected_response TEXT,
+    rag_context_hash TEXT,
+    corrected_diff TEXT
+)
+"""
+
+
+def connect(db_file: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(db_file, timeout=30, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA busy_timeout=30000")
+    return conn
+
+
+def init_feedback_db(db_file: str):
+    """
+    Cria (ou migra) o esquema do feedback. Bases antigas, com rag_context e corrected_response
+    completos em cada linha, são reconstruídas mantendo os dados e os ids.
+    """
+    conn = connect(db_file)
+    # Transação explícita: o módulo sqlite3 não abre uma antes de DDL, e uma migração interrompida
+    # a meio (tabela renomeada mas dados por copiar) deixaria o feedback.db inutilizável.
+    conn.isolation_level = None
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Lido já dentro da transação: dois workers a arrancar não migram a mesma base em paralelo.
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(feedback)")}
+            if columns and "corrected_diff" not in columns:
+                # O SQLite não permite remover o NOT NULL de corrected_response com ALTER TABLE.
+                conn.execute("ALTER TABLE feedback RENAME TO feedback_legacy")
+                conn.execute(FEEDBACK_SCHEMA)
+                conn.execute(
+                    "INSERT INTO feedback (id, timestamp, form_type, rag_context, original_response, corrected_response) "
+                    "SELECT id, timestamp, form_type, rag_context, original_response, corrected_response FROM feedback_legacy"
+                )
+                conn.execute("DROP TABLE feedback_legacy")
+            else:
+                conn.execute(FEEDBACK_SCHEMA)
+            conn.execute("""
+            CREATE TABLE IF NOT EXISTS rag_contexts (
+                hash TEXT PRIMARY KEY,
+                content TEXT NOT NULL
+            )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_feedback_form_type ON feedback (form_type, id)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_feedback_timestamp ON feedback (timestamp)")
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+    finally:
+        conn.close()
+
+
+# --- Diferença campo a campo ---
+
+def diff_fields(original: Dict[str, Any], corrected: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "changed": {key: value for key, value in corrected.items() if key not in original or original[key] != value},
+        "removed": [key for key in original if key not in corrected],
+    }
+
+
+def apply_diff(original: Dict[str, Any], diff: Dict[str, Any]) -> Dict[str, Any]:
+    corrected = {key: value for key, value in original.items() if key not in diff.get("removed", [])}
+    corrected.update(diff.get("changed", {}))
+    return corrected
+
+
+def load_corrected_response(original_response: str, corrected_response: str | None, corrected_diff: str | None) -> Dict[str, Any]:
+    """
+    Reconstrói a resposta corrigida de uma linha do feedback (completa nas linhas antigas, diferença nas novas).
+    """
+    if corrected_response is not None:
+        return json.loads(corrected_response)
+    return apply_diff(json.loads(original_response), json.loads(corrected_diff))
+
+
+# --- Escritor em lote ---
+
+class FeedbackWriter:
+    def __init__(self, db_file: str, batch_size: int = FEEDBACK_BATCH_SIZE, flush_ms: float = FEEDBACK_FLUSH_MS,
+                 queue_size: int = FEEDBACK_QUEUE_SIZE):
+        self.db_file = db_file
+        self.batch_size = batch_size
+        self.flush_wait = flush_ms / 1000
+        self.queue_size = queue_size
+        self._queue: asyncio.Queue | None = None
+        self._worker: asyncio.Task | None = None
+        # Uma única thread (e uma única ligação) escreve na base de dados.
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="feedback-writer")
+        self._conn: sqlite3.Connection | None = None
+        self.written = 0
+        self.dropped = 0
+        self.batches = 0
+
+    async def start(self):
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self._executor, self._open)
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        self._worker = asyncio.create_task(self._write_loop())
+
+    def _open(self):
+        init_feedback_db(self.db_file)
+        self._conn = connect(self.db_file)
+
+    async def close(self):
+        """
+        Para a tarefa escritora depois de gravar o que ainda estiver na fila.
+        """
+        if self._worker is not None:
+            await self._queue.put(None)
+            await self._worker
+            self._worker = None
+        if self._conn is not None:
+            await asyncio.get_running_loop().run_in_executor(self._executor, self._conn.close)
+            self._conn = None
+        self._executor.shutdown(wait=True)
+
+    def submit(self, form_type: str, rag_context: str | None, original_data: Dict[str, Any], corrected_data: Dict[str, Any]) -> bool:
+        """
+        Coloca o feedback na fila sem esperar pelo disco. Retorna False se a fila estiver cheia.
+        """
+        record = (datetime.datetime.now().isoformat(), form_type, rag_context, original_data, corrected_data)
+        try:
+            self._queue.put_nowait(record)
+            return True
+        except asyncio.QueueFull:
+            self.dropped += 1
+            print(f"AVISO: fila de feedback cheia ({self.queue_size}); registo descartado.")
+            return False
+
+    async def _write_loop(self):
+        loop = asyncio.get_running_loop()
+        closing = False
+        while not closing:
+            record = await self._queue.get()
+            if record is None:
+                break
+            batch = [record]
+            deadline = loop.time() + self.flush_wait
+            while len(batch) < self.batch_size:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    record = await asyncio.wait_for(self._queue.get(), timeout=remaining)
+                except asyncio.TimeoutError:
+                    break
+                if record is None:
+                    # Pedido de paragem: grava o lote atual e termina.
+                    closing = True
+                    break
+                batch.append(record)
+            await self._flush(batch)
+
+    async def _flush(self, batch: List[tuple]):
+        try:
+            await asyncio.get_running_loop().run_in_executor(self._executor, self._write_batch, batch)
+            self.written += len(batch)
+            self.batches += 1
+        except Exception as e:
+            print(f"ERRO ao guardar feedback ({len(batch)} registos): {e}")
+
+    def _write_batch(self, batch: List[tuple]):
+        contexts = {}
+        rows = []
+        for timestamp, form_type, rag_context, original_data, corrected_data in batch:
+            context_hash = None
+            if rag_context is not None:
+                context_hash = hashlib.sha256(rag_context.encode("utf-8")).hexdigest()
+                contexts[context_hash] = rag_context
+            rows.append((
+                timestamp,
+                form_type,
+                context_hash,
+                json.dumps(original_data, ensure_ascii=False),
+                json.dumps(diff_fields(original_data, corrected_data), ensure_ascii=False),
+            ))
+        with metrics.stage("feedback_insert"), self._conn:
+            self._conn.executemany("INSERT OR IGNORE INTO rag_contexts (hash, content) VALUES (?, ?)", contexts.items())
+            self._conn.executemany(
+                "INSERT INTO feedback (timestamp, form_type, rag_context_hash, original_response, corrected_diff) VALUES (?, ?, ?, ?, ?)",
+                rows
+            )
+
+    def stats(self) -> dict:
+        return {
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "written": self.written,
+            "dropped": self.dropped,
+            "batches": self.batches,
+        }
@@ -0,0 +1,95 @@
+# gemini_stub.py
+# Servidor local que imita o endpoint generateContent da API do Gemini, para testes e benchmarks
+# sem gastar quota. A resposta é um JSON válido segundo o responseSchema do pedido.
+#
+# Para rodar este servidor:
+#   uvicorn gemini_stub:app --port 8009
+# e, na API: GEMINI_API_URL=http://127.0.0.1:8009/v1beta/models/gemini-1.5-flash-latest:generateContent
+#
+# Configuração via variáveis de ambiente (simulação de condições reais):
+#   STUB_LATENCY_MS      -> latência média de cada resposta
+#   STUB_LATENCY_JITTER  -> variação aleatória da latência (fração da média, ex: 0.5 = ±50%)
+#   STUB_LATENCY_PER_FIELD_MS -> latência adicional por campo do responseSchema (a geração demora
+#                           mais quanto maior a resposta; permite medir a extração em paralelo)
+#   STUB_ERROR_RATE      -> fração de pedidos que falham com 503
+#   STUB_RATE_LIMIT_RATE -> fração de pedidos que falham com 429 (com Retry-After)
+
+import asyncio
+import json
+import os
+import random
+from typing import Any, Dict
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+import metrics
+
+STUB_LATENCY_MS = float(os.getenv("STUB_LATENCY_MS", "200"))
+STUB_LATENCY_JITTER = float(os.getenv("STUB_LATENCY_JITTER", "0.5"))
+STUB_LATENCY_PER_FIELD_MS = float(os.getenv("STUB_LATENCY_PER_FIELD_MS", "0"))
+STUB_ERROR_RATE = float(os.getenv("STUB_ERROR_RATE", "0"))
+STUB_RATE_LIMIT_RATE = float(os.getenv("STUB_RATE_LIMIT_RATE", "0"))
+
+app = FastAPI(
+    title="Monster Factory - Gemini Stub",
+    description="Imitação local do endpoint generateContent do Gemini, para testes.",
+    version="1.0.0"
+)
+
+metrics.install(app)
+
+stats = {"requests": 0, "errors": 0, "rate_limited": 0}
+
+
+def sample_value(schema: Dict[str, Any], name: str = "") -> Any:
+    """
+    Valor de exemplo que respeita o schema (tipos OBJECT, ARRAY, STRING, NUMBER, INTEGER, BOOLEAN e enum).
+    """
+    schema_type = str(schema.get("type", "STRING")).upper()
+    if schema.get("enum"):
+        return schema["enum"][0]
+    if schema_type == "OBJECT":
+        return {key: sample_value(value, key) for key, value in schema.get("properties", {}).items()}
+    if schema_type == "ARRAY":
+        return [sample_value(schema.get("items", {}), name)]
+    if schema_type == "INTEGER":
+        return 0
+    if schema_type == "NUMBER":
+        return 0.0
+    if schema_type == "BOOLEAN":
+        return False
+    return f"stub: {name}" if name else "stub"
+
+
+@app.get("/")
+def read_root():
+    return {"message": "Stub do Gemini está ativo.", **stats}
+
+
+@app.post("/v1beta/models/{model_action}")
+async def generate_content(model_action: str, request: Request):
+    stats["requests"] += 1
+    body = await request.json()
+
+    fields = len(body.get("generationConfig", {}).get("responseSchema", {}).get("properties", {}))
+    latency = (STUB_LATENCY_MS + STUB_LATENCY_PER_FIELD_MS * fields) * (1 + random.uniform(-STUB_LATENCY_JITTER, STUB_LATENCY_JITTER))
+    await asyncio.sleep(max(latency, 0) / 1000)
+
+    draw = random.random()
+    if draw < STUB_RATE_LIMIT_RATE:
+        stats["rate_limited"] += 1
+        return JSONResponse({"error": {"code": 429, "status": "RESOURCE_EXHAUSTED"}}, status_code=429,
+                            headers={"Retry-After": "1"})
+    if draw < STUB_RATE_LIMIT_RATE + STUB_ERROR_RATE:
+        stats["errors"] += 1
+        return JSONResponse({"error": {"code": 503, "status": "UNAVAILABLE"}}, status_code=503)
+
+    response_schema = body.get("generationConfig", {}).get("responseSchema", {"type": "OBJECT", "properties": {}})
+    text = json.dumps(sample_value(response_schema), ensure_ascii=False)
+    prompt_chars = sum(len(part.get("text", "")) for content in body.get("contents", []) for part in content.get("parts", []))
+    return {
+        "candidates": [{"content": {"role": "model", "parts": [{"text": text}]}, "finishReason": "STOP"}],
+        "usageMetadata": {"promptTokenCount": prompt_chars // 4, "candidatesTokenCount": len(text) // 4},
+        "modelVersion": model_action.split(":")[0],
+    }
@@ -8,15 +8,20 @@
 # 3. Crie uma pasta 'output' para os ficheiros gerados.
 # 4. Execute no seu terminal: uvicorn generator_service:app --reload
 
+import asyncio
+import io
+import json
 import os
-import uuid
-import subprocess
-from fastapi import FastAPI, HTTPException
-from fastapi.responses import FileResponse
-from pydantic import BaseModel
-from typing import Dict, Any
+import zipfile
+from fastapi import FastAPI, HTTPException, Query, Request
+from fastapi.responses import FileResponse, Response, StreamingResponse
+from pydantic import BaseModel, Field
+from typing import Dict, Any, List, Literal, Tuple
 
-from docxtpl import DocxTemplate
+import metrics
+from office_pool import OfficePool, PoolSaturatedError, ConversionTimeoutError, ConversionError
+from storage_manager import StorageManager
+from template_cache import TemplateCache
 
 # --- Inicialização da Aplicação FastAPI ---
 app = FastAPI(
@@ -25,17 +30,91 @@ app = FastAPI(
     version="1.1.0"
 )
 
+# Métricas (GET /metrics); o X-Request-ID vem da API e aparece nos erros 5xx
+metrics.install(app)
+metrics.gauge("monsterfactory_office_pool_idle", "Instâncias LibreOffice livres.",
+              lambda: office_pool.stats()["idle"] if office_pool is not None else 0)
+metrics.gauge("monsterfactory_office_pool_waiting", "Pedidos à espera de uma instância LibreOffice.",
+              lambda: office_pool.stats()["waiting"] if office_pool is not None else 0)
+
 # --- Configuração de Pastas ---
 TEMPLATE_FOLDER = "templates"
 OUTPUT_FOLDER = "output"
 os.makedirs(TEMPLATE_FOLDER, exist_ok=True)
 os.makedirs(OUTPUT_FOLDER, exist_ok=True)
 
+# --- Cache de Templates (analisados e compilados uma única vez) ---
+template_cache = TemplateCache(TEMPLATE_FOLDER)
+
+# --- Ciclo de Vida dos Ficheiros Gerados (TTL, orçamento em bytes e deduplicação) ---
+storage = StorageManager(OUTPUT_FOLDER)
+# Renderizações em curso, para que pedidos idênticos simultâneos partilhem o mesmo resultado.
+# O evento (só nas pré-renderizações) é ativado quando um pedido normal passa a esperar pela mesma renderização.
+inflight_renders: Dict[str, Tuple[asyncio.Future, asyncio.Event | None]] = {}
+
+# --- Pool de Instâncias LibreOffice (conversão DOCX -> PDF) ---
+office_pool: OfficePool | None = None
+
+@app.on_event("startup")
+async def startup_event():
+    global office_pool
+    # Falha já no arranque se algum template estiver corrompido.
+    await asyncio.to_thread(template_cache.warm)
+    storage.start()
+
+    pool = OfficePool()
+    try:
+        await pool.start()
+        office_pool = pool
+        print(f"Pool LibreOffice iniciado ({pool.mode}, {len(pool.instances)} instâncias).")
+    except (FileNotFoundError, ConversionError) as e:
+        await pool.close()
+        print(f"AVISO: não foi possível iniciar o LibreOffice ({e}). A conversão para PDF não funcionará.")
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await storage.close()
+    if office_pool is not None:
+        await office_pool.close()
+
 # --- Modelos de Dados (Pydantic) ---
 class GenerationPayload(BaseModel):
     form_type: str
     form_data: Dict[str, Any]
 
+class PrerenderPayload(GenerationPayload):
+    job_id: str
+
+class BatchGenerationPayload(BaseModel):
+    items: List[GenerationPayload]
+    output: Literal["docx", "pdf", "both"] = "both"
+    # Nº de lotes renderizados/convertidos em simultâneo
+    max_parallel: int = Field(2, ge=1, le=16)
+
+# --- Limites da Geração em Lote ---
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "1000"))
+# Nº de documentos convertidos por cada invocação do LibreOffice
+BATCH_CONVERT_SIZE = int(os.getenv("BATCH_CONVERT_SIZE", "8"))
+
+# --- Pré-renderização Especulativa ---
+# Nº máximo de pré-renderizações registadas (as concluídas mais antigas são esquecidas primeiro)
+SPECULATIVE_MAX_PENDING = int(os.getenv("SPECULATIVE_MAX_PENDING", "64"))
+
+class SpeculativeRender:
+    """
+    Pré-renderização dos dados extraídos de um job. `claimed` fica True quando os mesmos ficheiros
+    são pedidos normalmente (ou já existiam), e nesse caso nunca são descartados.
+    """
+
+    def __init__(self, key: str, form_type: str):
+        self.key = key
+        self.form_type = form_type
+        self.claimed = False
+        self.task: asyncio.Task | None = None
+
+# Pré-renderizações por job_id
+speculative_renders: Dict[str, SpeculativeRender] = {}
+
 # --- Mapeamento de Tipos de Formulário para Ficheiros de Template ---
 TEMPLATE_MAPPING = {
     "dispensa": "13.4.1. Súmula de Dispensa de Recurso.docx",
@@ -49,8 +128,200 @@ TEMPLATE_MAPPING = {
 def read_root():
     return {"message": "Serviço de Geração de Documentos está ativo."}
 
+@app.get("/api/v1/office-pool")
+def get_office_pool_stats():
+    """
+    Estado do pool de instâncias LibreOffice (instâncias livres, fila de espera, conversões).
+    """
+    if office_pool is None:
+        raise HTTPException(status_code=503, detail="O pool LibreOffice não está disponível.")
+    return office_pool.stats()
+
+def render_docx_bytes(template_name: str, context: Dict[str, Any]) -> bytes:
+    with metrics.stage("template_render"):
+        doc = template_cache.render(template_name, context)
+        buffer = io.BytesIO()
+        doc.save(buffer)
+        return buffer.getvalue()
+
+async def convert_pdf_bytes(docx_bytes: bytes, promote: asyncio.Event | None = None) -> bytes:
+    """
+    Converte um DOCX em memória para PDF no pool LibreOffice, traduzindo os erros para HTTP.
+    Com `promote`, a conversão é de baixa prioridade até o evento ser ativado.
+    """
+    if office_pool is None:
+        raise HTTPException(status_code=500, detail="Comando 'soffice' (LibreOffice) não encontrado. Este serviço deve ser executado num ambiente com LibreOffice instalado.")
+    try:
+        with metrics.stage("pdf_conversion" if promote is None else "pdf_conversion_speculative"):
+            return await office_pool.convert_bytes(docx_bytes, promote=promote)
+    except PoolSaturatedError:
+        raise HTTPException(status_code=503, detail="Serviço de conversão sobrecarregado. Tente novamente.", headers={"Retry-After": "5"})
+    except ConversionTimeoutError:
+        raise HTTPException(status_code=500, detail="A conversão para PDF demorou demasiado tempo (timeout).")
+    except ConversionError as e:
+        raise HTTPException(status_code=500, detail=f"Falha na conversão para PDF: {e}")
+
+DOCX_MEDIA_TYPE = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+
+@app.post("/api/v1/render")
+async def render_document(payload: GenerationPayload, output: str = Query("pdf", pattern="^(docx|pdf|zip)$")):
+    """
+    Gera o documento sem passar pelo disco e devolve-o diretamente na resposta:
+    `output=docx`, `output=pdf` ou `output=zip` (ambos os ficheiros).
+    """
+    template_name = TEMPLATE_MAPPING.get(payload.form_type)
+    if not template_name:
+        raise HTTPException(status_code=400, detail="Tipo de formulário inválido.")
+
+    try:
+        docx_bytes = await asyncio.to_thread(render_docx_bytes, template_name, payload.form_data)
+    except FileNotFoundError:
+        raise HTTPException(status_code=500, detail=f"Ficheiro de template não encontrado: {template_name}")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Falha ao renderizar o template DOCX: {e}")
+
+    file_stem = payload.form_type
+    if output == "docx":
+        return Response(
+            content=docx_bytes, media_type=DOCX_MEDIA_TYPE,
+            headers={"Content-Disposition": f'attachment; filename="{file_stem}.docx"'}
+        )
+
+    pdf_bytes = await convert_pdf_bytes(docx_bytes)
+    if output == "pdf":
+        return Response(
+            content=pdf_bytes, media_type="application/pdf",
+            headers={"Content-Disposition": f'attachment; filename="{file_stem}.pdf"'}
+        )
+
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr(f"{file_stem}.docx", docx_bytes)
+        archive.writestr(f"{file_stem}.pdf", pdf_bytes)
+    return Response(
+        content=buffer.getvalue(), media_type="application/zip",
+        headers={"Content-Disposition": f'attachment; filename="{file_stem}.zip"'}
+    )
+
+class _ZipStream(io.RawIOBase):
+    """
+    Destino não posicionável para o zipfile: acumula os bytes escritos até serem enviados ao cliente.
+    """
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+async def render_batch_window(window, output: str):
+    """
+    Renderiza um lote de documentos e converte-os para PDF numa só chamada ao pool.
+    Retorna, para cada item, (índice, ficheiros) ou (índice, mensagem de erro).
+    """
+    async def render_item(item: GenerationPayload) -> bytes:
+        template_name = TEMPLATE_MAPPING.get(item.form_type)
+        if not template_name:
+            raise ValueError("Tipo de formulário inválido.")
+        return await asyncio.to_thread(render_docx_bytes, template_name, item.form_data)
+
+    rendered = await asyncio.gather(*[render_item(item) for _, item in window], return_exceptions=True)
+    results = {}
+    converted = []
+    for (index, item), docx in zip(window, rendered):
+        if isinstance(docx, Exception):
+            results[index] = f"Falha ao renderizar o template DOCX: {docx}"
+        else:
+            results[index] = {f"{index:04d}_{item.form_type}.docx": docx} if output != "pdf" else {}
+            converted.append((index, item, docx))
+
+    if output != "docx" and converted:
+        try:
+            if office_pool is None:
+                raise ConversionError("LibreOffice não disponível.")
+            with metrics.stage("pdf_conversion_batch"):
+                pdfs = await office_pool.convert_batch([docx for _, _, docx in converted])
+        except (PoolSaturatedError, ConversionTimeoutError, ConversionError) as e:
+            pdfs = [e] * len(converted)
+        for (index, item, _), pdf in zip(converted, pdfs):
+            if isinstance(pdf, Exception):
+                results[index] = f"Falha na conversão para PDF: {pdf}"
+            else:
+                results[index][f"{index:04d}_{item.form_type}.pdf"] = pdf
+    return [(index, results[index]) for index, _ in window]
+
+
+async def stream_batch_zip(payload: BatchGenerationPayload):
+    """
+    Produz o ZIP à medida que os lotes terminam. A fila limitada faz com que um cliente lento
+    trave a renderização, pelo que a memória não cresce com o tamanho do pedido.
+    """
+    items = list(enumerate(payload.items))
+    windows = [items[i:i + BATCH_CONVERT_SIZE] for i in range(0, len(items), BATCH_CONVERT_SIZE)]
+    results: asyncio.Queue = asyncio.Queue(maxsize=payload.max_parallel)
+    semaphore = asyncio.Semaphore(payload.max_parallel)
+
+    async def worker(window):
+        async with semaphore:
+            try:
+                window_results = await render_batch_window(window, payload.output)
+            except Exception as e:
+                # Cada item tem de chegar à fila, senão o stream fica à espera para sempre.
+                window_results = [(index, f"Falha inesperada na geração: {e}") for index, _ in window]
+            for result in window_results:
+                await results.put(result)
+
+    tasks = [asyncio.create_task(worker(window)) for window in windows]
+    stream = _ZipStream()
+    manifest = []
+    try:
+        with zipfile.ZipFile(stream, "w", zipfile.ZIP_DEFLATED) as archive:
+            for _ in range(len(items)):
+                index, result = await results.get()
+                if isinstance(result, str):
+                    archive.writestr(f"errors/{index:04d}.txt", result)
+                    manifest.append({"index": index, "status": "failed", "error": result})
+                else:
+                    for file_name, content in result.items():
+                        archive.writestr(file_name, content)
+                    manifest.append({"index": index, "status": "ok", "files": sorted(result)})
+                yield stream.drain()
+            manifest.sort(key=lambda entry: entry["index"])
+            archive.writestr("manifest.json", json.dumps(manifest, ensure_ascii=False, indent=2))
+        yield stream.drain()
+    finally:
+        # Cliente desligou-se (ou terminou): cancela o trabalho pendente.
+        for task in tasks:
+            task.cancel()
+
+@app.post("/api/v1/generate-batch")
+async def create_documents_batch(payload: BatchGenerationPayload):
+    """
+    Gera muitos documentos de uma vez e devolve um ZIP transmitido à medida que ficam prontos.
+    Os erros de cada item ficam em `errors/NNNN.txt` e o resumo em `manifest.json`.
+    """
+    if not payload.items:
+        raise HTTPException(status_code=400, detail="O lote não contém documentos.")
+    if len(payload.items) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"O lote excede o limite de {BATCH_MAX_ITEMS} documentos.")
+    return StreamingResponse(
+        stream_batch_zip(payload),
+        media_type="application/zip",
+        headers={"Content-Disposition": 'attachment; filename="documentos.zip"'}
+    )
+
 @app.post("/api/v1/generate-document", status_code=201)
-def create_document(payload: GenerationPayload):
+async def create_document(payload: GenerationPayload):
     """
     Gera um ficheiro .docx e um .pdf a partir de dados e um tipo de formulário.
     """
@@ -62,54 +333,155 @@ def create_document(payload: GenerationPayload):
     if not os.path.exists(template_path):
         raise HTTPException(status_code=500, detail=f"Ficheiro de template não encontrado: {template_name}")
 
-    unique_id = str(uuid.uuid4())
-    docx_filename = f"{payload.form_type}_{unique_id}.docx"
-    docx_filepath = os.path.join(OUTPUT_FOLDER, docx_filename)
-
     # O contexto são os dados do formulário recebidos diretamente.
     # As chaves no seu template .docx devem corresponder às chaves no form_data.
     # Ex: {{ data_publicacao }}, {{ numero_processo }}, etc.
-    context = payload.form_data
+    docx_filename, pdf_filename = await render_to_storage(payload.form_type, template_name, payload.form_data)
 
+    return {
+        "message": "Documentos gerados com sucesso.",
+        "docx_filename": docx_filename,
+        "pdf_filename": pdf_filename
+    }
+
+async def render_key_for(form_type: str, template_name: str, context: Dict[str, Any]) -> str:
     try:
-        doc = DocxTemplate(template_path)
-        doc.render(context)
-        doc.save(docx_filepath)
+        template_hash = (await asyncio.to_thread(template_cache.get, template_name)).content_hash
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Falha ao renderizar o template DOCX: {e}")
+        raise HTTPException(status_code=500, detail=f"Falha ao carregar o template: {e}")
+    return storage.render_key(template_hash, form_type, context)
 
-    # Converte o DOCX gerado para PDF usando LibreOffice
+async def render_to_storage(form_type: str, template_name: str, context: Dict[str, Any],
+                            speculative: SpeculativeRender | None = None):
+    """
+    Retorna os ficheiros já gerados para o mesmo template + dados, ou gera-os uma única vez
+    (pedidos idênticos em simultâneo aguardam a mesma renderização).
+    Com `speculative`, a renderização é de baixa prioridade até um pedido normal precisar dela.
+    """
+    key = speculative.key if speculative is not None else await render_key_for(form_type, template_name, context)
+    if speculative is None:
+        for pending in speculative_renders.values():
+            if pending.key == key:
+                pending.claimed = True
+
+    existing = await asyncio.to_thread(storage.lookup, key, form_type)
+    if existing:
+        if speculative is not None:
+            speculative.claimed = True
+        return existing
+
+    entry = inflight_renders.get(key)
+    if entry is None:
+        promote = asyncio.Event() if speculative is not None else None
+        render = asyncio.ensure_future(render_and_store(key, form_type, template_name, context, promote))
+        inflight_renders[key] = (render, promote)
+        render.add_done_callback(lambda _: inflight_renders.pop(key, None))
+    else:
+        render, promote = entry
+        if speculative is not None:
+            speculative.claimed = True
+        elif promote is not None:
+            # Pedido normal à espera de uma pré-renderização: passa a prioridade normal.
+            promote.set()
     try:
-        subprocess.run(
-            ["soffice", "--headless", "--convert-to", "pdf", "--outdir", OUTPUT_FOLDER, docx_filepath],
-            check=True,
-            timeout=60
-        )
-    except FileNotFoundError:
-        raise HTTPException(status_code=500, detail="Comando 'soffice' (LibreOffice) não encontrado. Este serviço deve ser executado num ambiente com LibreOffice instalado.")
-    except subprocess.CalledProcessError as e:
-        raise HTTPException(status_code=500, detail=f"Falha na conversão para PDF: {e}")
-    except subprocess.TimeoutExpired:
-        raise HTTPException(status_code=500, detail="A conversão para PDF demorou demasiado tempo (timeout).")
+        # shield: um cliente que desiste não cancela a renderização dos restantes
+        return await asyncio.shield(render)
+    except asyncio.CancelledError:
+        # Pré-renderização cancelada antes de alguém precisar dela: liberta o LibreOffice.
+        if speculative is not None and promote is not None and not promote.is_set():
+            render.cancel()
+        raise
 
-    pdf_filename = docx_filename.replace(".docx", ".pdf")
-    pdf_filepath = os.path.join(OUTPUT_FOLDER, pdf_filename)
+async def render_and_store(key: str, form_type: str, template_name: str, context: Dict[str, Any],
+                           promote: asyncio.Event | None = None):
+    try:
+        docx_bytes = await asyncio.to_thread(render_docx_bytes, template_name, context)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Falha ao renderizar o template DOCX: {e}")
 
-    if not os.path.exists(pdf_filepath):
-         raise HTTPException(status_code=500, detail="Ficheiro PDF não foi criado após a conversão.")
+    # Converte o DOCX gerado para PDF em memória, no pool de instâncias LibreOffice
+    pdf_bytes = await convert_pdf_bytes(docx_bytes, promote)
 
-    return {
-        "message": "Documentos gerados com sucesso.",
-        "docx_filename": docx_filename,
-        "pdf_filename": pdf_filename
-    }
+    docx_filename, pdf_filename = storage.file_names(key, form_type)
+    await asyncio.to_thread(storage.store, {docx_filename: docx_bytes, pdf_filename: pdf_bytes})
+    return docx_filename, pdf_filename
+
+@app.post("/api/v1/prerender", status_code=202)
+async def prerender_document(payload: PrerenderPayload):
+    """
+    Pré-renderização especulativa (baixa prioridade) dos dados extraídos de um job, pedida pela API
+    quando a análise termina. Se o utilizador gerar o documento sem alterações, os ficheiros já estão
+    prontos; se alterar os dados, a API cancela ou descarta esta renderização (DELETE).
+    """
+    template_name = TEMPLATE_MAPPING.get(payload.form_type)
+    if not template_name:
+        raise HTTPException(status_code=400, detail="Tipo de formulário inválido.")
+    key = await render_key_for(payload.form_type, template_name, payload.form_data)
+
+    previous = speculative_renders.get(payload.job_id)
+    if previous is not None:
+        if previous.key == key:
+            return {"job_id": payload.job_id, "status": "pending" if not previous.task.done() else "done"}
+        discard_speculative(payload.job_id)
+    if len(speculative_renders) >= SPECULATIVE_MAX_PENDING:
+        for job_id in [job_id for job_id, spec in speculative_renders.items() if spec.task.done()]:
+            if len(speculative_renders) < SPECULATIVE_MAX_PENDING:
+                break
+            del speculative_renders[job_id]
+        if len(speculative_renders) >= SPECULATIVE_MAX_PENDING:
+            return {"job_id": payload.job_id, "status": "skipped"}
+
+    spec = SpeculativeRender(key, payload.form_type)
+    spec.task = asyncio.create_task(run_speculative(payload.job_id, spec, template_name, payload.form_data))
+    speculative_renders[payload.job_id] = spec
+    return {"job_id": payload.job_id, "status": "pending"}
+
+async def run_speculative(job_id: str, spec: SpeculativeRender, template_name: str, context: Dict[str, Any]):
+    try:
+        await render_to_storage(spec.form_type, template_name, context, speculative=spec)
+    except HTTPException as e:
+        print(f"AVISO: a pré-renderização do job {job_id} falhou: {e.detail}")
+    except Exception as e:
+        print(f"AVISO: a pré-renderização do job {job_id} falhou: {e}")
+
+def discard_speculative(job_id: str) -> str | None:
+    """
+    Cancela a pré-renderização do job (se ainda estiver a correr) ou remove os ficheiros
+    que ninguém chegou a pedir. Retorna o que foi feito, ou None se não houver pré-renderização.
+    """
+    spec = speculative_renders.pop(job_id, None)
+    if spec is None:
+        return None
+    if not spec.task.done():
+        spec.task.cancel()
+        return "cancelled"
+    if not spec.claimed:
+        storage.discard(spec.key, spec.form_type)
+        return "discarded"
+    return "kept"
+
+@app.delete("/api/v1/prerender/{job_id}")
+def cancel_prerender(job_id: str):
+    status = discard_speculative(job_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail="Pré-renderização não encontrada.")
+    return {"job_id": job_id, "status": status}
 
 @app.get("/download/{file_name}")
-def download_file(file_name: str):
+def download_file(file_name: str, request: Request):
     """
     Endpoint para fazer o download dos ficheiros gerados.
+    Suporta pedidos condicionais (ETag / If-None-Match -> 304) e parciais (Range).
     """
-    file_path = os.path.join(OUTPUT_FOLDER, file_name)
-    if os.path.exists(file_path):
-        return FileResponse(path=file_path, filename=file_name, media_type='application/octet-stream')
-    raise HTTPException(status_code=404, detail="Ficheiro não encontrado.")
+    file_path = storage.resolve(file_name)
+    if file_path is None:
+        raise HTTPException(status_code=404, detail="Ficheiro não encontrado.")
+
+    etag = storage.etag(file_path)
+    headers = {"ETag": etag, "Cache-Control": f"private, max-age={storage.ttl_seconds}"}
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and (if_none_match.strip() == "*" or etag in [tag.strip() for tag in if_none_match.split(",")]):
+        return Response(status_code=304, headers=headers)
+
+    # O FileResponse trata os cabeçalhos Range / If-Range (206) com base no mesmo ETag.
+    return FileResponse(path=file_path, filename=file_name, media_type='application/octet-stream', headers=headers)
@@ -0,0 +1,153 @@
+# hybrid_retriever.py
+# Recuperação híbrida sobre a base vetorial da política: BM25 (léxico) + FAISS (semântico).
+#
+# Os índices auxiliares são construídos uma única vez, no arranque, a partir dos chunks do VectorIndex:
+#   - BM25Index: índice invertido termo -> (chunks, frequências), para termos exatos como "PASEP" ou "FIES";
+#   - SectionIndex: título da secção (metadado 'section' da ingestão) -> chunks dessa secção.
+# As duas listas de candidatos são combinadas por Reciprocal Rank Fusion (RRF), e secções ou termos
+# que o prompt usa diretamente podem ser fixados no contexto, à frente dos restantes resultados.
+
+from collections import defaultdict
+from typing import Dict, Iterable, List, Sequence, Tuple
+
+import numpy as np
+
+import metrics
+from text_normalize import normalize, tokenize
+from vector_index import Chunk, VectorIndex
+
+BM25_K1 = 1.5
+BM25_B = 0.75
+# Constante do Reciprocal Rank Fusion (valor habitual na literatura)
+RRF_K = 60
+# Nº de candidatos de cada método antes da fusão
+HYBRID_CANDIDATES = 20
+
+
+class BM25Index:
+    def __init__(self, texts: Sequence[str], k1: float = BM25_K1, b: float = BM25_B):
+        self.k1 = k1
+        self.b = b
+        self.doc_count = len(texts)
+        postings: Dict[str, Dict[int, int]] = defaultdict(dict)
+        lengths = np.zeros(len(texts), dtype="float32")
+        for doc_id, text in enumerate(texts):
+            tokens = tokenize(text)
+            lengths[doc_id] = len(tokens)
+            for token in tokens:
+                postings[token][doc_id] = postings[token].get(doc_id, 0) + 1
+        self.lengths = lengths
+        self.average_length = float(lengths.mean()) if len(texts) else 0.0
+        self.postings: Dict[str, Tuple[np.ndarray, np.ndarray]] = {
+            term: (np.fromiter(docs.keys(), dtype="int64"), np.fromiter(docs.values(), dtype="float32"))
+            for term, docs in postings.items()
+        }
+
+    def search(self, query: str, k: int) -> List[Tuple[int, float]]:
+        scores = np.zeros(self.doc_count, dtype="float32")
+        for term in set(tokenize(query)):
+            posting = self.postings.get(term)
+            if posting is None:
+                continue
+            ids, tf = posting
+            idf = np.log(1 + (self.doc_count - len(ids) + 0.5) / (len(ids) + 0.5))
+            norm = self.k1 * (1 - self.b + self.b * self.lengths[ids] / max(self.average_length, 1e-9))
+            scores[ids] += idf * tf * (self.k1 + 1) / (tf + norm)
+        k = min(k, int(np.count_nonzero(scores)))
+        if k == 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(i), float(scores[i])) for i in top]
+
+    def docs_with_all(self, text: str) -> List[int]:
+        """
+        Chunks que contêm todos os termos de `text` (ex: "Cédula Rural").
+        """
+        tokens = tokenize(text)
+        if not tokens or any(token not in self.postings for token in tokens):
+            return []
+        docs = set(self.postings[tokens[0]][0].tolist())
+        for token in tokens[1:]:
+            docs &= set(self.postings[token][0].tolist())
+        return sorted(docs)
+
+
+class SectionIndex:
+    def __init__(self, metadatas: Sequence[dict]):
+        self.sections: Dict[str, List[int]] = defaultdict(list)
+        for doc_id, metadata in enumerate(metadatas):
+            section = metadata.get("section")
+            if section:
+                self.sections[section].append(doc_id)
+        self._normalized = {title: normalize(title) for title in self.sections}
+
+    def find(self, title: str) -> List[int]:
+        """
+        Chunks das secções cujo título contém `title` (comparação sem acentos nem pontuação).
+        """
+        wanted = normalize(title)
+        return [doc_id for section, normalized in self._normalized.items() if wanted in normalized
+                for doc_id in self.sections[section]]
+
+
+class HybridRetriever:
+    """
+    Pesquisa híbrida (BM25 + FAISS) sobre um VectorIndex, com secções e termos fixáveis no contexto.
+    """
+
+    def __init__(self, index: VectorIndex):
+        self.index = index
+        texts = [index.get_text(i) for i in range(len(index))]
+        self.lexical = BM25Index(texts)
+        self.sections = SectionIndex(index.metadatas)
+
+    @property
+    def version(self) -> str:
+        return self.index.version
+
+    @property
+    def model_name(self) -> str:
+        return self.index.model_name
+
+    def embed_query(self, text: str) -> Sequence[float]:
+        if self.index.embed_query is None:
+            raise RuntimeError("Nenhuma função de embedding configurada para a base vetorial.")
+        return self.index.embed_query(text)
+
+    def fuse(self, query_text: str, query_vector: Sequence[float], candidates: int = HYBRID_CANDIDATES) -> Dict[int, float]:
+        """
+        Pontuação RRF de cada chunk candidato (soma de 1 / (RRF_K + posição) em cada lista).
+        """
+        fused: Dict[int, float] = defaultdict(float)
+        with metrics.stage("faiss_search"):
+            semantic = self.index.search_ids(query_vector, candidates)
+        with metrics.stage("bm25_search"):
+            lexical = self.lexical.search(query_text, candidates)
+        for ranking in (semantic, lexical):
+            for rank, (doc_id, _) in enumerate(ranking):
+                fused[doc_id] += 1.0 / (RRF_K + rank + 1)
+        return fused
+
+    def search(self, query_text: str, query_vector: Sequence[float], k: int,
+               pin_sections: Iterable[str] = (), pin_terms: Iterable[str] = (), max_pinned: int = 0) -> List[Chunk]:
+        """
+        Retorna até `k` chunks: primeiro os fixados (o melhor chunk de cada secção/termo pedido, até
+        `max_pinned`) e depois os restantes por ordem da pontuação híbrida.
+        """
+        fused = self.fuse(query_text, query_vector)
+
+        def best(ids: List[int]) -> int:
+            # Melhor pontuação híbrida; sem pontuação, o primeiro chunk (início da secção).
+            return max(ids, key=lambda doc_id: (fused.get(doc_id, 0.0), -doc_id))
+
+        pinned: List[int] = []
+        groups = [self.sections.find(title) for title in pin_sections] + [self.lexical.docs_with_all(term) for term in pin_terms]
+        for ids in groups:
+            ids = [doc_id for doc_id in ids if doc_id not in pinned]
+            if ids and len(pinned) < max_pinned:
+                pinned.append(best(ids))
+
+        ranked = [doc_id for doc_id in sorted(fused, key=fused.get, reverse=True) if doc_id not in pinned]
+        selected = (pinned + ranked)[:k]
+        return [self.index.get_chunk(doc_id, fused.get(doc_id, 0.0)) for doc_id in selected]
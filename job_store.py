@@ -0,0 +1,251 @@
+# job_store.py
+# Armazenamento persistente e limitado dos jobs de análise, partilhável entre workers do uvicorn.
+#
+# Backends disponíveis (JOB_STORE_BACKEND):
+#   - "sqlite" (padrão): ficheiro SQLite em modo WAL, partilhado por todos os workers da máquina.
+#   - "redis": servidor Redis (ou compatível) local. Requer o pacote opcional 'redis'.
+#
+# Ambos aplicam expiração por TTL (JOB_TTL_SECONDS), despejo LRU acima de JOB_STORE_MAX_JOBS
+# e serialização compacta (JSON sem espaços comprimido com zlib).
+
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from abc import ABC, abstractmethod
+from typing import Any, Dict, List
+
+JOB_STORE_BACKEND = os.getenv("JOB_STORE_BACKEND", "sqlite")
+JOB_STORE_PATH = os.getenv("JOB_STORE_PATH", "jobs.db")
+JOB_STORE_REDIS_URL = os.getenv("JOB_STORE_REDIS_URL", "redis://localhost:6379/0")
+JOB_TTL_SECONDS = int(os.getenv("JOB_TTL_SECONDS", str(24 * 3600)))
+JOB_STORE_MAX_JOBS = int(os.getenv("JOB_STORE_MAX_JOBS", "10000"))
+# Intervalo mínimo (s) entre atualizações do último acesso de um job (LRU) nas leituras:
+# long-poll e SSE leem o mesmo job muitas vezes e não precisam de uma escrita por leitura.
+JOB_TOUCH_INTERVAL = float(os.getenv("JOB_TOUCH_INTERVAL", "60"))
+
+
+def serialize_job(job: Dict[str, Any]) -> bytes:
+    return zlib.compress(json.dumps(job, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+
+
+def deserialize_job(blob: bytes) -> Dict[str, Any]:
+    return json.loads(zlib.decompress(blob).decode("utf-8"))
+
+
+class JobStore(ABC):
+    """
+    Interface comum dos backends de jobs. Todos os métodos são síncronos e seguros entre threads;
+    no código assíncrono devem ser chamados através do motor de execução (engine.run_io).
+    """
+
+    @abstractmethod
+    def create(self, job_id: str, job: Dict[str, Any]) -> None:
+        ...
+
+    @abstractmethod
+    def get(self, job_id: str) -> Dict[str, Any] | None:
+        ...
+
+    @abstractmethod
+    def update(self, job_id: str, **fields) -> Dict[str, Any] | None:
+        """
+        Atualiza os campos indicados de forma atómica. Retorna o job atualizado (ou None se não existir).
+        """
+
+    @abstractmethod
+    def delete(self, job_id: str) -> None:
+        ...
+
+    def close(self) -> None:
+        pass
+
+
+class SQLiteJobStore(JobStore):
+    def __init__(self, path: str = JOB_STORE_PATH, ttl_seconds: int = JOB_TTL_SECONDS, max_jobs: int = JOB_STORE_MAX_JOBS,
+                 touch_interval: float = JOB_TOUCH_INTERVAL):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_jobs = max_jobs
+        self.touch_interval = touch_interval
+        self._local = threading.local()
+        # Todas as ligações abertas (uma por thread), para as fechar em close()
+        self._connections: List[sqlite3.Connection] = []
+        self._connections_lock = threading.Lock()
+        conn = self._conn()
+        conn.execute("""
+        CREATE TABLE IF NOT EXISTS jobs (
+            job_id TEXT PRIMARY KEY,
+            payload BLOB NOT NULL,
+            accessed_at REAL NOT NULL,
+            expires_at REAL NOT NULL
+        )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_accessed_at ON jobs (accessed_at)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_expires_at ON jobs (expires_at)")
+
+    def _conn(self) -> sqlite3.Connection:
+        # Uma ligação por thread; o modo WAL permite leituras concorrentes com um escritor.
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # check_same_thread=False: só close() usa a ligação fora da thread que a criou.
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            with self._connections_lock:
+                self._connections.append(conn)
+        return conn
+
+    def create(self, job_id, job):
+        now = time.time()
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM jobs WHERE expires_at < ?", (now,))
+            conn.execute(
+                "INSERT OR REPLACE INTO jobs (job_id, payload, accessed_at, expires_at) VALUES (?, ?, ?, ?)",
+                (job_id, serialize_job(job), now, now + self.ttl_seconds)
+            )
+            # Despejo LRU: mantém apenas os 'max_jobs' acedidos mais recentemente.
+            conn.execute(
+                "DELETE FROM jobs WHERE job_id IN (SELECT job_id FROM jobs ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_jobs,)
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def get(self, job_id):
+        now = time.time()
+        conn = self._conn()
+        row = conn.execute(
+            "SELECT payload, accessed_at FROM jobs WHERE job_id = ? AND expires_at >= ?", (job_id, now)
+        ).fetchone()
+        if row is None:
+            return None
+        if now - row[1] >= self.touch_interval:
+            conn.execute("UPDATE jobs SET accessed_at = ? WHERE job_id = ?", (now, job_id))
+        return deserialize_job(row[0])
+
+    def update(self, job_id, **fields):
+        now = time.time()
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT payload FROM jobs WHERE job_id = ? AND expires_at >= ?", (job_id, now)
+            ).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            job = deserialize_job(row[0])
+            job.update(fields)
+            conn.execute(
+                "UPDATE jobs SET payload = ?, accessed_at = ?, expires_at = ? WHERE job_id = ?",
+                (serialize_job(job), now, now + self.ttl_seconds, job_id)
+            )
+            conn.execute("COMMIT")
+            return job
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def delete(self, job_id):
+        self._conn().execute("DELETE FROM jobs WHERE job_id = ?", (job_id,))
+
+    def close(self):
+        with self._connections_lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            conn.close()
+        self._local = threading.local()
+
+
+class RedisJobStore(JobStore):
+    """
+    Backend Redis: cada job é uma chave com TTL; um sorted set guarda o último acesso para o despejo LRU.
+    """
+
+    LRU_KEY = "jobs:lru"
+
+    def __init__(self, url: str = JOB_STORE_REDIS_URL, ttl_seconds: int = JOB_TTL_SECONDS, max_jobs: int = JOB_STORE_MAX_JOBS):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("O backend 'redis' requer o pacote opcional 'redis' (pip install redis).")
+        self.client = redis.Redis.from_url(url)
+        self.ttl_seconds = ttl_seconds
+        self.max_jobs = max_jobs
+
+    @staticmethod
+    def _key(job_id: str) -> str:
+        return f"job:{job_id}"
+
+    def create(self, job_id, job):
+        now = time.time()
+        pipe = self.client.pipeline()
+        pipe.set(self._key(job_id), serialize_job(job), ex=self.ttl_seconds)
+        pipe.zadd(self.LRU_KEY, {job_id: now})
+        pipe.execute()
+        self._evict()
+
+    def _evict(self):
+        excess = self.client.zcard(self.LRU_KEY) - self.max_jobs
+        if excess <= 0:
+            return
+        oldest = self.client.zrange(self.LRU_KEY, 0, excess - 1)
+        if oldest:
+            pipe = self.client.pipeline()
+            pipe.delete(*[self._key(job_id.decode()) for job_id in oldest])
+            pipe.zrem(self.LRU_KEY, *oldest)
+            pipe.execute()
+
+    def get(self, job_id):
+        blob = self.client.get(self._key(job_id))
+        if blob is None:
+            self.client.zrem(self.LRU_KEY, job_id)
+            return None
+        self.client.zadd(self.LRU_KEY, {job_id: time.time()})
+        return deserialize_job(blob)
+
+    def update(self, job_id, **fields):
+        key = self._key(job_id)
+        updated = {}
+
+        def apply(pipe):
+            blob = pipe.get(key)
+            if blob is None:
+                return
+            job = deserialize_job(blob)
+            job.update(fields)
+            pipe.multi()
+            pipe.set(key, serialize_job(job), ex=self.ttl_seconds)
+            pipe.zadd(self.LRU_KEY, {job_id: time.time()})
+            updated["job"] = job
+
+        self.client.transaction(apply, key)
+        return updated.get("job")
+
+    def delete(self, job_id):
+        pipe = self.client.pipeline()
+        pipe.delete(self._key(job_id))
+        pipe.zrem(self.LRU_KEY, job_id)
+        pipe.execute()
+
+    def close(self):
+        self.client.close()
+
+
+def create_job_store(backend: str = JOB_STORE_BACKEND) -> JobStore:
+    """
+    Cria o backend de jobs configurado em JOB_STORE_BACKEND.
+    """
+    if backend == "sqlite":
+        return SQLiteJobStore()
+    if backend == "redis":
+        return RedisJobStore()
+    raise ValueError(f"Backend de jobs desconhecido: '{backend}'.")
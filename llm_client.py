@@ -0,0 +1,193 @@
+# llm_client.py
+# Cliente partilhado para as chamadas ao LLM (Gemini), usado por todos os assistentes via motor de execução.
+#
+# - Um único httpx.AsyncClient por worker, com pool de ligações keep-alive e HTTP/2 (se o 'h2' estiver instalado).
+# - Limitador token bucket para pedidos/minuto e tokens/minuto (quota da API), partilhado pelos jobs do worker.
+# - Novas tentativas com backoff exponencial e jitter em 429/5xx e erros de rede (respeitando o Retry-After).
+# - Hedging opcional: se a resposta demorar mais do que LLM_HEDGE_AFTER, é enviado um segundo pedido
+#   e fica a resposta que chegar primeiro (o outro é cancelado).
+# - Cancelamento: cancelar a tarefa do job cancela o pedido HTTP em curso e a espera no limitador.
+#
+# Configuração via variáveis de ambiente:
+#   LLM_HTTP_TIMEOUT         -> timeout (s) de cada pedido
+#   LLM_REQUESTS_PER_MINUTE  -> limite de pedidos por minuto (por worker)
+#   LLM_TOKENS_PER_MINUTE    -> limite de tokens (estimados) por minuto (por worker)
+#   LLM_MAX_RETRIES          -> nº máximo de novas tentativas
+#   LLM_BACKOFF_BASE / LLM_BACKOFF_MAX -> backoff inicial e máximo (s)
+#   LLM_HEDGE_AFTER          -> segundos até enviar o pedido de reserva (0 = sem hedging)
+
+import asyncio
+import json
+import os
+import random
+import time
+from typing import Any, Dict
+
+import httpx
+
+import metrics
+
+try:
+    import h2  # noqa: F401 (necessário para o HTTP/2 do httpx: pip install "httpx[http2]")
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+LLM_HTTP_TIMEOUT = float(os.getenv("LLM_HTTP_TIMEOUT", "120"))
+LLM_REQUESTS_PER_MINUTE = float(os.getenv("LLM_REQUESTS_PER_MINUTE", "60"))
+LLM_TOKENS_PER_MINUTE = float(os.getenv("LLM_TOKENS_PER_MINUTE", "1000000"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "4"))
+LLM_BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", "1"))
+LLM_BACKOFF_MAX = float(os.getenv("LLM_BACKOFF_MAX", "30"))
+LLM_HEDGE_AFTER = float(os.getenv("LLM_HEDGE_AFTER", "0"))
+
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+
+class LLMError(Exception):
+    """
+    Falha definitiva de uma chamada ao LLM (erro não recuperável ou tentativas esgotadas).
+    """
+
+
+def estimate_tokens(payload: Dict[str, Any]) -> int:
+    # Aproximação habitual de ~4 caracteres por token; serve apenas para o limitador.
+    return max(1, len(json.dumps(payload, ensure_ascii=False)) // 4)
+
+
+class TokenBucket:
+    """
+    Balde de tokens reposto continuamente a `rate_per_minute` por minuto, com capacidade de um minuto.
+    """
+
+    def __init__(self, rate_per_minute: float):
+        self.rate = rate_per_minute / 60
+        self.capacity = rate_per_minute
+        self.tokens = rate_per_minute
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, amount: float = 1):
+        # Pedidos maiores do que a capacidade esperariam para sempre: ficam limitados a um minuto inteiro.
+        amount = min(amount, self.capacity)
+        async with self._lock:
+            while True:
+                self._refill()
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                await asyncio.sleep((amount - self.tokens) / self.rate)
+
+
+class LLMClient:
+    def __init__(self, timeout: float = LLM_HTTP_TIMEOUT, requests_per_minute: float = LLM_REQUESTS_PER_MINUTE,
+                 tokens_per_minute: float = LLM_TOKENS_PER_MINUTE, max_retries: int = LLM_MAX_RETRIES,
+                 backoff_base: float = LLM_BACKOFF_BASE, backoff_max: float = LLM_BACKOFF_MAX,
+                 hedge_after: float = LLM_HEDGE_AFTER, transport: httpx.AsyncBaseTransport | None = None):
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.hedge_after = hedge_after
+        self.request_bucket = TokenBucket(requests_per_minute)
+        self.token_bucket = TokenBucket(tokens_per_minute)
+        self._transport = transport
+        self.http_client: httpx.AsyncClient | None = None
+        self.stats = {"requests": 0, "retries": 0, "hedges": 0, "failures": 0}
+
+    def start(self):
+        self.http_client = httpx.AsyncClient(
+            timeout=self.timeout,
+            http2=HTTP2_AVAILABLE and self._transport is None,
+            limits=httpx.Limits(max_connections=100, max_keepalive_connections=20),
+            transport=self._transport,
+        )
+
+    async def close(self):
+        if self.http_client is not None:
+            await self.http_client.aclose()
+            self.http_client = None
+
+    def _backoff(self, attempt: int, response: httpx.Response | None) -> float:
+        if response is not None:
+            retry_after = response.headers.get("retry-after", "")
+            if retry_after.replace(".", "", 1).isdigit():
+                return min(float(retry_after), self.backoff_max)
+        # "Full jitter": espera aleatória entre 0 e o backoff exponencial
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    async def _post(self, url: str, payload: Dict[str, Any]) -> httpx.Response:
+        self.stats["requests"] += 1
+        return await self.http_client.post(url, json=payload)
+
+    async def _post_hedged(self, url: str, payload: Dict[str, Any]) -> httpx.Response:
+        """
+        Envia o pedido e, se não houver resposta em `hedge_after` segundos, um segundo pedido igual.
+        Retorna a primeira resposta bem-sucedida; o pedido que ficar para trás é cancelado.
+        """
+        if self.hedge_after <= 0:
+            return await self._post(url, payload)
+        tasks = [asyncio.create_task(self._post(url, payload))]
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=self.hedge_after)
+            if not done:
+                await self._acquire_quota(payload)
+                self.stats["hedges"] += 1
+                tasks.append(asyncio.create_task(self._post(url, payload)))
+            pending = set(tasks)
+            result = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None and task.result().status_code < 400:
+                        return task.result()
+                    result = task
+            # Nenhum dos pedidos teve sucesso: devolve o último resultado (ou a exceção) para a lógica de retry.
+            return result.result()
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def generate(self, url: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Faz o pedido ao LLM (respeitando os limites) e retorna o JSON da resposta.
+        """
+        with metrics.stage("llm_quota_wait"):
+            await self._acquire_quota(payload)
+        with metrics.stage("llm_call"):
+            return await self._generate(url, payload)
+
+    async def _acquire_quota(self, payload: Dict[str, Any]):
+        # Cada envio (o primeiro, cada nova tentativa e o pedido de reserva) leva o payload inteiro:
+        # todos contam para os dois limites.
+        await self.request_bucket.acquire()
+        await self.token_bucket.acquire(estimate_tokens(payload))
+
+    async def _generate(self, url: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+        for attempt in range(self.max_retries + 1):
+            response = None
+            try:
+                response = await self._post_hedged(url, payload)
+                if response.status_code not in RETRYABLE_STATUS:
+                    response.raise_for_status()
+                    return response.json()
+                error = f"HTTP {response.status_code}"
+            except httpx.TransportError as e:
+                error = f"{type(e).__name__}: {e}"
+            except httpx.HTTPStatusError as e:
+                self.stats["failures"] += 1
+                raise LLMError(f"O LLM recusou o pedido (HTTP {e.response.status_code}): {e.response.text[:500]}") from e
+
+            if attempt == self.max_retries:
+                break
+            self.stats["retries"] += 1
+            await asyncio.sleep(self._backoff(attempt, response))
+            await self._acquire_quota(payload)
+
+        self.stats["failures"] += 1
+        raise LLMError(f"O LLM não respondeu após {self.max_retries + 1} tentativas ({error}).")
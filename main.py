@@ -2,42 +2,39 @@
 # Versão 3.0 - Arquitetura de Assistentes Modulares
 
 import asyncio
+import datetime
 import uuid
 import json
-import sqlite3
-import datetime
-import requests
+import httpx
 import os
 import importlib
+import time
 
 from pydantic import BaseModel
-from fastapi import FastAPI, File, UploadFile, Form, HTTPException
+from fastapi import FastAPI, File, UploadFile, Form, HTTPException, Request, Query
 from fastapi.middleware.cors import CORSMiddleware
-from typing import Dict, Any
+from fastapi.responses import JSONResponse, StreamingResponse
+from starlette.background import BackgroundTask
+from typing import Dict, Any, List, Literal
 from dotenv import load_dotenv
 
+import metrics
+from execution_engine import ExecutionEngine
+from feedback_writer import FeedbackWriter
+from job_store import create_job_store
+from result_cache import ResultCache
+from retrieval import RetrievalUnavailableError, create_retriever
+from scheduler import JobScheduler, SchedulerSaturatedError, extract_deadline, parse_date
+from upload_spool import check_content_length, spool_upload, spool_batch, remove_spooled
+
 # Carregar variáveis de ambiente
 load_dotenv()
 
 # --- Configuração da Aplicação e Banco de Dados ---
 DB_FILE = "feedback.db"
 
-def init_db():
-    # (código do init_db sem alterações)
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    cursor.execute("""
-    CREATE TABLE IF NOT EXISTS feedback (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        timestamp TEXT NOT NULL,
-        form_type TEXT NOT NULL,
-        rag_context TEXT,
-        original_response TEXT NOT NULL,
-        corrected_response TEXT NOT NULL
-    )
-    """)
-    conn.commit()
-    conn.close()
+# Escritor do feedback em lote (fila em memória + uma única tarefa escritora)
+feedback_writer = FeedbackWriter(DB_FILE)
 
 app = FastAPI(
     title="Monster Factory API",
@@ -45,9 +42,39 @@ app = FastAPI(
     version="3.0.0"
 )
 
+# Motor de execução (pools de processos/threads e cliente HTTP assíncrono)
+engine = ExecutionEngine()
+# Escalonador das análises (fila limitada, prioridade pelo prazo fatal, equidade entre tenants)
+scheduler = JobScheduler()
+
+# Métricas (GET /metrics) e X-Request-ID propagado ao gerador
+metrics.install(app)
+metrics.gauge("monsterfactory_scheduler_queue_depth", "Jobs à espera no escalonador.", lambda: scheduler.queue_depth)
+metrics.gauge("monsterfactory_scheduler_running", "Jobs em execução neste worker.", lambda: scheduler.running)
+# Cliente HTTP partilhado (keep-alive) para o serviço de geração
+generator_client: httpx.AsyncClient | None = None
+
 @app.on_event("startup")
 async def startup_event():
-    init_db()
+    global generator_client, retrieval_warmup
+    # A API aceita pedidos já durante o aquecimento da recuperação (ver /health/ready).
+    retrieval_warmup = asyncio.create_task(retriever.start())
+    engine.start()
+    await feedback_writer.start()
+    generator_client = httpx.AsyncClient(
+        base_url=GENERATOR_SERVICE_URL, timeout=90.0,
+        limits=httpx.Limits(max_connections=50, max_keepalive_connections=20)
+    )
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await engine.shutdown()
+    await feedback_writer.close()
+    await generator_client.aclose()
+    retrieval_warmup.cancel()
+    await retriever.close()
+    job_store.close()
+    result_cache.close()
 
 # --- Configurações Gerais (CORS, Constantes, Vector Store) ---
 app.add_middleware(
@@ -55,74 +82,223 @@ app.add_middleware(
     allow_origins=["*"], allow_credentials=True, allow_methods=["*"], allow_headers=["*"],
 )
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY", "")
-GEMINI_API_URL = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-1.5-flash-latest:generateContent?key={GEMINI_API_KEY}"
-GENERATOR_SERVICE_URL = "http://generator:8001"
-
-import pickle
-from langchain_community.vectorstores import FAISS
-from langchain_community.embeddings import HuggingFaceEmbeddings
-VECTOR_STORE_PATH = "vector_store.pkl"
-if os.path.exists(VECTOR_STORE_PATH):
-    with open(VECTOR_STORE_PATH, "rb") as f:
-        vector_store = pickle.load(f)
-else:
-    print("AVISO: vector_store.pkl não encontrado. O RAG não funcionará.")
-    vector_store = None
-
-# --- Banco de Dados em Memória para Jobs ---
-jobs: Dict[str, Dict[str, Any]] = {}
+# GEMINI_API_URL permite apontar para outro endpoint (ex: o stub local gemini_stub.py)
+GEMINI_API_URL = os.getenv(
+    "GEMINI_API_URL",
+    f"https://generativelanguage.googleapis.com/v1beta/models/gemini-1.5-flash-latest:generateContent?key={GEMINI_API_KEY}"
+)
+GENERATOR_SERVICE_URL = os.getenv("GENERATOR_SERVICE_URL", "http://generator:8001")
+# URL do gerador visto pelo browser (links de download)
+GENERATOR_PUBLIC_URL = os.getenv("GENERATOR_PUBLIC_URL", "http://127.0.0.1:8001")
+
+# --- Recuperação (RAG) ---
+# Sem RETRIEVAL_SERVICE_URL, a base vetorial é carregada neste processo, em segundo plano no arranque;
+# com ele, a pesquisa é feita pelo retrieval_service.py e este processo não carrega FAISS nem modelo.
+retriever = create_retriever()
+retrieval_warmup: asyncio.Task | None = None
+
+# --- Cache de Resultados de Análise (endereçado pelo conteúdo do PDF) ---
+result_cache = ResultCache()
+
+# --- Armazenamento de Jobs (persistente, com TTL e despejo LRU, partilhado entre workers) ---
+job_store = create_job_store()
+
+# --- Notificação de Conclusão de Jobs (SSE / long-poll) ---
+# Estados finais: a partir daqui o job não muda mais de estado.
+TERMINAL_STATUSES = {"ready", "failed"}
+# Eventos de conclusão dos jobs que correm neste worker. Jobs de outros workers
+# são acompanhados consultando o job_store a cada JOB_STORE_POLL_INTERVAL segundos.
+job_events: Dict[str, asyncio.Event] = {}
+JOB_STORE_POLL_INTERVAL = float(os.getenv("JOB_STORE_POLL_INTERVAL", "1.0"))
+LONG_POLL_MAX_WAIT = 60.0
+SSE_KEEPALIVE_SECONDS = 15.0
+# --- Análise em Lote ---
+BATCH_ANALYSIS_MAX_FILES = int(os.getenv("BATCH_ANALYSIS_MAX_FILES", "500"))
+# Nº de documentos de um lote analisados em simultâneo (o limite global do escalonador também se aplica)
+BATCH_ANALYSIS_CONCURRENCY = int(os.getenv("BATCH_ANALYSIS_CONCURRENCY", "8"))
+# Tarefas das análises em curso neste worker, por job_id (o asyncio só guarda referências fracas).
+background_tasks: Dict[str, asyncio.Task] = {}
+# Jobs lançados cuja vaga reservada na admissão ainda não passou para a fila do escalonador.
+reserved_jobs: set = set()
+# --- Pré-renderização Especulativa (opt-in: SPECULATIVE_RENDER=1) ---
+# Quando uma análise termina, o gerador renderiza logo os dados extraídos em baixa prioridade;
+# se o utilizador os aceitar sem alterações, /api/v1/generate encontra os ficheiros já prontos.
+SPECULATIVE_RENDER = os.getenv("SPECULATIVE_RENDER", "0").lower() in ("1", "true", "yes")
+prerender_tasks: set = set()
 
 # --- Modelos Pydantic ---
 class Job(BaseModel):
     job_id: str
     status: str
     data: Dict[str, Any] | None = None
+class ReanalysisRequest(BaseModel):
+    corrections: Dict[str, Any]
 class GenerationRequest(BaseModel):
     job_id: str; form_data: Dict[str, Any]; original_data: Dict[str, Any]; rag_context: str | None = None
+    output: Literal["links", "docx", "pdf", "zip"] = "links"
 
 # --- LÓGICA DO ORQUESTRADOR ---
 
-async def run_assistant_in_background(job_id: str, assistant_name: str, **kwargs):
+# Mapeia o nome do assistente para o caminho do módulo
+# Ex: "analise_sumula" -> "assistants.dispensa_assistant.logic"
+# Adicionaremos outros assistentes aqui no futuro
+assistant_map = {
+    "analise_sumula": "assistants.dispensa_assistant"
+}
+
+async def run_assistant_in_background(job_id: str, assistant_name: str, tenant: str = "default",
+                                      deadline: datetime.date | None = None, batch_id: str | None = None,
+                                      batch_parallel: int | None = None, **kwargs):
     """
     Carrega e executa a lógica de um assistente dinamicamente.
+    O job espera a sua vez no escalonador (prioridade pelo prazo, equidade entre tenants
+    e, nos lotes, o limite de paralelismo do lote).
     """
+    # Os pedidos ao gerador feitos por este job levam o job_id como X-Request-ID.
+    metrics.request_id_var.set(job_id)
+    queued = time.perf_counter()
+    reserved = job_id in reserved_jobs
+    reserved_jobs.discard(job_id)
     try:
-        # Mapeia o nome do assistente para o caminho do módulo
-        # Ex: "analise_sumula" -> "assistants.dispensa_assistant.logic"
-        # Adicionaremos outros assistentes aqui no futuro
-        assistant_map = {
-            "analise_sumula": "assistants.dispensa_assistant"
-        }
-        
-        assistant_path = assistant_map.get(assistant_name)
-        if not assistant_path:
-            raise ModuleNotFoundError(f"Assistente '{assistant_name}' não encontrado.")
-
-        # Importa dinamicamente a lógica do assistente
-        logic_module = importlib.import_module(f"{assistant_path}.logic")
-        
-        # Chama a função principal do assistente (assumimos que seja 'run_analysis')
-        # e passa os argumentos necessários
-        result = logic_module.run_analysis(
-            form_type=kwargs.get("form_type"),
-            file_content=kwargs.get("file_content"),
-            vector_store=vector_store,
-            gemini_url=GEMINI_API_URL
-        )
+        async with scheduler.slot(job_id, tenant, deadline, group=batch_id, group_limit=batch_parallel,
+                                  reserved=reserved):
+            metrics.observe_stage("scheduler_wait", time.perf_counter() - queued)
+            # Profiler opcional: jobs lentos deixam um perfil em PROFILE_DIR (ver metrics.py)
+            with metrics.profiler.profile(f"job_{job_id}"), metrics.stage("analysis_total"):
+                assistant_path = assistant_map.get(assistant_name)
+                if not assistant_path:
+                    raise ModuleNotFoundError(f"Assistente '{assistant_name}' não encontrado.")
 
-        # Atualiza o job com o resultado
-        jobs[job_id].update({
-            "status": "ready",
-            "data": result["extracted_data"],
-            "rag_context": result["rag_context"],
-            "form_type": kwargs.get("form_type")
-        })
-        print(f"Job {job_id} (Assistente: {assistant_name}) concluído com sucesso.")
+                # Importa dinamicamente a lógica do assistente
+                logic_module = importlib.import_module(f"{assistant_path}.logic")
+
+                form_type = kwargs.get("form_type")
+                file_hash = kwargs.get("file_hash")
+                # A versão da base vetorial entra nas chaves de cache: espera pelo aquecimento da recuperação.
+                # Sem recuperação pronta o job falha logo, em vez de chegar ao RAG e falhar a meio da análise.
+                if not await retriever.wait_ready():
+                    raise RetrievalUnavailableError(
+                        f"Recuperação (RAG) indisponível: {retriever.error or 'base vetorial ainda a aquecer'}."
+                    )
+                vector_store_version = retriever.version
+
+                # Cache de resultados: chave = PDF + formulário + versão do prompt/schema + versão da base vetorial.
+                cache_key = None
+                result = None
+                if hasattr(logic_module, "get_cache_version"):
+                    cache_key = ":".join([
+                        assistant_name, file_hash, str(form_type),
+                        logic_module.get_cache_version(form_type), vector_store_version
+                    ])
+                    result = await engine.run_io(result_cache.get, "result", cache_key)
+
+                cache_hit = result is not None
+                if not cache_hit:
+                    analysis_args = dict(
+                        form_type=form_type,
+                        file_path=kwargs.get("file_path"),
+                        vector_store=retriever,
+                        gemini_url=GEMINI_API_URL
+                    )
+                    # Assistentes com 'run_analysis_async' usam o motor de execução diretamente;
+                    # os restantes têm o 'run_analysis' síncrono executado no pool de threads.
+                    if hasattr(logic_module, "run_analysis_async"):
+                        result = await logic_module.run_analysis_async(
+                            **analysis_args, engine=engine,
+                            cache=result_cache, file_hash=file_hash, vector_store_version=vector_store_version
+                        )
+                    else:
+                        result = await engine.run_io(logic_module.run_analysis, **analysis_args)
+                    if cache_key is not None:
+                        await engine.run_io(result_cache.set, "result", cache_key, result)
+
+                # Atualiza o job com o resultado
+                await engine.run_io(
+                    job_store.update, job_id,
+                    status="ready",
+                    data=result["extracted_data"],
+                    rag_context=result["rag_context"],
+                    form_type=form_type,
+                    cache_hit=cache_hit,
+                    extraction=result.get("extraction"),
+                    vector_store_version=vector_store_version
+                )
+                print(f"Job {job_id} (Assistente: {assistant_name}) concluído com sucesso.")
+                if SPECULATIVE_RENDER and form_type:
+                    fire_and_forget(request_prerender(job_id, form_type, result["extracted_data"]))
+
+    except asyncio.CancelledError:
+        # Job abandonado (DELETE /api/v1/analysis/{job_id}): o pedido ao LLM em curso também é cancelado.
+        print(f"Job {job_id} cancelado.")
+        await engine.run_io(job_store.update, job_id, status="failed", data={"error": "Análise cancelada."})
+        raise
 
     except Exception as e:
         print(f"Job {job_id} falhou: {e}")
-        jobs[job_id]["status"] = "failed"
-        jobs[job_id]["data"] = {"error": str(e)}
+        await engine.run_io(job_store.update, job_id, status="failed", data={"error": str(e)})
+
+    finally:
+        await engine.run_io(remove_spooled, kwargs.get("file_path"))
+        event = job_events.pop(job_id, None)
+        if event is not None:
+            event.set()
+
+
+def fire_and_forget(coro):
+    task = asyncio.create_task(coro)
+    prerender_tasks.add(task)
+    task.add_done_callback(prerender_tasks.discard)
+
+
+async def request_prerender(job_id: str, form_type: str, form_data: Dict[str, Any]):
+    try:
+        response = await generator_client.post(
+            "/api/v1/prerender", json={"job_id": job_id, "form_type": form_type, "form_data": form_data},
+            headers=metrics.request_headers()
+        )
+        response.raise_for_status()
+    except httpx.HTTPError as e:
+        print(f"AVISO: pré-renderização do job {job_id} não pedida: {e}")
+
+
+async def discard_prerender(job_id: str):
+    try:
+        response = await generator_client.delete(f"/api/v1/prerender/{job_id}", headers=metrics.request_headers())
+        if response.status_code != 404:
+            response.raise_for_status()
+    except httpx.HTTPError as e:
+        print(f"AVISO: pré-renderização do job {job_id} não cancelada: {e}")
+
+
+async def wait_for_job(job_id: str, timeout: float) -> Dict[str, Any] | None:
+    """
+    Aguarda até o job atingir um estado final ou até expirar o timeout.
+    Retorna o estado mais recente do job (ou None se não existir).
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while True:
+        job = await engine.run_io(job_store.get, job_id)
+        remaining = deadline - loop.time()
+        if job is None or job["status"] in TERMINAL_STATUSES or remaining <= 0:
+            return job
+
+        event = job_events.get(job_id)
+        if event is not None:
+            # Job a correr neste worker: acordamos no instante em que terminar.
+            try:
+                await asyncio.wait_for(event.wait(), timeout=remaining)
+            except asyncio.TimeoutError:
+                pass
+        else:
+            await asyncio.sleep(min(remaining, JOB_STORE_POLL_INTERVAL))
+
+
+def build_job_response(job_id: str, job: Dict[str, Any]) -> Job:
+    response_data = job.get("data")
+    if job["status"] == "ready" and response_data:
+        response_data["rag_context"] = job.get("rag_context")
+    return Job(job_id=job_id, status=job["status"], data=response_data)
 
 
 # --- Endpoints da API ---
@@ -131,84 +307,482 @@ async def run_assistant_in_background(job_id: str, assistant_name: str, **kwargs
 def read_root():
     return {"message": "Bem-vindo à Fábrica de Monstros v3.0!"}
 
+# --- Saúde (orquestrador / balanceador) ---
+# Liveness: o processo responde. Readiness: a recuperação (RAG) está carregada e aquecida,
+# local ou no serviço de recuperação; até lá o balanceador não deve encaminhar análises.
+@app.get("/health/live")
+def liveness():
+    return {"status": "alive"}
+
+@app.get("/health/ready")
+def readiness():
+    status = {"status": "ready" if retriever.ready else "warming", "retrieval": retriever.status()}
+    return JSONResponse(status_code=200 if retriever.ready else 503, content=status)
+
+def admit(count: int = 1):
+    """
+    Controlo de admissão: com a fila do escalonador cheia, responde 429 com o Retry-After estimado.
+    Cada vaga admitida fica reservada até o job entrar na fila (submit_job) ou ser devolvida com
+    `scheduler.release_admission` se o upload falhar.
+    """
+    try:
+        scheduler.check_admission(count)
+    except SchedulerSaturatedError as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+
+
+def tenant_of(request: Request) -> str:
+    return request.headers.get("x-tenant-id") or "default"
+
+
+def requested_deadline(prazo_fatal: str | None) -> datetime.date | None:
+    deadline = parse_date(prazo_fatal)
+    if prazo_fatal and deadline is None:
+        raise HTTPException(status_code=400, detail="'prazo_fatal' inválido (use AAAA-MM-DD ou DD/MM/AAAA).")
+    return deadline
+
+
 @app.post("/api/v1/analysis", status_code=202)
 async def start_analysis(
+    request: Request,
     file: UploadFile = File(...),
     assistant_type: str = Form(...), # ex: "analise_sumula"
-    form_type: str = Form(None)      # ex: "autodispensa"
+    form_type: str = Form(None),     # ex: "autodispensa"
+    prazo_fatal: str = Form(None)    # opcional; sem ele o prazo é procurado nas primeiras páginas do PDF
 ):
     if not file.content_type == "application/pdf":
         raise HTTPException(status_code=400, detail="Tipo de arquivo inválido.")
-    
+    check_content_length(request.headers.get("content-length"))
+    deadline = requested_deadline(prazo_fatal)
+    admit()
+
     job_id = str(uuid.uuid4())
-    file_content = await file.read()
-    
-    # Inicializa o job
-    jobs[job_id] = {"status": "processing", "data": None}
-    
+    try:
+        # Copia o PDF em blocos para a pasta de spool (limite de tamanho e assinatura %PDF verificados)
+        with metrics.stage("upload_read"):
+            file_path, file_hash, _ = await engine.run_io(spool_upload, file.file)
+        if deadline is None:
+            deadline = await engine.run_io(extract_deadline, file_path)
+    except BaseException:
+        scheduler.release_admission()
+        raise
+    await submit_job(job_id, assistant_type, form_type, file_path, file_hash,
+                     tenant=tenant_of(request), deadline=deadline)
+    return {"job_id": job_id}
+
+
+async def submit_job(job_id: str, assistant_type: str, form_type: str | None, file_path: str, file_hash: str,
+                     tenant: str = "default", deadline: datetime.date | None = None,
+                     batch_id: str | None = None, batch_parallel: int | None = None, **extra) -> asyncio.Task:
+    """
+    Regista o job e lança a análise em segundo plano. `extra` são campos adicionais do job.
+    Consome uma vaga reservada com `admit()`: passa-a à fila quando o job começa, ou devolve-a se falhar antes.
+    """
+    if batch_id is not None:
+        extra["batch_id"] = batch_id
+    try:
+        # Inicializa o job
+        await engine.run_io(job_store.create, job_id, {
+            "status": "processing", "data": None, "assistant": assistant_type, "form_type": form_type,
+            "file_hash": file_hash, "tenant": tenant, "deadline": deadline.isoformat() if deadline else None, **extra
+        })
+    except BaseException:
+        scheduler.release_admission()
+        await engine.run_io(remove_spooled, file_path)
+        raise
+
     # Cria a tarefa em segundo plano, passando os argumentos para o assistente
-    asyncio.create_task(run_assistant_in_background(
+    job_events[job_id] = asyncio.Event()
+    task = asyncio.create_task(run_assistant_in_background(
         job_id=job_id,
         assistant_name=assistant_type,
+        tenant=tenant,
+        deadline=deadline,
+        batch_id=batch_id,
+        batch_parallel=batch_parallel,
         form_type=form_type,
-        file_content=file_content
+        file_path=file_path,
+        file_hash=file_hash
     ))
-    
-    return {"job_id": job_id}
+    background_tasks[job_id] = task
+    reserved_jobs.add(job_id)
+    task.add_done_callback(lambda _: release_unused_reservation(job_id))
+    return task
+
+
+def release_unused_reservation(job_id: str):
+    background_tasks.pop(job_id, None)
+    # Tarefa cancelada antes de começar: a vaga reservada nunca chegou à fila
+    if job_id in reserved_jobs:
+        reserved_jobs.discard(job_id)
+        scheduler.release_admission()
 
 
 @app.get("/api/v1/analysis/{job_id}/status", response_model=Job)
-def get_analysis_status(job_id: str):
-    job = jobs.get(job_id)
+async def get_analysis_status(job_id: str, wait: float = Query(0, ge=0, le=LONG_POLL_MAX_WAIT)):
+    """
+    Retorna o estado do job. Com `wait` > 0 funciona como long-poll: a resposta só é enviada
+    quando o job terminar ou quando passarem `wait` segundos.
+    """
+    if wait > 0:
+        job = await wait_for_job(job_id, wait)
+    else:
+        job = await engine.run_io(job_store.get, job_id)
     if not job:
         raise HTTPException(status_code=404, detail="Trabalho não encontrado.")
-    
-    response_data = job.get("data")
-    if job["status"] == "ready" and response_data:
-        response_data["rag_context"] = job.get("rag_context")
 
-    return Job(job_id=job_id, status=job["status"], data=response_data)
+    return build_job_response(job_id, job)
+
+
+@app.get("/api/v1/analysis/{job_id}/events")
+async def stream_analysis_events(job_id: str, request: Request):
+    """
+    Stream Server-Sent Events com o estado do job. Envia o estado atual, comentários
+    de keep-alive enquanto o job corre e o estado final assim que estiver disponível.
+    """
+    job = await engine.run_io(job_store.get, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Trabalho não encontrado.")
+
+    async def event_stream():
+        current = job
+        yield f"event: status\ndata: {build_job_response(job_id, current).model_dump_json()}\n\n"
+        while current["status"] not in TERMINAL_STATUSES:
+            if await request.is_disconnected():
+                return
+            current = await wait_for_job(job_id, SSE_KEEPALIVE_SECONDS)
+            if current is None:
+                return
+            if current["status"] in TERMINAL_STATUSES:
+                yield f"event: status\ndata: {build_job_response(job_id, current).model_dump_json()}\n\n"
+            else:
+                yield ": keep-alive\n\n"
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@app.delete("/api/v1/analysis/{job_id}")
+async def cancel_analysis(job_id: str):
+    """
+    Cancela uma análise em curso (ex: o utilizador abandonou a página). O pedido ao LLM é interrompido.
+    """
+    task = background_tasks.get(job_id)
+    if task is None:
+        job = await engine.run_io(job_store.get, job_id)
+        if not job:
+            raise HTTPException(status_code=404, detail="Job não encontrado.")
+        if job["status"] not in TERMINAL_STATUSES:
+            raise HTTPException(status_code=409, detail="O job está a ser processado por outro worker.")
+        return {"job_id": job_id, "status": job["status"]}
+    task.cancel()
+    return {"job_id": job_id, "status": "cancelling"}
+
+
+# Tipos Python aceites nas correções, por tipo do schema de resposta do Gemini
+SCHEMA_VALUE_TYPES = {"STRING": (str,), "NUMBER": (int, float), "INTEGER": (int,), "BOOLEAN": (bool,)}
+
+
+def mistyped_fields(values: Dict[str, Any], json_schema: dict) -> List[str]:
+    """
+    Campos cujo valor não tem o tipo declarado no schema (ex: um número num campo STRING).
+    """
+    mistyped = []
+    for field, value in values.items():
+        expected = SCHEMA_VALUE_TYPES.get(json_schema[field].get("type"))
+        if expected is None:
+            continue
+        # bool é subclasse de int em Python, mas não é um NUMBER/INTEGER válido
+        if not isinstance(value, expected) or (isinstance(value, bool) and bool not in expected):
+            mistyped.append(f"{field} ({json_schema[field]['type']})")
+    return mistyped
+
+
+@app.post("/api/v1/analysis/{job_id}/reanalyze")
+async def reanalyze(job_id: str, request: ReanalysisRequest):
+    """
+    Reanálise incremental: aplica as correções do analista ao job e deriva de novo só os campos
+    que delas dependem (ex: a fundamentação depois de corrigir o valor da condenação), a partir do
+    texto da decisão e do contexto RAG da análise original. O job é atualizado no próprio lugar.
+    """
+    job = await engine.run_io(job_store.get, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Trabalho não encontrado.")
+    if job["status"] != "ready":
+        raise HTTPException(status_code=409, detail="O trabalho ainda não tem resultado para corrigir.")
+
+    assistant_path = assistant_map.get(job.get("assistant"))
+    logic_module = importlib.import_module(f"{assistant_path}.logic") if assistant_path else None
+    if not hasattr(logic_module, "run_reanalysis_async"):
+        raise HTTPException(status_code=400, detail="Este assistente não suporta reanálise incremental.")
+    json_schema = logic_module.get_schema(job["form_type"]) or {}
+    unknown = set(request.corrections) - set(json_schema)
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Campos desconhecidos: {', '.join(sorted(unknown))}.")
+    mistyped = mistyped_fields(request.corrections, json_schema)
+    if mistyped:
+        raise HTTPException(status_code=400, detail=f"Valores com tipo inválido: {', '.join(sorted(mistyped))}.")
+    corrections = {field: value for field, value in request.corrections.items() if job["data"].get(field) != value}
+
+    try:
+        updated = await logic_module.run_reanalysis_async(
+            job["form_type"], corrections, GEMINI_API_URL, engine, result_cache, job["file_hash"],
+            vector_store_version=job.get("vector_store_version", retriever.version)
+        )
+    except Exception as e:
+        raise HTTPException(status_code=502, detail=f"A reanálise falhou: {e}")
+    if updated is None:
+        raise HTTPException(status_code=409, detail="O texto da decisão já não está em cache. Submeta o PDF novamente.")
+
+    data = {**job["data"], **corrections, **updated}
+    await engine.run_io(job_store.update, job_id, data=data)
+    if SPECULATIVE_RENDER and data != job["data"]:
+        fire_and_forget(discard_prerender(job_id))
+    return {"job_id": job_id, "corrected_fields": sorted(corrections), "updated_fields": updated, "data": data}
+
+
+# --- Análise em Lote ---
+
+def batch_key(batch_id: str) -> str:
+    # Os lotes partilham o job_store com os jobs, num espaço de chaves próprio.
+    return f"batch:{batch_id}"
+
+def load_jobs(job_ids: List[str]) -> List[Dict[str, Any] | None]:
+    return [job_store.get(job_id) for job_id in job_ids]
+
+def ndjson_line(item: Dict[str, Any]) -> bytes:
+    return (json.dumps(item, ensure_ascii=False) + "\n").encode("utf-8")
+
+def batch_result_line(entry: Dict[str, Any], job: Dict[str, Any] | None) -> Dict[str, Any]:
+    job = job or {"status": "failed", "data": {"error": "Job não encontrado."}}
+    return {
+        "job_id": entry["job_id"], "filename": entry["filename"], "status": job["status"],
+        "data": job.get("data"), "cache_hit": job.get("cache_hit", False)
+    }
+
+async def stream_batch_results(batch_id: str, entries: List[Dict[str, Any]]):
+    """
+    NDJSON: cabeçalho com o batch_id, uma linha por documento pela ordem de conclusão e um resumo final.
+    """
+    yield ndjson_line({"batch_id": batch_id, "total": len(entries)})
+    counts = {"ready": 0, "failed": 0}
+    pending = {}
+    for entry in entries:
+        task = background_tasks.get(entry["job_id"])
+        if task is not None:
+            pending[task] = entry
+        else:
+            # Rejeitado na receção (ou já terminado): o resultado já está no job_store.
+            line = batch_result_line(entry, await engine.run_io(job_store.get, entry["job_id"]))
+            counts[line["status"]] = counts.get(line["status"], 0) + 1
+            yield ndjson_line(line)
+
+    while pending:
+        done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            entry = pending.pop(task)
+            line = batch_result_line(entry, await engine.run_io(job_store.get, entry["job_id"]))
+            counts[line["status"]] = counts.get(line["status"], 0) + 1
+            yield ndjson_line(line)
+
+    yield ndjson_line({"batch_id": batch_id, "done": True, **counts})
+
+
+@app.post("/api/v1/analysis/batch")
+async def start_batch_analysis(
+    request: Request,
+    files: List[UploadFile] = File(None),
+    archive: UploadFile = File(None),
+    assistant_type: str = Form(...),
+    form_type: str = Form(None),
+    max_parallel: int = Form(BATCH_ANALYSIS_CONCURRENCY, ge=1, le=64),
+    prazo_fatal: str = Form(None)
+):
+    """
+    Analisa vários PDFs (lista multipart em `files` e/ou um ZIP em `archive`) com o mesmo assistente e formulário.
+    A resposta é NDJSON, com o resultado de cada documento enviado assim que a sua análise termina.
+    O lote continua a correr se o cliente desligar: ver GET /api/v1/analysis/batch/{batch_id}.
+    """
+    if assistant_type not in assistant_map:
+        raise HTTPException(status_code=400, detail=f"Assistente '{assistant_type}' não encontrado.")
+    uploads = [(upload.filename, upload.file) for upload in files or [] if upload.filename]
+    if not uploads and archive is None:
+        raise HTTPException(status_code=400, detail="Envie os PDFs em 'files' ou um ZIP em 'archive'.")
+    batch_deadline = requested_deadline(prazo_fatal)
+    admit()
+
+    try:
+        with metrics.stage("upload_read"):
+            spooled = await engine.run_io(
+                spool_batch, uploads, archive.file if archive is not None else None, BATCH_ANALYSIS_MAX_FILES
+            )
+    except BaseException:
+        scheduler.release_admission()
+        raise
+    if not spooled:
+        scheduler.release_admission()
+        raise HTTPException(status_code=400, detail="O lote não contém nenhum PDF.")
+    valid = sum(1 for _, path, _, _ in spooled if path is not None)
+    reserved = 1
+    try:
+        # O lote só é aceite por inteiro (a vaga do pedido já foi reservada acima)
+        if valid > 1:
+            admit(valid - 1)
+            reserved = valid
+        deadlines = await asyncio.gather(*(
+            engine.run_io(extract_deadline, path) if path is not None and batch_deadline is None
+            else asyncio.sleep(0, batch_deadline)
+            for _, path, _, _ in spooled
+        ))
+    except BaseException:
+        scheduler.release_admission(reserved)
+        for _, path, _, _ in spooled:
+            await engine.run_io(remove_spooled, path)
+        raise
+    # Lote só com ficheiros inválidos: nenhum job chega à fila
+    scheduler.release_admission(reserved - valid)
+
+    batch_id = str(uuid.uuid4())
+    entries = [{"job_id": str(uuid.uuid4()), "filename": name} for name, _, _, _ in spooled]
+    try:
+        await engine.run_io(job_store.create, batch_key(batch_id), {
+            "status": "processing", "assistant_type": assistant_type, "form_type": form_type, "jobs": entries
+        })
+    except BaseException:
+        scheduler.release_admission(valid)
+        for _, path, _, _ in spooled:
+            await engine.run_io(remove_spooled, path)
+        raise
+
+    tenant = tenant_of(request)
+    for i, (entry, (_, file_path, file_hash, error), deadline) in enumerate(zip(entries, spooled, deadlines)):
+        try:
+            if error is not None:
+                await engine.run_io(job_store.create, entry["job_id"], {
+                    "status": "failed", "data": {"error": error}, "form_type": form_type, "batch_id": batch_id
+                })
+            else:
+                await submit_job(entry["job_id"], assistant_type, form_type, file_path, file_hash,
+                                 tenant=tenant, deadline=deadline, batch_id=batch_id, batch_parallel=max_parallel)
+        except BaseException:
+            # submit_job já devolveu a vaga deste documento; devolve as dos que não chegaram a ser lançados
+            scheduler.release_admission(sum(1 for _, path, _, _ in spooled[i + 1:] if path is not None))
+            for _, remaining_path, _, _ in spooled[i + 1:]:
+                await engine.run_io(remove_spooled, remaining_path)
+            raise
+
+    return StreamingResponse(
+        stream_batch_results(batch_id, entries),
+        media_type="application/x-ndjson",
+        headers={"X-Batch-ID": batch_id, "X-Accel-Buffering": "no"}
+    )
+
+
+@app.get("/api/v1/analysis/batch/{batch_id}")
+async def get_batch_status(batch_id: str, include_results: bool = False):
+    """
+    Estado do lote: contagem por estado e estado de cada documento (com os dados se `include_results`).
+    """
+    batch = await engine.run_io(job_store.get, batch_key(batch_id))
+    if not batch:
+        raise HTTPException(status_code=404, detail="Lote não encontrado.")
+    jobs = await engine.run_io(load_jobs, [entry["job_id"] for entry in batch["jobs"]])
+
+    counts: Dict[str, int] = {}
+    items = []
+    for entry, job in zip(batch["jobs"], jobs):
+        line = batch_result_line(entry, job)
+        counts[line["status"]] = counts.get(line["status"], 0) + 1
+        if not include_results:
+            line = {key: line[key] for key in ("job_id", "filename", "status")}
+        items.append(line)
+
+    finished = sum(counts.get(status, 0) for status in TERMINAL_STATUSES)
+    status = batch["status"] if batch["status"] == "cancelled" or finished < len(items) else "completed"
+    return {"batch_id": batch_id, "status": status, "total": len(items), "counts": counts, "jobs": items}
+
+
+@app.delete("/api/v1/analysis/batch/{batch_id}")
+async def cancel_batch(batch_id: str):
+    """
+    Cancela os documentos do lote que ainda não terminaram (os concluídos mantêm o resultado).
+    """
+    batch = await engine.run_io(job_store.update, batch_key(batch_id), status="cancelled")
+    if not batch:
+        raise HTTPException(status_code=404, detail="Lote não encontrado.")
+    cancelled = 0
+    for entry in batch["jobs"]:
+        task = background_tasks.get(entry["job_id"])
+        if task is not None and task.cancel():
+            cancelled += 1
+    return {"batch_id": batch_id, "status": "cancelled", "cancelled_jobs": cancelled}
+
+
+@app.get("/api/v1/cache/stats")
+def get_cache_stats():
+    """
+    Estatísticas do cache de análises (entradas, bytes, acertos e falhas deste worker).
+    """
+    return result_cache.stats()
+
+
+@app.get("/api/v1/scheduler/stats")
+def get_scheduler_stats():
+    """
+    Métricas do escalonador deste worker (profundidade da fila, análises em curso, tempos de espera).
+    """
+    return scheduler.stats()
 
 
 @app.post("/api/v1/generate")
-def generate_documents(request: GenerationRequest):
-    # (Este endpoint não precisa de alterações)
-    job = jobs.get(request.job_id)
+async def generate_documents(request: GenerationRequest):
+    """
+    Gera os documentos finais. Com `output` = "links" (padrão) o gerador grava os ficheiros e
+    são devolvidos os URLs de download; com "docx", "pdf" ou "zip" o documento é gerado em memória
+    e transmitido diretamente nesta resposta.
+    """
+    job = await engine.run_io(job_store.get, request.job_id)
     if not job or job["status"] != "ready":
         raise HTTPException(status_code=400, detail="O trabalho não está pronto para geração.")
 
     if request.original_data != request.form_data:
-        # (lógica de salvar feedback sem alterações)
-        try:
-            conn = sqlite3.connect(DB_FILE)
-            cursor = conn.cursor()
-            cursor.execute(
-                "INSERT INTO feedback (timestamp, form_type, rag_context, original_response, corrected_response) VALUES (?, ?, ?, ?, ?)",
-                (
-                    datetime.datetime.now().isoformat(),
-                    job["form_type"],
-                    request.rag_context,
-                    json.dumps(request.original_data),
-                    json.dumps(request.form_data)
-                )
-            )
-            conn.commit()
-            conn.close()
-        except Exception as e:
-            print(f"ERRO ao guardar feedback: {e}")
+        feedback_writer.submit(job["form_type"], request.rag_context, request.original_data, request.form_data)
+    if SPECULATIVE_RENDER and request.form_data != job.get("data"):
+        # Dados alterados: a pré-renderização não serve e liberta-se o LibreOffice.
+        fire_and_forget(discard_prerender(request.job_id))
 
     payload = {"form_type": job["form_type"], "form_data": request.form_data}
-    internal_generator_url = f"{GENERATOR_SERVICE_URL}/api/v1/generate-document"
-    public_download_url = "http://127.0.0.1:8001/download"
+    headers = {**metrics.request_headers(), "X-Job-ID": request.job_id}
 
     try:
-        response = requests.post(internal_generator_url, json=payload, timeout=90.0)
-        response.raise_for_status()
-        result = response.json()
-        return {
-            "message": result["message"],
-            "docx_url": f"{public_download_url}/{result['docx_filename']}",
-            "pdf_url": f"{public_download_url}/{result['pdf_filename']}"
-        }
-    except requests.exceptions.RequestException as e:
-        raise HTTPException(status_code=503, detail=f"Não foi possível conectar ao serviço de geração: {e}")
\ No newline at end of file
+        if request.output == "links":
+            response = await generator_client.post("/api/v1/generate-document", json=payload, headers=headers)
+            response.raise_for_status()
+            result = response.json()
+            return {
+                "message": result["message"],
+                "docx_url": f"{GENERATOR_PUBLIC_URL}/download/{result['docx_filename']}",
+                "pdf_url": f"{GENERATOR_PUBLIC_URL}/download/{result['pdf_filename']}"
+            }
+
+        # Caminho sem disco: os bytes do gerador são reencaminhados à medida que chegam.
+        upstream = await generator_client.send(
+            generator_client.build_request("POST", "/api/v1/render", params={"output": request.output}, json=payload,
+                                           headers=headers),
+            stream=True
+        )
+        if upstream.is_error:
+            await upstream.aread()
+            await upstream.aclose()
+            upstream.raise_for_status()
+        return StreamingResponse(
+            upstream.aiter_raw(),
+            media_type=upstream.headers.get("content-type"),
+            headers={"Content-Disposition": upstream.headers.get("content-disposition", "attachment")},
+            background=BackgroundTask(upstream.aclose)
+        )
+    except httpx.HTTPError as e:
+        raise HTTPException(status_code=503, detail=f"Não foi possível conectar ao serviço de geração: {e}")
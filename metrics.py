@@ -0,0 +1,268 @@
+# metrics.py
+# Métricas de latência por etapa, partilhadas por todos os serviços (API, gerador, treino, embeddings).
+#
+# - Histogramas no formato de texto do Prometheus, expostos em GET /metrics (sem dependências externas,
+#   para que serviços leves como o de treino não precisem do prometheus_client).
+# - `with stage("pdf_extraction"): ...` mede uma etapa (funciona em código síncrono, em threads e em corrotinas).
+# - Middleware HTTP: duração de cada pedido por rota e um X-Request-ID propagado entre serviços
+#   (a API envia-o ao gerador; os erros 5xx são registados com ele).
+# - Profiler por amostragem opcional: jobs mais lentos do que PROFILE_SLOW_JOBS_SECONDS deixam um
+#   ficheiro de pilhas "collapsed" (flamegraph.pl / speedscope) em PROFILE_DIR.
+#
+# Configuração via variáveis de ambiente:
+#   PROFILE_SLOW_JOBS_SECONDS -> duração a partir da qual um job é gravado pelo profiler (0 = desligado)
+#   PROFILE_SAMPLE_INTERVAL   -> intervalo (s) entre amostras de pilhas
+#   PROFILE_DIR               -> pasta dos perfis gravados
+
+import bisect
+import contextvars
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Tuple
+
+PROFILE_SLOW_JOBS_SECONDS = float(os.getenv("PROFILE_SLOW_JOBS_SECONDS", "0"))
+PROFILE_SAMPLE_INTERVAL = float(os.getenv("PROFILE_SAMPLE_INTERVAL", "0.01"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+REQUEST_ID_HEADER = "X-Request-ID"
+
+# ID do pedido (ou do job) em curso; as tarefas criadas a partir do pedido herdam-no.
+request_id_var: contextvars.ContextVar[str] = contextvars.ContextVar("request_id", default="")
+
+
+# --- Registo de métricas ---
+
+def _format_labels(labels: Iterable[Tuple[str, str]]) -> str:
+    parts = []
+    for name, value in labels:
+        value = str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        parts.append(f'{name}="{value}"')
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = tuple(sorted(buckets))
+        # labels -> (contagens por bucket, soma, total)
+        self._series: Dict[Tuple[str, ...], Tuple[List[int], List[float]]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels: str):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = ([0] * (len(self.buckets) + 1), [0.0])
+            series[0][index] += 1
+            series[1][0] += value
+
+    def collect(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            snapshot = [(labels, list(counts), total[0]) for labels, (counts, total) in sorted(self._series.items())]
+        for labels, counts, total in snapshot:
+            base = list(zip(self.labelnames, labels))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f"{self.name}_bucket{_format_labels(base + [('le', le)])} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(base)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(base)} {cumulative}")
+        return lines
+
+
+class Gauge:
+    """
+    Valor lido no momento da recolha (ex: profundidade da fila do escalonador).
+    """
+
+    def __init__(self, name: str, documentation: str, func: Callable[[], float]):
+        self.name = name
+        self.documentation = documentation
+        self.func = func
+
+    def collect(self) -> List[str]:
+        try:
+            value = float(self.func())
+        except Exception:
+            return []
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} gauge", f"{self.name} {value}"]
+
+
+_registry: Dict[str, Histogram | Gauge] = {}
+
+
+def register(metric):
+    _registry[metric.name] = metric
+    return metric
+
+
+def gauge(name: str, documentation: str, func: Callable[[], float]) -> Gauge:
+    return register(Gauge(name, documentation, func))
+
+
+def render_metrics() -> str:
+    lines = []
+    for metric in list(_registry.values()):
+        lines.extend(metric.collect())
+    return "\n".join(lines) + "\n"
+
+
+STAGE_SECONDS = register(Histogram(
+    "monsterfactory_stage_seconds", "Duração de cada etapa do processamento (segundos).", ("stage",)
+))
+HTTP_REQUEST_SECONDS = register(Histogram(
+    "monsterfactory_http_request_seconds", "Duração dos pedidos HTTP (segundos).", ("method", "route", "status")
+))
+
+
+@contextmanager
+def stage(name: str):
+    """
+    Mede a duração de uma etapa. Uso: `with stage("template_render"): ...`
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - started, name)
+
+
+def observe_stage(name: str, seconds: float):
+    STAGE_SECONDS.observe(seconds, name)
+
+
+# --- Pedidos HTTP e X-Request-ID ---
+
+def request_headers() -> Dict[str, str]:
+    """
+    Cabeçalhos a enviar nas chamadas a outros serviços, para correlacionar os pedidos.
+    """
+    request_id = request_id_var.get()
+    return {REQUEST_ID_HEADER: request_id} if request_id else {}
+
+
+def install(app):
+    """
+    Adiciona a uma aplicação FastAPI o endpoint GET /metrics e o middleware de duração/X-Request-ID.
+    """
+    from fastapi import Request
+    from fastapi.responses import PlainTextResponse
+
+    @app.middleware("http")
+    async def metrics_middleware(request: Request, call_next):
+        request_id = request.headers.get(REQUEST_ID_HEADER) or uuid.uuid4().hex
+        token = request_id_var.set(request_id)
+        started = time.perf_counter()
+        status = 500
+        try:
+            response = await call_next(request)
+            status = response.status_code
+            response.headers[REQUEST_ID_HEADER] = request_id
+            return response
+        finally:
+            route = request.scope.get("route")
+            route_path = getattr(route, "path", "unmatched")
+            if route_path != "/metrics":
+                HTTP_REQUEST_SECONDS.observe(time.perf_counter() - started, request.method, route_path, str(status))
+            # O 503 das sondas de readiness durante o aquecimento é esperado, não é um erro.
+            if status >= 500 and not route_path.startswith("/health/"):
+                print(f"ERRO {request.method} {request.url.path} -> {status} (request_id={request_id})")
+            request_id_var.reset(token)
+
+    @app.get("/metrics", include_in_schema=False)
+    def metrics_endpoint():
+        return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+
+# --- Profiler por amostragem para jobs lentos ---
+
+class SamplingProfiler:
+    """
+    Amostra as pilhas de todas as threads enquanto houver jobs a ser perfilados. As amostras cobrem
+    o processo inteiro (o event loop é partilhado pelos jobs): o perfil de um job lento mostra o que
+    o worker estava a fazer durante esse job. Etapas no pool de processos não aparecem.
+    """
+
+    def __init__(self, interval: float = PROFILE_SAMPLE_INTERVAL, directory: str = PROFILE_DIR):
+        self.interval = interval
+        self.directory = directory
+        self._sessions: Dict[int, Counter] = {}
+        self._lock = threading.Lock()
+        self._thread: threading.Thread | None = None
+
+    @staticmethod
+    def _collapse(frame, thread_name: str) -> str:
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+            frame = frame.f_back
+        return ";".join([thread_name] + stack[::-1])
+
+    def _sample_loop(self):
+        own_id = threading.get_ident()
+        while True:
+            with self._lock:
+                if not self._sessions:
+                    self._thread = None
+                    return
+                sessions = list(self._sessions.values())
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            stacks = [
+                self._collapse(frame, names.get(thread_id, str(thread_id)))
+                for thread_id, frame in sys._current_frames().items() if thread_id != own_id
+            ]
+            for samples in sessions:
+                samples.update(stacks)
+            time.sleep(self.interval)
+
+    @contextmanager
+    def profile(self, name: str, threshold: float = PROFILE_SLOW_JOBS_SECONDS):
+        """
+        Perfila o bloco e grava as amostras se durar `threshold` segundos ou mais (0 = desligado).
+        """
+        if threshold <= 0:
+            yield
+            return
+        samples = Counter()
+        session = id(samples)
+        with self._lock:
+            self._sessions[session] = samples
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._sample_loop, name="profiler", daemon=True)
+                self._thread.start()
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._sessions.pop(session, None)
+            elapsed = time.perf_counter() - started
+            if elapsed >= threshold and samples:
+                self._save(name, elapsed, samples)
+
+    def _save(self, name: str, elapsed: float, samples: Counter):
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            path = os.path.join(self.directory, f"{name}.collapsed.txt")
+            with open(path, "w", encoding="utf-8") as f:
+                for stack, count in samples.most_common():
+                    f.write(f"{stack} {count}\n")
+            print(f"AVISO: '{name}' demorou {elapsed:.1f}s; perfil gravado em {path}")
+        except OSError as e:
+            print(f"ERRO ao gravar o perfil de '{name}': {e}")
+
+
+profiler = SamplingProfiler()
@@ -0,0 +1,434 @@
+# office_pool.py
+# Pool de instâncias LibreOffice headless de longa duração para conversão DOCX -> PDF.
+#
+# Cada instância tem o seu próprio perfil (UserInstallation), pelo que pedidos concorrentes não
+# disputam o mesmo perfil, e fica à escuta num socket UNO: a conversão não paga o arranque a frio.
+# Se o módulo 'uno' (pacote python3-uno) não estiver disponível, cada slot do pool converte
+# com `soffice --convert-to`, ainda assim com perfil isolado e concorrência limitada.
+#
+# Configuração via variáveis de ambiente:
+#   OFFICE_POOL_SIZE              -> nº de instâncias LibreOffice
+#   OFFICE_POOL_BASE_PORT         -> porta UNO da primeira instância (as seguintes usam +1, +2, ...)
+#   OFFICE_MAX_CONVERSIONS        -> reciclar a instância após N conversões
+#   OFFICE_CONVERSION_TIMEOUT     -> timeout (s) de cada conversão
+#   OFFICE_MAX_QUEUE              -> nº máximo de pedidos à espera de uma instância (backpressure)
+#   OFFICE_HEALTHCHECK_INTERVAL   -> intervalo (s) entre verificações de saúde das instâncias livres
+#   OFFICE_PROFILE_ROOT           -> pasta onde são criados os perfis das instâncias
+#   OFFICE_SPOOL_DIR              -> pasta temporária da alternativa sem UNO (padrão: /dev/shm, em memória)
+
+import asyncio
+import io
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+
+SOFFICE_BINARY = os.getenv("SOFFICE_BINARY", "soffice")
+OFFICE_POOL_SIZE = int(os.getenv("OFFICE_POOL_SIZE", "2"))
+OFFICE_POOL_BASE_PORT = int(os.getenv("OFFICE_POOL_BASE_PORT", "2002"))
+OFFICE_MAX_CONVERSIONS = int(os.getenv("OFFICE_MAX_CONVERSIONS", "200"))
+OFFICE_CONVERSION_TIMEOUT = float(os.getenv("OFFICE_CONVERSION_TIMEOUT", "60"))
+OFFICE_MAX_QUEUE = int(os.getenv("OFFICE_MAX_QUEUE", "32"))
+OFFICE_HEALTHCHECK_INTERVAL = float(os.getenv("OFFICE_HEALTHCHECK_INTERVAL", "30"))
+OFFICE_PROFILE_ROOT = os.getenv("OFFICE_PROFILE_ROOT", os.path.join(tempfile.gettempdir(), "office_pool"))
+OFFICE_SPOOL_DIR = os.getenv("OFFICE_SPOOL_DIR", "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir())
+OFFICE_STARTUP_TIMEOUT = 60.0
+# Intervalo (s) com que as conversões de baixa prioridade verificam se há uma instância sobrante
+BACKGROUND_POLL_INTERVAL = 0.1
+
+try:
+    import uno
+    import unohelper
+    from com.sun.star.beans import PropertyValue
+    from com.sun.star.io import XOutputStream
+    UNO_AVAILABLE = True
+except ImportError:
+    UNO_AVAILABLE = False
+
+
+class PoolSaturatedError(Exception):
+    """A fila de conversões está cheia; o cliente deve tentar mais tarde."""
+
+
+class ConversionTimeoutError(Exception):
+    """A conversão excedeu OFFICE_CONVERSION_TIMEOUT."""
+
+
+class ConversionError(Exception):
+    """O LibreOffice não conseguiu converter o documento."""
+
+
+def _profile_url(profile_dir: str) -> str:
+    return "file://" + os.path.abspath(profile_dir)
+
+
+if UNO_AVAILABLE:
+    class _BytesOutputStream(unohelper.Base, XOutputStream):
+        """
+        XOutputStream que acumula em memória o que o LibreOffice escreve (ex: o PDF exportado).
+        """
+
+        def __init__(self):
+            self.buffer = io.BytesIO()
+
+        def writeBytes(self, data):
+            self.buffer.write(data.value)
+
+        def flush(self):
+            pass
+
+        def closeOutput(self):
+            pass
+
+
+class UnoOfficeInstance:
+    """
+    Uma instância `soffice --headless` de longa duração controlada por UNO.
+    """
+
+    def __init__(self, slot: int, port: int, profile_dir: str):
+        self.slot = slot
+        self.port = port
+        self.profile_dir = profile_dir
+        self.process: subprocess.Popen | None = None
+        self.context = None
+        self.desktop = None
+        self.conversions = 0
+
+    def start(self):
+        os.makedirs(self.profile_dir, exist_ok=True)
+        self.process = subprocess.Popen(
+            [
+                SOFFICE_BINARY, "--headless", "--invisible", "--nologo", "--nodefault", "--norestore", "--nolockcheck",
+                f"-env:UserInstallation={_profile_url(self.profile_dir)}",
+                f"--accept=socket,host=127.0.0.1,port={self.port};urp;StarOffice.ComponentContext",
+            ],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        local_context = uno.getComponentContext()
+        resolver = local_context.ServiceManager.createInstanceWithContext("com.sun.star.bridge.UnoUrlResolver", local_context)
+        deadline = time.monotonic() + OFFICE_STARTUP_TIMEOUT
+        while True:
+            try:
+                context = resolver.resolve(f"uno:socket,host=127.0.0.1,port={self.port};urp;StarOffice.ComponentContext")
+                break
+            except Exception:
+                if self.process.poll() is not None or time.monotonic() > deadline:
+                    self.stop()
+                    raise ConversionError(f"Não foi possível iniciar a instância LibreOffice do slot {self.slot}.")
+                time.sleep(0.25)
+        self.context = context
+        self.desktop = context.ServiceManager.createInstanceWithContext("com.sun.star.frame.Desktop", context)
+        self.conversions = 0
+
+    def stop(self):
+        if self.desktop is not None:
+            try:
+                self.desktop.terminate()
+            except Exception:
+                pass
+            self.desktop = None
+        if self.process is not None:
+            try:
+                self.process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+            self.process = None
+
+    def kill(self):
+        # Usado quando a conversão ficou presa: a chamada UNO pendente falha e liberta a thread.
+        if self.process is not None and self.process.poll() is None:
+            self.process.kill()
+
+    def is_healthy(self) -> bool:
+        if self.process is None or self.process.poll() is not None or self.desktop is None:
+            return False
+        try:
+            self.desktop.getComponents()
+            return True
+        except Exception:
+            return False
+
+    @staticmethod
+    def _properties(**values):
+        return tuple(PropertyValue(Name=name, Value=value) for name, value in values.items())
+
+    def convert_bytes(self, docx_bytes: bytes) -> bytes:
+        """
+        Conversão totalmente em memória: o DOCX entra e o PDF sai por streams UNO, sem tocar no disco.
+        """
+        input_stream = self.context.ServiceManager.createInstanceWithArgumentsAndContext(
+            "com.sun.star.io.SequenceInputStream", (uno.ByteSequence(docx_bytes),), self.context
+        )
+        document = self.desktop.loadComponentFromURL(
+            "private:stream", "_blank", 0,
+            self._properties(Hidden=True, ReadOnly=True, InputStream=input_stream)
+        )
+        if document is None:
+            raise ConversionError("O LibreOffice não conseguiu abrir o documento.")
+        output_stream = _BytesOutputStream()
+        try:
+            document.storeToURL(
+                "private:stream",
+                self._properties(FilterName="writer_pdf_Export", OutputStream=output_stream)
+            )
+        finally:
+            document.close(True)
+        return output_stream.buffer.getvalue()
+
+    def convert_many_bytes(self, docx_list: List[bytes]) -> List[bytes | Exception]:
+        """
+        Converte vários documentos na mesma instância; cada falha é devolvida no lugar do PDF.
+        """
+        results = []
+        for docx_bytes in docx_list:
+            try:
+                results.append(self.convert_bytes(docx_bytes))
+            except Exception as e:
+                results.append(ConversionError(str(e)))
+        return results
+
+
+class SubprocessOfficeInstance:
+    """
+    Alternativa sem UNO: um processo `soffice --convert-to` por conversão, com o perfil do slot.
+    """
+
+    def __init__(self, slot: int, port: int, profile_dir: str):
+        self.slot = slot
+        self.profile_dir = profile_dir
+        self.process: subprocess.Popen | None = None
+        self.conversions = 0
+
+    def start(self):
+        os.makedirs(self.profile_dir, exist_ok=True)
+        if shutil.which(SOFFICE_BINARY) is None:
+            raise FileNotFoundError(SOFFICE_BINARY)
+        self.conversions = 0
+
+    def stop(self):
+        self.kill()
+
+    def kill(self):
+        if self.process is not None and self.process.poll() is None:
+            self.process.kill()
+
+    def is_healthy(self) -> bool:
+        return True
+
+    def _run_soffice(self, docx_paths: List[str], outdir: str):
+        # Uma só invocação do soffice converte todos os ficheiros indicados.
+        self.process = subprocess.Popen(
+            [
+                SOFFICE_BINARY, "--headless", "--norestore", "--nolockcheck",
+                f"-env:UserInstallation={_profile_url(self.profile_dir)}",
+                "--convert-to", "pdf", "--outdir", outdir, *docx_paths,
+            ],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        if self.process.wait() != 0:
+            raise ConversionError(f"soffice terminou com o código {self.process.returncode}.")
+
+    def convert_bytes(self, docx_bytes: bytes) -> bytes:
+        # O soffice só converte ficheiros: usamos uma pasta temporária em memória (tmpfs) quando existe.
+        with tempfile.TemporaryDirectory(dir=OFFICE_SPOOL_DIR) as spool:
+            docx_path = os.path.join(spool, "document.docx")
+            pdf_path = os.path.join(spool, "document.pdf")
+            with open(docx_path, "wb") as f:
+                f.write(docx_bytes)
+            self._run_soffice([docx_path], spool)
+            if not os.path.exists(pdf_path):
+                raise ConversionError("Ficheiro PDF não foi criado após a conversão.")
+            with open(pdf_path, "rb") as f:
+                return f.read()
+
+    def convert_many_bytes(self, docx_list: List[bytes]) -> List[bytes | Exception]:
+        with tempfile.TemporaryDirectory(dir=OFFICE_SPOOL_DIR) as spool:
+            docx_paths = []
+            for i, docx_bytes in enumerate(docx_list):
+                docx_path = os.path.join(spool, f"document_{i}.docx")
+                with open(docx_path, "wb") as f:
+                    f.write(docx_bytes)
+                docx_paths.append(docx_path)
+            self._run_soffice(docx_paths, spool)
+            results = []
+            for docx_path in docx_paths:
+                pdf_path = docx_path[:-len(".docx")] + ".pdf"
+                if os.path.exists(pdf_path):
+                    with open(pdf_path, "rb") as f:
+                        results.append(f.read())
+                else:
+                    results.append(ConversionError("Ficheiro PDF não foi criado após a conversão."))
+            return results
+
+
+class OfficePool:
+    """
+    Pool de instâncias LibreOffice com fila limitada, timeouts, verificação de saúde e reciclagem.
+    """
+
+    def __init__(self, size: int = OFFICE_POOL_SIZE, base_port: int = OFFICE_POOL_BASE_PORT,
+                 max_conversions: int = OFFICE_MAX_CONVERSIONS, conversion_timeout: float = OFFICE_CONVERSION_TIMEOUT,
+                 max_queue: int = OFFICE_MAX_QUEUE, profile_root: str = OFFICE_PROFILE_ROOT):
+        instance_class = UnoOfficeInstance if UNO_AVAILABLE else SubprocessOfficeInstance
+        self.instances = [
+            instance_class(slot, base_port + slot, os.path.join(profile_root, f"slot_{slot}"))
+            for slot in range(size)
+        ]
+        self.max_conversions = max_conversions
+        self.conversion_timeout = conversion_timeout
+        self.max_queue = max_queue
+        # Threads extra para que uma conversão presa não bloqueie a reciclagem das restantes.
+        self._executor = ThreadPoolExecutor(max_workers=size * 2, thread_name_prefix="office")
+        self._idle: asyncio.Queue | None = None
+        self._waiting = 0
+        self._waiting_background = 0
+        self._healthcheck: asyncio.Task | None = None
+        # Devoluções de instâncias ao pool em curso (o asyncio só guarda referências fracas às tarefas)
+        self._release_tasks: set = set()
+
+    @property
+    def mode(self) -> str:
+        return "uno" if UNO_AVAILABLE else "subprocess"
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    async def start(self):
+        self._idle = asyncio.Queue()
+        await asyncio.gather(*[self._run(instance.start) for instance in self.instances])
+        for instance in self.instances:
+            self._idle.put_nowait(instance)
+        self._healthcheck = asyncio.create_task(self._healthcheck_loop())
+
+    async def close(self):
+        if self._healthcheck is not None:
+            self._healthcheck.cancel()
+            self._healthcheck = None
+        await asyncio.gather(*[self._run(instance.stop) for instance in self.instances], return_exceptions=True)
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    async def _restart(self, instance):
+        await self._run(instance.stop)
+        await self._run(instance.start)
+
+    async def convert_bytes(self, docx_bytes: bytes, promote: asyncio.Event | None = None) -> bytes:
+        """
+        Converte um DOCX em memória e retorna os bytes do PDF.
+        Com `promote`, a conversão é de baixa prioridade (ver _acquire_background) até o evento ser ativado.
+        """
+        if promote is not None:
+            instance = await self._acquire_background(promote)
+            if instance is not None:
+                return await self._execute(instance, "convert_bytes", docx_bytes)
+        return await self._submit("convert_bytes", docx_bytes)
+
+    async def _acquire_background(self, promote: asyncio.Event):
+        """
+        Espera por uma instância livre sem pedidos normais à espera, deixando sempre uma instância
+        livre para eles (exceto num pool de uma só instância). Retorna None se for promovida entretanto.
+        """
+        reserve = 1 if len(self.instances) > 1 else 0
+        self._waiting_background += 1
+        try:
+            while not promote.is_set():
+                if self._waiting == 0 and self._idle.qsize() > reserve:
+                    return self._idle.get_nowait()
+                try:
+                    await asyncio.wait_for(promote.wait(), timeout=BACKGROUND_POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+            return None
+        finally:
+            self._waiting_background -= 1
+
+    async def convert_batch(self, docx_list: List[bytes]) -> List[bytes | Exception]:
+        """
+        Converte vários documentos de uma vez na mesma instância (no modo sem UNO, numa única
+        invocação do soffice). As falhas individuais são devolvidas no lugar do respetivo PDF.
+        """
+        return await self._submit("convert_many_bytes", docx_list, timeout=self.conversion_timeout * len(docx_list))
+
+    async def _submit(self, method: str, *args, timeout: float | None = None):
+        if self._waiting >= self.max_queue:
+            raise PoolSaturatedError("Fila de conversão para PDF cheia.")
+        self._waiting += 1
+        try:
+            instance = await self._idle.get()
+        finally:
+            self._waiting -= 1
+        return await self._execute(instance, method, *args, timeout=timeout)
+
+    async def _execute(self, instance, method: str, *args, timeout: float | None = None):
+        healthy = True
+        try:
+            result = await asyncio.wait_for(
+                self._run(getattr(instance, method), *args), timeout=timeout or self.conversion_timeout
+            )
+            instance.conversions += 1
+            return result
+        except asyncio.TimeoutError:
+            healthy = False
+            instance.kill()
+            raise ConversionTimeoutError("A conversão para PDF demorou demasiado tempo (timeout).")
+        except ConversionError:
+            healthy = False
+            raise
+        except Exception as e:
+            healthy = False
+            raise ConversionError(f"Falha na conversão para PDF: {e}")
+        finally:
+            # A instância só volta ao pool depois de reciclada, se necessário.
+            self._schedule_release(instance, healthy)
+
+    def _schedule_release(self, instance, healthy: bool):
+        task = asyncio.create_task(self._release(instance, healthy))
+        self._release_tasks.add(task)
+        task.add_done_callback(self._release_tasks.discard)
+
+    async def _release(self, instance, healthy: bool):
+        try:
+            if not healthy or instance.conversions >= self.max_conversions:
+                await self._restart(instance)
+        except Exception as e:
+            print(f"ERRO ao reiniciar a instância LibreOffice do slot {instance.slot}: {e}")
+        finally:
+            self._idle.put_nowait(instance)
+
+    async def _healthcheck_loop(self):
+        while True:
+            await asyncio.sleep(OFFICE_HEALTHCHECK_INTERVAL)
+            # Verifica as instâncias livres uma de cada vez: enquanto uma é verificada, as restantes
+            # continuam disponíveis para novas conversões.
+            checked = set()
+            while True:
+                try:
+                    instance = self._idle.get_nowait()
+                except asyncio.QueueEmpty:
+                    break
+                if instance.slot in checked:
+                    # Já verificada nesta ronda (a fila deu a volta): devolve-a e termina.
+                    self._idle.put_nowait(instance)
+                    break
+                checked.add(instance.slot)
+                if await self._run(instance.is_healthy):
+                    self._idle.put_nowait(instance)
+                else:
+                    self._schedule_release(instance, False)
+
+    def stats(self) -> dict:
+        return {
+            "mode": self.mode,
+            "size": len(self.instances),
+            "idle": self._idle.qsize() if self._idle is not None else 0,
+            "waiting": self._waiting,
+            "waiting_background": self._waiting_background,
+            "max_queue": self.max_queue,
+            "conversions": {instance.slot: instance.conversions for instance in self.instances},
+        }
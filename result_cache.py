@@ -0,0 +1,128 @@
+# result_cache.py
+# Cache persistente (em disco) de resultados de análise, endereçado pelo conteúdo.
+#
+# As entradas são agrupadas por namespace:
+#   - "result": resultado final de uma análise (PDF + formulário + versão do prompt/schema/RAG).
+#   - "stage":  etapas independentes do formulário (texto extraído e contexto RAG), reaproveitadas
+#               quando o mesmo PDF é analisado para outro tipo de formulário.
+#
+# O tamanho total é limitado por ANALYSIS_CACHE_MAX_BYTES; acima disso as entradas acedidas
+# há mais tempo são removidas (LRU). Os contadores de acertos/falhas são por worker.
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from collections import Counter
+from typing import Any, Dict, List
+
+ANALYSIS_CACHE_PATH = os.getenv("ANALYSIS_CACHE_PATH", "analysis_cache.db")
+ANALYSIS_CACHE_MAX_BYTES = int(os.getenv("ANALYSIS_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+
+
+def sha256_hex(data: bytes | str) -> str:
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    return hashlib.sha256(data).hexdigest()
+
+
+class ResultCache:
+    def __init__(self, path: str = ANALYSIS_CACHE_PATH, max_bytes: int = ANALYSIS_CACHE_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = Counter()
+        self.misses = Counter()
+        # Os contadores são atualizados a partir de várias threads do pool de I/O
+        self._counters_lock = threading.Lock()
+        self._local = threading.local()
+        # Todas as ligações abertas (uma por thread), para as fechar em close()
+        self._connections: List[sqlite3.Connection] = []
+        self._connections_lock = threading.Lock()
+        self._conn().execute("""
+        CREATE TABLE IF NOT EXISTS cache (
+            namespace TEXT NOT NULL,
+            key TEXT NOT NULL,
+            payload BLOB NOT NULL,
+            size INTEGER NOT NULL,
+            accessed_at REAL NOT NULL,
+            PRIMARY KEY (namespace, key)
+        )
+        """)
+        self._conn().execute("CREATE INDEX IF NOT EXISTS idx_cache_accessed_at ON cache (accessed_at)")
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # check_same_thread=False: só close() usa a ligação fora da thread que a criou.
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            with self._connections_lock:
+                self._connections.append(conn)
+        return conn
+
+    def get(self, namespace: str, key: str) -> Dict[str, Any] | None:
+        conn = self._conn()
+        row = conn.execute(
+            "SELECT payload FROM cache WHERE namespace = ? AND key = ?", (namespace, key)
+        ).fetchone()
+        with self._counters_lock:
+            (self.misses if row is None else self.hits)[namespace] += 1
+        if row is None:
+            return None
+        conn.execute(
+            "UPDATE cache SET accessed_at = ? WHERE namespace = ? AND key = ?", (time.time(), namespace, key)
+        )
+        return json.loads(zlib.decompress(row[0]).decode("utf-8"))
+
+    def set(self, namespace: str, key: str, value: Dict[str, Any]) -> None:
+        payload = zlib.compress(json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+        if len(payload) > self.max_bytes:
+            return
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "INSERT OR REPLACE INTO cache (namespace, key, payload, size, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                (namespace, key, payload, len(payload), time.time())
+            )
+            self._evict(conn)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _evict(self, conn: sqlite3.Connection):
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM cache").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        # Remove as entradas menos usadas até voltar ao orçamento.
+        to_delete = []
+        for namespace, key, size in conn.execute("SELECT namespace, key, size FROM cache ORDER BY accessed_at ASC"):
+            if total <= self.max_bytes:
+                break
+            to_delete.append((namespace, key))
+            total -= size
+        conn.executemany("DELETE FROM cache WHERE namespace = ? AND key = ?", to_delete)
+
+    def stats(self) -> Dict[str, Any]:
+        entries, total = self._conn().execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM cache").fetchone()
+        stats = {
+            "entries": entries,
+            "bytes": total,
+            "max_bytes": self.max_bytes,
+        }
+        with self._counters_lock:
+            stats.update(hits=dict(self.hits), misses=dict(self.misses))
+        return stats
+
+    def close(self):
+        with self._connections_lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            conn.close()
+        self._local = threading.local()
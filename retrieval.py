@@ -0,0 +1,273 @@
+# retrieval.py
+# Interface de recuperação (RAG) usada pela API e pelos assistentes.
+#
+# O processo da API importa só este módulo (biblioteca padrão + httpx). A base vetorial, o FAISS,
+# o numpy e o modelo de embeddings ficam atrás de uma de duas implementações com a mesma interface:
+#   - RemoteRetriever: cliente do retrieval_service.py, um processo à parte que mantém tudo carregado
+#     e aquecido. Cada worker da API custa então só alguns MB, em vez de uma cópia do modelo;
+#   - LocalRetriever (padrão sem RETRIEVAL_SERVICE_URL): carrega a base neste processo, mas só no
+#     arranque (`start()`, numa thread) e nunca na importação do módulo.
+#
+# Interface comum:
+#   ready / version / error          -> estado do aquecimento e versão da base vetorial
+#   await start() / await close()
+#   await wait_ready(timeout)        -> espera pelo aquecimento (False se não ficar pronto)
+#   await search(query_text, k, pin_sections, pin_terms, max_pinned)  -> List[Chunk]
+#   search_sync(...)                 -> idem, para código que corre fora do event loop
+#   status()                         -> dicionário para os endpoints de saúde
+#
+# Configuração via variáveis de ambiente:
+#   RETRIEVAL_SERVICE_URL     -> se definido, a API usa o serviço de recuperação (ex: http://retrieval:8004)
+#   VECTOR_STORE_DIR          -> diretório da base vetorial (modo local e serviço)
+#   RETRIEVAL_READY_TIMEOUT   -> segundos que um job espera pelo aquecimento antes de falhar
+#   RETRIEVAL_HEALTH_INTERVAL -> intervalo (s) entre verificações do /health/ready do serviço
+
+import asyncio
+import os
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterable, List
+
+import httpx
+
+import metrics
+
+RETRIEVAL_SERVICE_URL = os.getenv("RETRIEVAL_SERVICE_URL", "")
+VECTOR_STORE_DIR = os.getenv("VECTOR_STORE_DIR", "vector_store")
+RETRIEVAL_READY_TIMEOUT = float(os.getenv("RETRIEVAL_READY_TIMEOUT", "60"))
+RETRIEVAL_HEALTH_INTERVAL = float(os.getenv("RETRIEVAL_HEALTH_INTERVAL", "2.0"))
+RETRIEVAL_TIMEOUT = 30.0
+# Versão reportada enquanto a base vetorial não está carregada (ou não existe)
+NO_VERSION = "none"
+
+
+@dataclass
+class Chunk:
+    """
+    Um pedaço da política devolvido pela pesquisa (compatível com o `page_content` dos Documents do LangChain).
+    """
+    page_content: str
+    metadata: Dict[str, Any] = field(default_factory=dict)
+    score: float = 0.0
+
+
+class RetrievalUnavailableError(RuntimeError):
+    pass
+
+
+class LocalRetriever:
+    """
+    Base vetorial, pesquisa híbrida e embeddings de consulta carregados neste processo.
+    Os módulos pesados (FAISS, numpy, sentence-transformers) só são importados em `start()`.
+    """
+
+    def __init__(self, directory: str = VECTOR_STORE_DIR):
+        self.directory = directory
+        self.hybrid = None
+        self.embedder = None
+        self.ready = False
+        self.error: str | None = None
+        self.warmup_seconds: float | None = None
+        self._started = asyncio.Event()
+
+    @property
+    def version(self) -> str:
+        return self.hybrid.version if self.hybrid is not None else NO_VERSION
+
+    @property
+    def model_name(self) -> str | None:
+        return self.hybrid.model_name if self.hybrid is not None else None
+
+    def _load(self):
+        from hybrid_retriever import HybridRetriever
+        from vector_index import MANIFEST_FILE, VectorIndex
+
+        if not os.path.exists(os.path.join(self.directory, MANIFEST_FILE)):
+            return None
+        # Índice FAISS e textos mapeados em memória; índices BM25 e de secções construídos uma vez.
+        return HybridRetriever(VectorIndex.load(self.directory))
+
+    async def start(self):
+        began = time.perf_counter()
+        try:
+            hybrid = await asyncio.to_thread(self._load)
+            if hybrid is None:
+                self.error = f"base vetorial '{self.directory}/' não encontrada"
+                print(f"AVISO: {self.error}. O RAG não funcionará.")
+                return
+            from embedding_service import create_query_embedder
+
+            # Embeddings de consulta com micro-batching e cache LRU (modelo local ou sidecar).
+            embedder = create_query_embedder(os.getenv("EMBEDDING_MODEL", hybrid.model_name))
+            await embedder.start()
+            hybrid.index.embed_query = embedder.embed_sync
+            self.hybrid, self.embedder = hybrid, embedder
+            # Uma pesquisa de aquecimento: a primeira análise não paga o primeiro forward pass.
+            await self.search("política recursal", 1)
+            self.ready = True
+            self.warmup_seconds = round(time.perf_counter() - began, 3)
+            print(f"Base vetorial {self.version} pronta em {self.warmup_seconds}s.")
+        except Exception as e:
+            self.error = f"falha ao carregar a base vetorial: {e}"
+            print(f"ERRO: {self.error}")
+        finally:
+            self._started.set()
+
+    async def close(self):
+        if self.embedder is not None:
+            await self.embedder.close()
+
+    async def wait_ready(self, timeout: float = RETRIEVAL_READY_TIMEOUT) -> bool:
+        try:
+            await asyncio.wait_for(self._started.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        return self.ready
+
+    def _check_loaded(self):
+        if self.hybrid is None:
+            raise RetrievalUnavailableError(f"Recuperação indisponível: {self.error or 'base vetorial a carregar'}.")
+
+    async def search(self, query_text: str, k: int, pin_sections: Iterable[str] = (), pin_terms: Iterable[str] = (),
+                     max_pinned: int = 0) -> List[Chunk]:
+        self._check_loaded()
+        with metrics.stage("query_embedding"):
+            query_vector = await self.embedder.embed(query_text)
+        return await asyncio.to_thread(
+            self.hybrid.search, query_text, query_vector, k, list(pin_sections), list(pin_terms), max_pinned
+        )
+
+    def search_sync(self, query_text: str, k: int, pin_sections: Iterable[str] = (), pin_terms: Iterable[str] = (),
+                    max_pinned: int = 0) -> List[Chunk]:
+        self._check_loaded()
+        with metrics.stage("query_embedding"):
+            query_vector = self.embedder.embed_sync(query_text)
+        return self.hybrid.search(query_text, query_vector, k, list(pin_sections), list(pin_terms), max_pinned)
+
+    def status(self) -> dict:
+        return {
+            "mode": "local",
+            "ready": self.ready,
+            "version": self.version,
+            "model": self.model_name,
+            "chunks": len(self.hybrid.index) if self.hybrid is not None else 0,
+            "warmup_seconds": self.warmup_seconds,
+            "error": self.error,
+        }
+
+
+class RemoteRetriever:
+    """
+    Cliente do serviço de recuperação (retrieval_service.py). O estado de aquecimento e a versão da
+    base vetorial vêm do /health/ready do serviço, verificado a cada RETRIEVAL_HEALTH_INTERVAL segundos.
+    """
+
+    def __init__(self, base_url: str = RETRIEVAL_SERVICE_URL, health_interval: float = RETRIEVAL_HEALTH_INTERVAL):
+        self.base_url = base_url.rstrip("/")
+        self.health_interval = health_interval
+        self.ready = False
+        self.error: str | None = None
+        self._version = NO_VERSION
+        self._model: str | None = None
+        self._client: httpx.AsyncClient | None = None
+        self._watcher: asyncio.Task | None = None
+        self._changed = asyncio.Event()
+
+    @property
+    def version(self) -> str:
+        return self._version
+
+    async def start(self):
+        self._client = httpx.AsyncClient(base_url=self.base_url, timeout=RETRIEVAL_TIMEOUT)
+        await self.refresh()
+        self._watcher = asyncio.create_task(self._watch())
+
+    async def close(self):
+        if self._watcher is not None:
+            self._watcher.cancel()
+            self._watcher = None
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def refresh(self):
+        try:
+            response = await self._client.get("/health/ready", timeout=5.0)
+            body = response.json()
+            self.ready = response.status_code == 200
+            self._version = body.get("version") or NO_VERSION
+            self._model = body.get("model")
+            self.error = body.get("error")
+        except (httpx.HTTPError, ValueError) as e:
+            self.ready = False
+            self.error = f"serviço de recuperação inacessível: {e}"
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def _watch(self):
+        while True:
+            await asyncio.sleep(self.health_interval)
+            await self.refresh()
+
+    async def wait_ready(self, timeout: float = RETRIEVAL_READY_TIMEOUT) -> bool:
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while not self.ready:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                await asyncio.wait_for(self._changed.wait(), remaining)
+            except asyncio.TimeoutError:
+                break
+        return self.ready
+
+    @staticmethod
+    def _request(query_text: str, k: int, pin_sections: Iterable[str], pin_terms: Iterable[str], max_pinned: int) -> dict:
+        return {"query_text": query_text, "k": k, "pin_sections": list(pin_sections),
+                "pin_terms": list(pin_terms), "max_pinned": max_pinned}
+
+    @staticmethod
+    def _chunks(response: httpx.Response) -> List[Chunk]:
+        if response.status_code == 503:
+            raise RetrievalUnavailableError(f"Recuperação indisponível: {response.json().get('detail')}.")
+        response.raise_for_status()
+        return [Chunk(**chunk) for chunk in response.json()["chunks"]]
+
+    async def search(self, query_text: str, k: int, pin_sections: Iterable[str] = (), pin_terms: Iterable[str] = (),
+                     max_pinned: int = 0) -> List[Chunk]:
+        with metrics.stage("retrieval_call"):
+            response = await self._client.post(
+                "/retrieve", json=self._request(query_text, k, pin_sections, pin_terms, max_pinned),
+                headers=metrics.request_headers()
+            )
+        return self._chunks(response)
+
+    def search_sync(self, query_text: str, k: int, pin_sections: Iterable[str] = (), pin_terms: Iterable[str] = (),
+                    max_pinned: int = 0) -> List[Chunk]:
+        with metrics.stage("retrieval_call"):
+            response = httpx.post(
+                f"{self.base_url}/retrieve", json=self._request(query_text, k, pin_sections, pin_terms, max_pinned),
+                headers=metrics.request_headers(), timeout=RETRIEVAL_TIMEOUT
+            )
+        return self._chunks(response)
+
+    def status(self) -> dict:
+        return {
+            "mode": "remote",
+            "service_url": self.base_url,
+            "ready": self.ready,
+            "version": self.version,
+            "model": self._model,
+            "error": self.error,
+        }
+
+
+def create_retriever():
+    """
+    Usa o serviço de recuperação se RETRIEVAL_SERVICE_URL estiver definido; caso contrário, carrega a base
+    vetorial neste processo (no arranque da aplicação).
+    """
+    if RETRIEVAL_SERVICE_URL:
+        return RemoteRetriever(RETRIEVAL_SERVICE_URL)
+    return LocalRetriever(VECTOR_STORE_DIR)
@@ -0,0 +1,82 @@
+# retrieval_service.py
+# Serviço de recuperação (RAG): um processo "quente" que mantém a base vetorial mapeada em memória,
+# os índices BM25/secções e o modelo de embeddings de consulta, e responde às pesquisas híbridas
+# dos workers da API (ver retrieval.py). Com ele, os workers da API não carregam FAISS, numpy nem modelo.
+#
+# Para rodar:
+#   uvicorn retrieval_service:app --port 8004
+# e, na API: RETRIEVAL_SERVICE_URL=http://retrieval:8004
+#
+# O carregamento corre em segundo plano no arranque: GET /health/live responde logo, e
+# GET /health/ready só devolve 200 quando a base está carregada e a primeira pesquisa já foi feita.
+#
+# Configuração via variáveis de ambiente:
+#   VECTOR_STORE_DIR       -> diretório da base vetorial
+#   EMBEDDING_MODEL        -> modelo de embeddings (padrão: o do manifest da base vetorial)
+#   EMBEDDING_SERVICE_URL  -> se definido, os embeddings vêm do sidecar (embedding_service.py)
+
+import asyncio
+from typing import List
+
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+
+import metrics
+from retrieval import LocalRetriever, RetrievalUnavailableError
+
+app = FastAPI(
+    title="Monster Factory - Retrieval Service",
+    description="Pesquisa híbrida (BM25 + FAISS) na base vetorial da Política Recursal.",
+    version="1.0.0"
+)
+metrics.install(app)
+
+retriever = LocalRetriever()
+warmup_task: asyncio.Task | None = None
+
+
+class RetrieveRequest(BaseModel):
+    query_text: str
+    k: int = 3
+    pin_sections: List[str] = []
+    pin_terms: List[str] = []
+    max_pinned: int = 0
+
+@app.on_event("startup")
+async def startup_event():
+    global warmup_task
+    warmup_task = asyncio.create_task(retriever.start())
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    if warmup_task is not None:
+        warmup_task.cancel()
+    await retriever.close()
+
+@app.get("/")
+def read_root():
+    return {"message": "Serviço de Recuperação está ativo.", **retriever.status()}
+
+@app.get("/health/live")
+def liveness():
+    return {"status": "alive"}
+
+@app.get("/health/ready")
+def readiness():
+    status = retriever.status()
+    return JSONResponse(status_code=200 if retriever.ready else 503, content=status)
+
+@app.post("/retrieve")
+async def retrieve(request: RetrieveRequest):
+    try:
+        chunks = await retriever.search(
+            request.query_text, request.k, pin_sections=request.pin_sections,
+            pin_terms=request.pin_terms, max_pinned=request.max_pinned
+        )
+    except RetrievalUnavailableError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    return {
+        "version": retriever.version,
+        "chunks": [{"page_content": c.page_content, "metadata": c.metadata, "score": c.score} for c in chunks]
+    }
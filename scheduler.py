@@ -0,0 +1,289 @@
+# scheduler.py
+# Escalonador das análises: fila de prioridade limitada à frente do executor dos assistentes.
+#
+# - Admissão: se a fila estiver cheia, o pedido é recusado logo (HTTP 429 com Retry-After estimado).
+# - Prioridade pelo prazo: jobs com prazo fatal próximo (ou já passado) passam à frente dos restantes.
+#   O prazo vem do pedido ou de uma pré-extração barata (1.as páginas do PDF) do prazo fatal ou da data de publicação.
+# - Equidade: dentro da mesma urgência, é servido primeiro o tenant que recebeu menos vagas até agora
+#   (um tenant que chega entra ao nível do menos servido, para não "cobrar" o tempo em que esteve parado).
+# - Lotes: cada grupo (batch_id) pode ter um limite próprio de análises em simultâneo.
+# - Métricas: profundidade da fila, análises em curso e tempos de espera/execução.
+#
+# Configuração via variáveis de ambiente:
+#   MAX_CONCURRENT_JOBS     -> nº máximo de análises em simultâneo neste worker
+#   SCHEDULER_MAX_QUEUE     -> nº máximo de jobs à espera (acima disto: 429)
+#   SCHEDULER_URGENT_DAYS   -> prazos até este nº de dias são urgentes
+#   SCHEDULER_SOON_DAYS     -> prazos até este nº de dias têm prioridade média
+
+import asyncio
+import datetime
+import itertools
+import math
+import os
+import re
+import time
+from collections import defaultdict, deque
+from contextlib import asynccontextmanager
+from typing import Dict, List
+
+MAX_CONCURRENT_JOBS = int(os.getenv("MAX_CONCURRENT_JOBS", "4"))
+SCHEDULER_MAX_QUEUE = int(os.getenv("SCHEDULER_MAX_QUEUE", "1000"))
+SCHEDULER_URGENT_DAYS = int(os.getenv("SCHEDULER_URGENT_DAYS", "2"))
+SCHEDULER_SOON_DAYS = int(os.getenv("SCHEDULER_SOON_DAYS", "7"))
+# Tempo médio de uma análise assumido antes de haver medições (para o Retry-After)
+DEFAULT_SERVICE_SECONDS = 20.0
+# Nº de amostras guardadas para as métricas de espera/execução
+METRICS_WINDOW = 500
+
+# --- Prazo do job ---
+
+# Páginas lidas na pré-extração do prazo (o cabeçalho da decisão costuma estar no início)
+DEADLINE_SCAN_PAGES = 2
+# Sem prazo fatal explícito, estima-se a partir da publicação (15 dias úteis ≈ 21 dias corridos)
+DAYS_AFTER_PUBLICATION = 21
+_DATE = r"(\d{1,2})[/.-](\d{1,2})[/.-](\d{4})"
+_PRAZO_FATAL = re.compile(r"prazo\s+fatal\D{0,30}" + _DATE, re.IGNORECASE)
+_PUBLICACAO = re.compile(
+    r"(?:data\s+d[ae]\s+publica[cç][aã]o|publicad[oa]\s+(?:no\s+\S+\s+)?em|disponibilizad[oa]\s+no\s+\S+\s+em)\D{0,30}" + _DATE,
+    re.IGNORECASE
+)
+
+
+def parse_date(value: str | None) -> datetime.date | None:
+    """
+    Aceita 'AAAA-MM-DD' ou 'DD/MM/AAAA'. Retorna None se o valor estiver vazio ou for inválido.
+    """
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return datetime.date.fromisoformat(value)
+    except ValueError:
+        pass
+    match = re.fullmatch(_DATE, value)
+    if match:
+        try:
+            return datetime.date(int(match.group(3)), int(match.group(2)), int(match.group(1)))
+        except ValueError:
+            return None
+    return None
+
+
+def _match_date(pattern: re.Pattern, text: str) -> datetime.date | None:
+    match = pattern.search(text)
+    if not match:
+        return None
+    try:
+        return datetime.date(int(match.group(3)), int(match.group(2)), int(match.group(1)))
+    except ValueError:
+        return None
+
+
+def extract_deadline(file_path: str) -> datetime.date | None:
+    """
+    Pré-extração barata do prazo: procura o prazo fatal (ou a data de publicação) nas primeiras páginas.
+    """
+    import fitz  # PyMuPDF: só carregado quando há um PDF para ler
+
+    try:
+        with fitz.open(file_path) as doc:
+            text = "".join(doc[i].get_text() for i in range(min(DEADLINE_SCAN_PAGES, len(doc))))
+    except Exception:
+        return None
+    deadline = _match_date(_PRAZO_FATAL, text)
+    if deadline is None:
+        published = _match_date(_PUBLICACAO, text)
+        if published is not None:
+            deadline = published + datetime.timedelta(days=DAYS_AFTER_PUBLICATION)
+    return deadline
+
+
+def urgency(deadline: datetime.date | None) -> int:
+    """
+    0 = urgente, 1 = prazo próximo, 2 = normal (ou sem prazo conhecido).
+    """
+    if deadline is None:
+        return 2
+    days_left = (deadline - datetime.date.today()).days
+    if days_left <= SCHEDULER_URGENT_DAYS:
+        return 0
+    if days_left <= SCHEDULER_SOON_DAYS:
+        return 1
+    return 2
+
+
+# --- Escalonador ---
+
+class SchedulerSaturatedError(Exception):
+    def __init__(self, retry_after: int):
+        super().__init__(f"Fila de análises cheia; tente novamente dentro de {retry_after}s.")
+        self.retry_after = retry_after
+
+
+class _Waiting:
+    __slots__ = ("job_id", "tenant", "group", "group_limit", "deadline", "urgency", "seq", "enqueued", "future")
+
+    def __init__(self, job_id: str, tenant: str, group: str | None, group_limit: int | None,
+                 deadline: datetime.date | None, seq: int):
+        self.job_id = job_id
+        self.tenant = tenant
+        self.group = group
+        self.group_limit = group_limit
+        self.deadline = deadline
+        self.urgency = urgency(deadline)
+        self.seq = seq
+        self.enqueued = time.monotonic()
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+
+
+class JobScheduler:
+    def __init__(self, concurrency: int = MAX_CONCURRENT_JOBS, max_queue: int = SCHEDULER_MAX_QUEUE):
+        self.concurrency = concurrency
+        self.max_queue = max_queue
+        self._waiting: List[_Waiting] = []
+        # Lugares reservados na admissão por jobs que ainda não entraram na fila (upload em curso)
+        self._reserved = 0
+        self._seq = itertools.count()
+        self.running = 0
+        self._running_by_tenant: Dict[str, int] = defaultdict(int)
+        self._running_by_group: Dict[str, int] = defaultdict(int)
+        # Vagas concedidas a cada tenant ativo (com jobs à espera ou em curso)
+        self._served: Dict[str, int] = {}
+        self._waits = deque(maxlen=METRICS_WINDOW)
+        self._service_times = deque(maxlen=METRICS_WINDOW)
+        self.admitted = 0
+        self.rejected = 0
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._waiting)
+
+    # --- Admissão ---
+
+    def retry_after(self) -> int:
+        service = sum(self._service_times) / len(self._service_times) if self._service_times else DEFAULT_SERVICE_SECONDS
+        return max(1, math.ceil(service * (len(self._waiting) + self._reserved + 1) / self.concurrency))
+
+    def check_admission(self, count: int = 1):
+        """
+        Reserva lugar na fila para `count` jobs, ou lança SchedulerSaturatedError se não houver.
+        Cada reserva passa para a fila quando o job entra em `slot(..., reserved=True)`; se o job
+        não chegar a entrar (upload falhado, job cancelado), deve ser devolvida com `release_admission`.
+        """
+        if len(self._waiting) + self._reserved + count > self.max_queue:
+            self.rejected += count
+            raise SchedulerSaturatedError(self.retry_after())
+        self._reserved += count
+        self.admitted += count
+
+    def release_admission(self, count: int = 1):
+        self._reserved = max(0, self._reserved - count)
+
+    # --- Execução ---
+
+    @asynccontextmanager
+    async def slot(self, job_id: str, tenant: str = "default", deadline: datetime.date | None = None,
+                   group: str | None = None, group_limit: int | None = None, reserved: bool = False):
+        """
+        Espera pela vez do job na fila. Uso: `async with scheduler.slot(job_id, tenant, deadline): ...`
+        Jobs do mesmo `group` (ex: um lote) nunca correm mais do que `group_limit` de cada vez.
+        Com `reserved`, o lugar reservado em `check_admission` passa a ser ocupado por este job.
+        """
+        if reserved:
+            self.release_admission()
+        entry = _Waiting(job_id, tenant, group, group_limit, deadline, next(self._seq))
+        if tenant not in self._served:
+            self._served[tenant] = min(self._served.values(), default=0)
+        self._waiting.append(entry)
+        self._dispatch()
+        try:
+            await entry.future
+        except asyncio.CancelledError:
+            if entry in self._waiting:
+                self._waiting.remove(entry)
+                self._forget_tenant(entry.tenant)
+            elif entry.future.done() and not entry.future.cancelled():
+                # A vez foi concedida no mesmo instante do cancelamento: devolve-a.
+                self._finish(entry)
+            raise
+
+        started = time.monotonic()
+        self._waits.append(started - entry.enqueued)
+        try:
+            yield
+        finally:
+            self._service_times.append(time.monotonic() - started)
+            self._finish(entry)
+
+    def _finish(self, entry: _Waiting):
+        self.running -= 1
+        self._running_by_tenant[entry.tenant] -= 1
+        if not self._running_by_tenant[entry.tenant]:
+            del self._running_by_tenant[entry.tenant]
+        if entry.group is not None:
+            self._running_by_group[entry.group] -= 1
+            if not self._running_by_group[entry.group]:
+                del self._running_by_group[entry.group]
+        self._forget_tenant(entry.tenant)
+        self._dispatch()
+
+    def _forget_tenant(self, tenant: str):
+        if tenant not in self._running_by_tenant and not any(waiting.tenant == tenant for waiting in self._waiting):
+            self._served.pop(tenant, None)
+
+    def _eligible(self, entry: _Waiting) -> bool:
+        if entry.group is None or entry.group_limit is None:
+            return True
+        return self._running_by_group.get(entry.group, 0) < entry.group_limit
+
+    def _dispatch(self):
+        while self.running < self.concurrency:
+            candidates = [entry for entry in self._waiting if self._eligible(entry)]
+            if not candidates:
+                return
+            # Urgência do prazo > tenant menos servido > prazo mais cedo > ordem de chegada
+            entry = min(candidates, key=lambda waiting: (
+                waiting.urgency,
+                self._served[waiting.tenant],
+                waiting.deadline or datetime.date.max,
+                waiting.seq,
+            ))
+            self._waiting.remove(entry)
+            self.running += 1
+            self._running_by_tenant[entry.tenant] += 1
+            self._served[entry.tenant] += 1
+            if entry.group is not None:
+                self._running_by_group[entry.group] += 1
+            entry.future.set_result(None)
+
+    # --- Métricas ---
+
+    @staticmethod
+    def _percentile(samples, fraction: float) -> float:
+        if not samples:
+            return 0.0
+        ordered = sorted(samples)
+        return round(ordered[min(len(ordered) - 1, int(fraction * len(ordered)))], 3)
+
+    def stats(self) -> dict:
+        waiting_by_urgency = defaultdict(int)
+        waiting_by_tenant = defaultdict(int)
+        for entry in self._waiting:
+            waiting_by_urgency[("urgent", "soon", "normal")[entry.urgency]] += 1
+            waiting_by_tenant[entry.tenant] += 1
+        return {
+            "concurrency": self.concurrency,
+            "max_queue": self.max_queue,
+            "queue_depth": len(self._waiting),
+            "reserved": self._reserved,
+            "running": self.running,
+            "waiting_by_urgency": dict(waiting_by_urgency),
+            "waiting_by_tenant": dict(waiting_by_tenant),
+            "running_by_tenant": dict(self._running_by_tenant),
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "wait_seconds_p50": self._percentile(self._waits, 0.5),
+            "wait_seconds_p95": self._percentile(self._waits, 0.95),
+            "service_seconds_p50": self._percentile(self._service_times, 0.5),
+            "retry_after_estimate": self.retry_after(),
+        }
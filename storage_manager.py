@@ -0,0 +1,145 @@
+# storage_manager.py
+# Ciclo de vida dos ficheiros gerados em OUTPUT_FOLDER pelo serviço de geração.
+#
+# - Deduplicação: o nome de cada ficheiro deriva do hash do template + form_type + form_data,
+#   pelo que um pedido idêntico reutiliza os ficheiros já gerados em vez de voltar a renderizar.
+# - Limpeza em segundo plano: ficheiros sem acesso há mais de OUTPUT_TTL_SECONDS são removidos e,
+#   se a pasta exceder OUTPUT_MAX_BYTES, os menos usados são removidos até voltar ao orçamento.
+# - Os ficheiros são imutáveis depois de escritos, o que permite ETags estáveis nos downloads.
+
+import asyncio
+import hashlib
+import json
+import os
+import time
+from typing import Any, Dict, Tuple
+
+OUTPUT_TTL_SECONDS = int(os.getenv("OUTPUT_TTL_SECONDS", str(7 * 24 * 3600)))
+OUTPUT_MAX_BYTES = int(os.getenv("OUTPUT_MAX_BYTES", str(2 * 1024 ** 3)))
+OUTPUT_SWEEP_INTERVAL = float(os.getenv("OUTPUT_SWEEP_INTERVAL", "300"))
+# Ficheiros temporários (escrita a meio) só são considerados abandonados após este tempo.
+TMP_FILE_GRACE_SECONDS = 3600
+
+
+class StorageManager:
+    def __init__(self, folder: str, ttl_seconds: int = OUTPUT_TTL_SECONDS, max_bytes: int = OUTPUT_MAX_BYTES,
+                 sweep_interval: float = OUTPUT_SWEEP_INTERVAL):
+        self.folder = folder
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.sweep_interval = sweep_interval
+        self._sweeper: asyncio.Task | None = None
+        os.makedirs(folder, exist_ok=True)
+
+    # --- Deduplicação ---
+
+    @staticmethod
+    def render_key(template_hash: str, form_type: str, form_data: Dict[str, Any]) -> str:
+        material = json.dumps([template_hash, form_type, form_data], sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+        return hashlib.sha256(material.encode("utf-8")).hexdigest()[:32]
+
+    @staticmethod
+    def file_names(key: str, form_type: str) -> Tuple[str, str]:
+        return f"{form_type}_{key}.docx", f"{form_type}_{key}.pdf"
+
+    def lookup(self, key: str, form_type: str) -> Tuple[str, str] | None:
+        """
+        Retorna os nomes dos ficheiros já gerados para esta chave, renovando o seu prazo de vida.
+        """
+        names = self.file_names(key, form_type)
+        paths = [os.path.join(self.folder, name) for name in names]
+        if not all(os.path.exists(path) for path in paths):
+            return None
+        now = time.time()
+        for path in paths:
+            try:
+                os.utime(path, (now, now))
+            except FileNotFoundError:
+                return None
+        return names
+
+    def store(self, files: Dict[str, bytes]):
+        """
+        Grava os ficheiros de forma atómica (ficheiro temporário + rename).
+        """
+        for name, content in files.items():
+            path = os.path.join(self.folder, name)
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(content)
+            os.replace(tmp_path, path)
+
+    def discard(self, key: str, form_type: str) -> int:
+        """
+        Remove os ficheiros de uma chave (ex: uma pré-renderização que não chegou a ser usada).
+        """
+        return sum(self._remove(os.path.join(self.folder, name)) for name in self.file_names(key, form_type))
+
+    # --- Downloads ---
+
+    def resolve(self, file_name: str) -> str | None:
+        """
+        Caminho do ficheiro pedido, ou None se não existir (ou se o nome tentar sair da pasta).
+        """
+        if os.path.basename(file_name) != file_name or file_name.startswith(".") or file_name.endswith(".tmp"):
+            return None
+        path = os.path.join(self.folder, file_name)
+        return path if os.path.isfile(path) else None
+
+    @staticmethod
+    def etag(path: str) -> str:
+        # Os ficheiros nunca são reescritos com outro conteúdo: nome + tamanho identificam-nos.
+        digest = hashlib.sha256(f"{os.path.basename(path)}:{os.path.getsize(path)}".encode("utf-8")).hexdigest()
+        return f'"{digest[:32]}"'
+
+    # --- Limpeza ---
+
+    def sweep(self) -> Dict[str, int]:
+        now = time.time()
+        files = []
+        removed = 0
+        for entry in os.scandir(self.folder):
+            if not entry.is_file():
+                continue
+            stat = entry.stat()
+            if entry.name.endswith(".tmp"):
+                if now - stat.st_mtime > TMP_FILE_GRACE_SECONDS:
+                    removed += self._remove(entry.path)
+                continue
+            if now - stat.st_mtime > self.ttl_seconds:
+                removed += self._remove(entry.path)
+            else:
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+
+        total = sum(size for _, size, _ in files)
+        if total > self.max_bytes:
+            for _, size, path in sorted(files):
+                if total <= self.max_bytes:
+                    break
+                removed += self._remove(path)
+                total -= size
+        return {"removed": removed, "bytes": total}
+
+    @staticmethod
+    def _remove(path: str) -> int:
+        try:
+            os.remove(path)
+            return 1
+        except FileNotFoundError:
+            return 0
+
+    async def _sweep_loop(self):
+        while True:
+            try:
+                await asyncio.to_thread(self.sweep)
+            except Exception as e:
+                print(f"ERRO na limpeza da pasta de saída: {e}")
+            await asyncio.sleep(self.sweep_interval)
+
+    def start(self):
+        self._sweeper = asyncio.create_task(self._sweep_loop())
+
+    async def close(self):
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+            self._sweeper = None
@@ -0,0 +1,168 @@
+# template_cache.py
+# Cache em processo dos templates .docx do serviço de geração.
+#
+# Cada template é lido e pré-processado uma única vez: o documento é analisado (zip + XML),
+# o XML é "limpo" para o Jinja (patch_xml do docxtpl) e o template Jinja é compilado.
+# Cada renderização parte de uma cópia do documento já analisado, em vez de voltar ao disco.
+# A entrada é invalidada quando o ficheiro muda (mtime/tamanho e, se necessário, hash do conteúdo).
+
+import copy
+import hashlib
+import io
+import os
+import threading
+from typing import Any, Dict
+
+from docx import Document
+from docxtpl import DocxTemplate
+from jinja2 import Environment
+
+
+def is_office_lock_file(file_name: str) -> bool:
+    """
+    Ficheiros de bloqueio do Word/LibreOffice (ex: '~$.3. Súmula...docx', '.~lock.x.docx#').
+    """
+    return file_name.startswith("~$") or file_name.startswith(".~lock.")
+
+
+class CachingEnvironment(Environment):
+    """
+    Ambiente Jinja que guarda os templates compilados, indexados pelo texto de origem.
+    """
+
+    def __init__(self, **options):
+        super().__init__(**options)
+        self._compiled: Dict[str, Any] = {}
+        self._compiled_lock = threading.Lock()
+
+    def from_string(self, source, globals=None, template_class=None):
+        if globals is not None or template_class is not None:
+            return super().from_string(source, globals, template_class)
+        key = hashlib.sha256(source.encode("utf-8")).hexdigest()
+        with self._compiled_lock:
+            template = self._compiled.get(key)
+            if template is None:
+                template = super().from_string(source)
+                self._compiled[key] = template
+        return template
+
+
+class CachedDocxTemplate(DocxTemplate):
+    """
+    DocxTemplate que parte de um documento já analisado e reaproveita o XML pré-processado.
+    """
+
+    def __init__(self, entry: "TemplateEntry"):
+        super().__init__(io.BytesIO(entry.content))
+        self._entry = entry
+
+    def init_docx(self, reload: bool = True):
+        if not self.docx or (self.is_rendered and reload):
+            self.docx = copy.deepcopy(self._entry.document)
+            self.is_rendered = False
+
+    def patch_xml(self, src_xml):
+        return self._entry.patch_xml(src_xml, super().patch_xml)
+
+    def render(self, context, jinja_env=None, autoescape=False):
+        if jinja_env is None and not autoescape:
+            jinja_env = self._entry.jinja_env
+        super().render(context, jinja_env, autoescape)
+
+
+class TemplateEntry:
+    """
+    Estado pré-processado de um ficheiro de template.
+    """
+
+    def __init__(self, path: str, stat_key: tuple, content: bytes):
+        self.path = path
+        self.stat_key = stat_key
+        self.content = content
+        self.content_hash = hashlib.sha256(content).hexdigest()
+        self.document = Document(io.BytesIO(content))
+        self.jinja_env = CachingEnvironment()
+        self._patched: Dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    def patch_xml(self, src_xml: str, patch) -> str:
+        key = hashlib.sha256(src_xml.encode("utf-8")).hexdigest()
+        with self._lock:
+            patched = self._patched.get(key)
+        if patched is None:
+            patched = patch(src_xml)
+            with self._lock:
+                self._patched[key] = patched
+        return patched
+
+    def warm(self):
+        """
+        Pré-processa e compila todas as partes do template (corpo, cabeçalhos e rodapés).
+        Lança exceção se o template estiver corrompido ou tiver erros de sintaxe Jinja.
+        """
+        template = CachedDocxTemplate(self)
+        template.render({})
+
+
+class TemplateCache:
+    def __init__(self, folder: str):
+        self.folder = folder
+        self._entries: Dict[str, TemplateEntry] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _stat_key(path: str) -> tuple:
+        stat = os.stat(path)
+        return stat.st_mtime_ns, stat.st_size
+
+    def get(self, template_name: str) -> TemplateEntry:
+        """
+        Retorna a entrada do template, recarregando-a se o ficheiro mudou desde a última leitura.
+        """
+        if is_office_lock_file(template_name):
+            raise ValueError(f"'{template_name}' é um ficheiro de bloqueio do Office, não um template.")
+        path = os.path.join(self.folder, template_name)
+        stat_key = self._stat_key(path)
+        with self._lock:
+            entry = self._entries.get(template_name)
+        if entry is not None and entry.stat_key == stat_key:
+            return entry
+
+        with open(path, "rb") as f:
+            content = f.read()
+        if entry is not None and hashlib.sha256(content).hexdigest() == entry.content_hash:
+            # Só o mtime mudou (ex: cópia do ficheiro): o estado pré-processado continua válido.
+            entry.stat_key = stat_key
+            return entry
+
+        entry = TemplateEntry(path, stat_key, content)
+        with self._lock:
+            self._entries[template_name] = entry
+        return entry
+
+    def render(self, template_name: str, context: Dict[str, Any]) -> DocxTemplate:
+        """
+        Renderiza o template a partir do estado em cache. O resultado pode ser gravado com `.save()`.
+        """
+        template = CachedDocxTemplate(self.get(template_name))
+        template.render(context)
+        return template
+
+    def template_names(self):
+        """
+        Templates .docx presentes na pasta, ignorando os ficheiros de bloqueio do Office.
+        """
+        return sorted(
+            name for name in os.listdir(self.folder)
+            if name.lower().endswith(".docx") and not is_office_lock_file(name)
+        )
+
+    def warm(self):
+        """
+        Carrega e compila todos os templates da pasta. Falha logo no arranque se algum estiver corrompido.
+        """
+        for template_name in self.template_names():
+            try:
+                self.get(template_name).warm()
+            except Exception as e:
+                raise RuntimeError(f"Template inválido '{template_name}': {e}") from e
@@ -0,0 +1,95 @@
+import asyncio
+import importlib
+import json
+
+import pytest
+
+from assistants.dispensa_assistant import logic
+from assistants.dispensa_assistant.logic import MISSING_VALUE, validate_fields
+from assistants.dispensa_assistant.schema import get_field_groups, get_schema
+
+
+def test_validate_fields_follows_the_schema():
+    schema = get_schema("autodispensa")
+    data = {"extra": "ignorado", "npj": "123", "valor_causa": 1500, "reu_s": None}
+    result = validate_fields(data, schema)
+
+    assert list(result) == list(schema)
+    assert "extra" not in result
+    assert result["npj"] == "123"
+    assert result["valor_causa"] == "1500"
+    assert result["reu_s"] == MISSING_VALUE
+    assert result["prazo_fatal"] == MISSING_VALUE
+
+
+def test_validate_fields_keeps_complete_responses():
+    schema = get_schema("autodispensa")
+    data = {field: f"valor de {field}" for field in reversed(list(schema))}
+    assert validate_fields(data, schema) == {field: f"valor de {field}" for field in schema}
+
+
+class FakeLLM:
+    """
+    Responde a cada pedido com "<campo>: ok" para os campos do responseSchema (e um campo a mais).
+    """
+
+    def __init__(self, fail_shards: int = 0):
+        self.payloads = []
+        self.fail_shards = fail_shards
+
+    async def generate(self, url, payload):
+        self.payloads.append(payload)
+        fields = payload["generationConfig"]["responseSchema"]["properties"]
+        if self.fail_shards and len(fields) < len(get_schema("autodispensa")):
+            self.fail_shards -= 1
+            raise RuntimeError("503 do Gemini")
+        data = {field: f"{field}: ok" for field in fields}
+        data["intruso"] = "fora do schema"
+        return {"candidates": [{"content": {"parts": [{"text": json.dumps(data)}]}}]}
+
+
+class FakeEngine:
+    def __init__(self, llm):
+        self.llm = llm
+
+
+def extract(mode, llm, monkeypatch):
+    monkeypatch.setattr(logic, "EXTRACTION_MODE", mode)
+    return asyncio.run(logic.extract_fields("autodispensa", "decisão", "política", FakeEngine(llm), "http://gemini"))
+
+
+def test_single_mode_is_the_default_and_makes_one_call(monkeypatch):
+    monkeypatch.delenv("EXTRACTION_MODE", raising=False)
+    assert importlib.reload(logic).EXTRACTION_MODE == "single"
+    llm = FakeLLM()
+    result = extract(logic.EXTRACTION_MODE, llm, monkeypatch)
+    assert len(llm.payloads) == 1
+    assert result == {field: f"{field}: ok" for field in get_schema("autodispensa")}
+
+
+def test_sharded_mode_merges_the_groups(monkeypatch):
+    llm = FakeLLM()
+    result = extract("sharded", llm, monkeypatch)
+    assert len(llm.payloads) == len(get_field_groups("autodispensa"))
+    assert result == {field: f"{field}: ok" for field in get_schema("autodispensa")}
+
+
+def test_sharded_failure_falls_back_to_single_call(monkeypatch):
+    llm = FakeLLM(fail_shards=1)
+    result = extract("sharded", llm, monkeypatch)
+    # A última chamada é a alternativa com o schema completo
+    assert len(llm.payloads[-1]["generationConfig"]["responseSchema"]["properties"]) == len(get_schema("autodispensa"))
+    assert list(result) == list(get_schema("autodispensa"))
+    assert "intruso" not in result
+
+
+@pytest.mark.parametrize("mode", ["single", "sharded"])
+def test_both_modes_return_the_same_shape(mode, monkeypatch):
+    class PartialLLM(FakeLLM):
+        async def generate(self, url, payload):
+            return {"candidates": [{"content": {"parts": [{"text": json.dumps({"npj": 42})}]}}]}
+
+    result = extract(mode, PartialLLM(), monkeypatch)
+    assert list(result) == list(get_schema("autodispensa"))
+    assert result["npj"] == "42"
+    assert result["reu_s"] == MISSING_VALUE
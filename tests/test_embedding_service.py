@@ -0,0 +1,66 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from embedding_service import QueryEmbedder
+
+
+class FakeModel:
+    """
+    Modelo que regista quantos forward passes correm ao mesmo tempo e em que threads.
+    """
+
+    def __init__(self):
+        self.active = 0
+        self.peak = 0
+        self.threads = set()
+        self._lock = threading.Lock()
+
+    def encode(self, texts, batch_size, convert_to_numpy):
+        with self._lock:
+            self.active += 1
+            self.peak = max(self.peak, self.active)
+            self.threads.add(threading.current_thread().name)
+        time.sleep(0.01)
+        with self._lock:
+            self.active -= 1
+        return np.array([[float(len(text)), 1.0] for text in texts])
+
+
+def test_sync_and_batched_embeddings_share_the_model_thread():
+    embedder = QueryEmbedder(max_wait_ms=1)
+    embedder.model = model = FakeModel()
+
+    async def main():
+        # start() sem carregar o modelo: só a fila e o batching
+        embedder._queue = asyncio.Queue()
+        embedder._worker = asyncio.create_task(embedder._batch_loop())
+        try:
+            with ThreadPoolExecutor(max_workers=4) as pool:
+                sync_results = [
+                    asyncio.get_running_loop().run_in_executor(pool, embedder.embed_sync, f"consulta síncrona {i}")
+                    for i in range(8)
+                ]
+                async_results = [embedder.embed(f"consulta {i}") for i in range(8)]
+                return await asyncio.gather(*sync_results), await asyncio.gather(*async_results)
+        finally:
+            await embedder.close()
+
+    sync_vectors, async_vectors = asyncio.run(main())
+    assert sync_vectors[0] == [float(len("consulta síncrona 0")), 1.0]
+    assert async_vectors[0] == [float(len("consulta 0")), 1.0]
+    assert model.peak == 1
+    assert all(name.startswith("embedding") for name in model.threads)
+
+
+def test_sync_embeddings_use_the_cache():
+    embedder = QueryEmbedder()
+    embedder.model = FakeModel()
+    try:
+        assert embedder.embed_sync("prazo fatal") == embedder.embed_sync("prazo fatal")
+        assert (embedder.cache.hits, embedder.cache.misses) == (1, 1)
+    finally:
+        embedder._executor.shutdown()
@@ -0,0 +1,26 @@
+import json
+
+from feedback_writer import apply_diff, diff_fields, load_corrected_response
+
+ORIGINAL = {"npj": "123", "valor_causa": "R$ 1.000,00", "tipo_acao": "Revisional", "reu_s": "Banco"}
+
+
+def test_diff_round_trip():
+    corrected = {"npj": "123", "valor_causa": "R$ 2.000,00", "reu_s": "Banco", "liminar_deferida": "Não"}
+    diff = diff_fields(ORIGINAL, corrected)
+    assert diff == {"changed": {"valor_causa": "R$ 2.000,00", "liminar_deferida": "Não"}, "removed": ["tipo_acao"]}
+    assert apply_diff(ORIGINAL, diff) == corrected
+
+
+def test_unchanged_response_has_empty_diff():
+    diff = diff_fields(ORIGINAL, dict(ORIGINAL))
+    assert diff == {"changed": {}, "removed": []}
+    assert apply_diff(ORIGINAL, diff) == ORIGINAL
+
+
+def test_load_corrected_response_from_stored_diff():
+    corrected = {**ORIGINAL, "npj": "456"}
+    stored_diff = json.dumps(diff_fields(ORIGINAL, corrected))
+    assert load_corrected_response(json.dumps(ORIGINAL), None, stored_diff) == corrected
+    # Linhas antigas guardam a resposta corrigida completa
+    assert load_corrected_response(json.dumps(ORIGINAL), json.dumps(corrected), None) == corrected
@@ -0,0 +1,41 @@
+import pytest
+
+from benchmarks.fixtures import build_policy_index, hash_embed
+from hybrid_retriever import RRF_K, HybridRetriever
+from vector_index import VectorIndex
+
+
+@pytest.fixture(scope="module")
+def hybrid(tmp_path_factory):
+    directory = tmp_path_factory.mktemp("vector_store")
+    build_policy_index(str(directory), chunks_per_section=8)
+    return HybridRetriever(VectorIndex.load(str(directory)))
+
+
+def test_fuse_sums_reciprocal_ranks(hybrid):
+    query = "honorários de sucumbência na cédula de crédito rural"
+    vector = hash_embed(query)
+    fused = hybrid.fuse(query, vector, candidates=10)
+
+    expected = {}
+    for ranking in (hybrid.index.search_ids(vector, 10), hybrid.lexical.search(query, 10)):
+        for rank, (doc_id, _) in enumerate(ranking):
+            expected[doc_id] = expected.get(doc_id, 0.0) + 1.0 / (RRF_K + rank + 1)
+    assert fused.keys() == expected.keys()
+    for doc_id, score in expected.items():
+        assert fused[doc_id] == pytest.approx(score)
+
+
+def test_fuse_scores_exact_term_matches(hybrid):
+    fused = hybrid.fuse("PASEP", hash_embed("PASEP"))
+    pasep = hybrid.lexical.docs_with_all("PASEP")
+    assert len(pasep) == 1
+    # Primeiro lugar no BM25 (o único chunk com o termo), mais o que vier da pesquisa semântica
+    assert fused[pasep[0]] >= 1.0 / (RRF_K + 1)
+    assert max(fused.values()) <= 2.0 / (RRF_K + 1)
+
+
+def test_search_pins_requested_section_first(hybrid):
+    chunks = hybrid.search("PASEP", hash_embed("PASEP"), k=3, pin_sections=["Alçadas de Dispensa"], max_pinned=1)
+    assert len(chunks) == 3
+    assert chunks[0].metadata["section"] == "2. Alçadas de Dispensa"
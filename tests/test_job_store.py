@@ -0,0 +1,90 @@
+import sqlite3
+import threading
+import time
+
+import pytest
+
+from job_store import JobStore, SQLiteJobStore
+
+
+@pytest.fixture
+def store_path(tmp_path):
+    return str(tmp_path / "jobs.db")
+
+
+def test_job_store_is_abstract():
+    with pytest.raises(TypeError):
+        JobStore()
+
+
+def test_create_update_delete(store_path):
+    store = SQLiteJobStore(store_path)
+    try:
+        store.create("j1", {"status": "processing", "data": None})
+        assert store.update("j1", status="ready", data={"npj": "1"}) == {"status": "ready", "data": {"npj": "1"}}
+        assert store.get("j1") == {"status": "ready", "data": {"npj": "1"}}
+        assert store.update("nao_existe", status="ready") is None
+        store.delete("j1")
+        assert store.get("j1") is None
+    finally:
+        store.close()
+
+
+def test_expired_jobs_are_not_returned(store_path):
+    store = SQLiteJobStore(store_path, ttl_seconds=-1)
+    try:
+        store.create("j1", {"status": "processing"})
+        assert store.get("j1") is None
+        assert store.update("j1", status="ready") is None
+    finally:
+        store.close()
+
+
+def test_least_recently_used_jobs_are_evicted(store_path):
+    store = SQLiteJobStore(store_path, max_jobs=2, touch_interval=0)
+    try:
+        store.create("j1", {"n": 1})
+        store.create("j2", {"n": 2})
+        time.sleep(0.01)
+        assert store.get("j1") == {"n": 1}
+        store.create("j3", {"n": 3})
+        assert store.get("j2") is None
+        assert store.get("j1") == {"n": 1}
+    finally:
+        store.close()
+
+
+def test_reads_touch_the_job_at_most_once_per_interval(store_path):
+    store = SQLiteJobStore(store_path, max_jobs=2, touch_interval=3600)
+    try:
+        store.create("j1", {"n": 1})
+        store.create("j2", {"n": 2})
+        # Leitura dentro do intervalo: não conta como acesso, "j1" continua a ser o menos recente
+        assert store.get("j1") == {"n": 1}
+        store.create("j3", {"n": 3})
+        assert store.get("j1") is None
+        assert store.get("j2") == {"n": 2}
+    finally:
+        store.close()
+
+
+def test_close_closes_connections_of_every_thread(store_path):
+    store = SQLiteJobStore(store_path)
+    store.create("j1", {"n": 1})
+    opened = []
+
+    def read():
+        store.get("j1")
+        opened.append(store._local.conn)
+
+    threads = [threading.Thread(target=read) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    store.close()
+
+    assert len(opened) == 3
+    for conn in opened:
+        with pytest.raises(sqlite3.ProgrammingError):
+            conn.execute("SELECT 1")
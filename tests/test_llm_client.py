@@ -0,0 +1,80 @@
+import asyncio
+
+import httpx
+import pytest
+
+from llm_client import LLMClient, LLMError, estimate_tokens
+
+URL = "http://gemini/generate"
+PAYLOAD = {"contents": [{"parts": [{"text": "decisão " * 200}]}]}
+
+
+def make_client(handler, **kwargs) -> LLMClient:
+    client = LLMClient(transport=httpx.MockTransport(handler), backoff_base=0.001, backoff_max=0.01, **kwargs)
+    client.acquired = {"requests": 0, "tokens": 0}
+
+    def spy(bucket, key):
+        acquire = bucket.acquire
+
+        async def counted(amount: float = 1):
+            client.acquired[key] += amount
+            await acquire(amount)
+        bucket.acquire = counted
+
+    spy(client.request_bucket, "requests")
+    spy(client.token_bucket, "tokens")
+    return client
+
+
+def run(client: LLMClient):
+    async def main():
+        client.start()
+        try:
+            return await client.generate(URL, PAYLOAD)
+        finally:
+            await client.close()
+    return asyncio.run(main())
+
+
+def test_every_retry_is_charged_to_both_quotas():
+    statuses = iter([503, 429, 200])
+
+    def handler(request):
+        return httpx.Response(next(statuses), json={"ok": True})
+
+    client = make_client(handler)
+    assert run(client) == {"ok": True}
+    assert client.stats["retries"] == 2
+    assert client.acquired == {"requests": 3, "tokens": 3 * estimate_tokens(PAYLOAD)}
+
+
+def test_hedged_request_is_charged_to_both_quotas():
+    calls = 0
+
+    async def handler(request):
+        nonlocal calls
+        calls += 1
+        if calls == 1:
+            await asyncio.sleep(1)
+        return httpx.Response(200, json={"pedido": calls})
+
+    client = make_client(handler, hedge_after=0.05)
+    assert run(client) == {"pedido": 2}
+    assert client.stats["hedges"] == 1
+    assert client.acquired == {"requests": 2, "tokens": 2 * estimate_tokens(PAYLOAD)}
+
+
+def test_client_errors_are_not_retried():
+    client = make_client(lambda request: httpx.Response(400, text="payload inválido"))
+    with pytest.raises(LLMError, match="HTTP 400"):
+        run(client)
+    assert client.stats["retries"] == 0
+    assert client.acquired["requests"] == 1
+
+
+def test_gives_up_after_max_retries():
+    client = make_client(lambda request: httpx.Response(503), max_retries=2)
+    with pytest.raises(LLMError, match="após 3 tentativas"):
+        run(client)
+    assert client.stats["requests"] == 3
+    assert client.acquired == {"requests": 3, "tokens": 3 * estimate_tokens(PAYLOAD)}
@@ -0,0 +1,156 @@
+import asyncio
+import importlib
+import os
+import time
+
+import fitz  # PyMuPDF
+import pytest
+from fastapi.testclient import TestClient
+
+from scheduler import JobScheduler
+
+
+@pytest.fixture(scope="module")
+def main(tmp_path_factory):
+    # A API grava as bases (jobs, cache, feedback) na pasta atual: corre numa pasta temporária.
+    previous = os.getcwd()
+    os.chdir(tmp_path_factory.mktemp("api"))
+    try:
+        yield importlib.import_module("main")
+    finally:
+        os.chdir(previous)
+
+
+@pytest.fixture(scope="module")
+def client(main):
+    with TestClient(main.app) as client:
+        yield client
+
+
+@pytest.fixture
+def scheduler(main, monkeypatch):
+    scheduler = JobScheduler(concurrency=1, max_queue=2)
+    monkeypatch.setattr(main, "scheduler", scheduler)
+    return scheduler
+
+
+def make_pdf() -> bytes:
+    doc = fitz.open()
+    doc.new_page().insert_text((72, 72), "Prazo fatal: 30/12/2030")
+    return doc.tobytes()
+
+
+def submit(client, content: bytes, content_type: str = "application/pdf"):
+    return client.post(
+        "/api/v1/analysis", files={"file": ("decisao.pdf", content, content_type)},
+        data={"assistant_type": "analise_sumula", "form_type": "autodispensa"}
+    )
+
+
+def wait_for(condition, timeout: float = 5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "condição não satisfeita a tempo"
+        time.sleep(0.01)
+
+
+# --- Admissão ---
+
+def test_failed_upload_releases_the_admission(client, scheduler):
+    response = submit(client, b"isto nao e um pdf")
+    assert response.status_code == 400
+    assert scheduler.stats()["reserved"] == 0
+    assert scheduler.admitted == 1
+
+
+def test_full_queue_returns_429(client, scheduler):
+    scheduler.check_admission(2)
+    response = submit(client, make_pdf())
+    assert response.status_code == 429
+    assert int(response.headers["Retry-After"]) >= 1
+    scheduler.release_admission(2)
+
+
+def test_queued_job_can_be_cancelled(client, main, scheduler):
+    # Um job ocupa a única vaga de execução: o job submetido fica na fila do escalonador
+    async def occupy():
+        started, gate = asyncio.Event(), asyncio.Event()
+
+        async def hold():
+            async with scheduler.slot("ocupado", "outro"):
+                started.set()
+                await gate.wait()
+
+        task = asyncio.create_task(hold())
+        await started.wait()
+        return gate, task
+
+    async def release(gate, task):
+        gate.set()
+        await task
+
+    gate, holder = client.portal.call(occupy)
+    try:
+        job_id = submit(client, make_pdf()).json()["job_id"]
+        wait_for(lambda: scheduler.queue_depth == 1)
+        assert scheduler.stats()["reserved"] == 0
+
+        assert client.delete(f"/api/v1/analysis/{job_id}").json()["status"] == "cancelling"
+        wait_for(lambda: client.get(f"/api/v1/analysis/{job_id}/status").json()["status"] == "failed")
+        assert scheduler.queue_depth == 0
+        assert job_id not in main.background_tasks
+    finally:
+        client.portal.call(release, gate, holder)
+
+
+def test_job_cancelled_before_starting_releases_its_reservation(client, main, scheduler, tmp_path):
+    spooled = tmp_path / "decisao.pdf"
+    spooled.write_bytes(make_pdf())
+
+    async def submit_and_cancel():
+        scheduler.check_admission()
+        task = await main.submit_job("cancelado-cedo", "analise_sumula", "autodispensa", str(spooled), "hash")
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        return scheduler.stats()["reserved"]
+
+    assert client.portal.call(submit_and_cancel) == 0
+    assert "cancelado-cedo" not in main.reserved_jobs
+
+
+# --- Reanálise ---
+
+@pytest.fixture
+def ready_job(main):
+    main.job_store.create("pronto", {
+        "status": "ready", "data": {"npj": "1", "reu_s": "Banco"}, "assistant": "analise_sumula",
+        "form_type": "autodispensa", "file_hash": "hash"
+    })
+    return "pronto"
+
+
+@pytest.mark.parametrize("corrections, fields", [
+    ({"npj": 5}, "npj (STRING)"),
+    ({"npj": None}, "npj (STRING)"),
+    ({"npj": True, "reu_s": ["Banco"]}, "npj (STRING), reu_s (STRING)"),
+])
+def test_reanalysis_rejects_mistyped_corrections(client, ready_job, corrections, fields):
+    response = client.post(f"/api/v1/analysis/{ready_job}/reanalyze", json={"corrections": corrections})
+    assert response.status_code == 400
+    assert response.json()["detail"] == f"Valores com tipo inválido: {fields}."
+
+
+def test_reanalysis_rejects_unknown_fields(client, ready_job):
+    response = client.post(f"/api/v1/analysis/{ready_job}/reanalyze", json={"corrections": {"campo_inventado": "x"}})
+    assert response.status_code == 400
+    assert "campo_inventado" in response.json()["detail"]
+
+
+def test_mistyped_fields_follows_the_schema_types(main):
+    schema = {"texto": {"type": "STRING"}, "valor": {"type": "NUMBER"}, "n": {"type": "INTEGER"},
+              "flag": {"type": "BOOLEAN"}, "livre": {}}
+    assert main.mistyped_fields({"texto": "a", "valor": 1.5, "n": 2, "flag": False, "livre": [1]}, schema) == []
+    assert main.mistyped_fields({"valor": True, "n": 2.5, "flag": 1}, schema) == [
+        "valor (NUMBER)", "n (INTEGER)", "flag (BOOLEAN)"
+    ]
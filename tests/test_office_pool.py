@@ -0,0 +1,139 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+import office_pool
+from office_pool import ConversionTimeoutError, OfficePool, PoolSaturatedError
+
+
+class FakeInstance:
+    """
+    Instância sem LibreOffice: "converte" devolvendo os bytes recebidos.
+    """
+
+    def __init__(self, slot: int, healthy: bool = True, check_seconds: float = 0.0, convert_seconds: float = 0.0):
+        self.slot = slot
+        self.conversions = 0
+        self.starts = 0
+        self.checks = 0
+        self.healthy = healthy
+        self.check_seconds = check_seconds
+        self.convert_seconds = convert_seconds
+        self.release = threading.Event()
+        self.release.set()
+
+    def start(self):
+        self.starts += 1
+        self.conversions = 0
+
+    def stop(self):
+        # Reiniciar (stop + start) repara a instância
+        self.healthy = True
+
+    def kill(self):
+        self.release.set()
+
+    def is_healthy(self) -> bool:
+        self.checks += 1
+        time.sleep(self.check_seconds)
+        return self.healthy
+
+    def convert_bytes(self, docx_bytes: bytes) -> bytes:
+        self.release.wait()
+        time.sleep(self.convert_seconds)
+        return b"%PDF " + docx_bytes
+
+
+async def wait_until(condition, timeout: float = 5.0):
+    async def poll():
+        while not condition():
+            await asyncio.sleep(0.005)
+    await asyncio.wait_for(poll(), timeout)
+
+
+def make_pool(instances, **kwargs) -> OfficePool:
+    pool = OfficePool(size=len(instances), **kwargs)
+    pool.instances = instances
+    return pool
+
+
+def test_instance_is_recycled_after_max_conversions():
+    async def main():
+        instance = FakeInstance(0)
+        pool = make_pool([instance], max_conversions=2)
+        await pool.start()
+        try:
+            for i in range(5):
+                assert await pool.convert_bytes(b"doc%d" % i) == b"%PDF " + b"doc%d" % i
+                await asyncio.sleep(0.01)
+        finally:
+            await pool.close()
+        # Arranque inicial + uma reciclagem a cada 2 conversões
+        return instance.starts
+
+    assert asyncio.run(main()) == 3
+
+
+def test_timeout_restarts_the_instance():
+    async def main():
+        instance = FakeInstance(0)
+        instance.release.clear()
+        pool = make_pool([instance], conversion_timeout=0.05)
+        await pool.start()
+        try:
+            with pytest.raises(ConversionTimeoutError):
+                await pool.convert_bytes(b"doc")
+            # A instância volta ao pool já reiniciada
+            assert await pool.convert_bytes(b"doc") == b"%PDF doc"
+        finally:
+            await pool.close()
+        return instance.starts
+
+    assert asyncio.run(main()) == 2
+
+
+def test_full_queue_is_rejected():
+    async def main():
+        instance = FakeInstance(0)
+        instance.release.clear()
+        pool = make_pool([instance], max_queue=1)
+        await pool.start()
+        try:
+            running = asyncio.create_task(pool.convert_bytes(b"a"))
+            await asyncio.sleep(0.01)
+            waiting = asyncio.create_task(pool.convert_bytes(b"b"))
+            await asyncio.sleep(0.01)
+            assert pool.stats()["waiting"] == 1
+            with pytest.raises(PoolSaturatedError):
+                await pool.convert_bytes(b"c")
+            instance.release.set()
+            assert await asyncio.gather(running, waiting) == [b"%PDF a", b"%PDF b"]
+        finally:
+            await pool.close()
+
+    asyncio.run(main())
+
+
+def test_healthcheck_keeps_other_instances_available(monkeypatch):
+    monkeypatch.setattr(office_pool, "OFFICE_HEALTHCHECK_INTERVAL", 0.01)
+
+    async def main():
+        slow, fast, broken = FakeInstance(0, check_seconds=0.5), FakeInstance(1), FakeInstance(2, healthy=False)
+        pool = make_pool([slow, fast, broken])
+        await pool.start()
+        try:
+            # Espera que a verificação da instância lenta comece
+            await wait_until(lambda: slow.checks > 0)
+            began = time.perf_counter()
+            assert await pool.convert_bytes(b"doc") == b"%PDF doc"
+            waited = time.perf_counter() - began
+            # A instância que falhou a verificação é reiniciada e volta ao pool
+            await wait_until(lambda: broken.starts == 2)
+        finally:
+            await pool.close()
+        return waited
+
+    # A conversão usou outra instância livre em vez de esperar pelo fim da verificação
+    assert asyncio.run(main()) < 0.25
@@ -0,0 +1,71 @@
+import sqlite3
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from result_cache import ResultCache
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = ResultCache(str(tmp_path / "cache.db"))
+    yield cache
+    cache.close()
+
+
+def test_entries_are_keyed_by_namespace(cache):
+    cache.set("result", "abc", {"npj": "1"})
+    cache.set("stage", "abc", {"text": "decisão"})
+    assert cache.get("result", "abc") == {"npj": "1"}
+    assert cache.get("stage", "abc") == {"text": "decisão"}
+    assert cache.get("result", "outra") is None
+    stats = cache.stats()
+    assert stats["entries"] == 2
+    assert (stats["hits"], stats["misses"]) == ({"result": 1, "stage": 1}, {"result": 1})
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    entry = {"texto": "x" * 100}
+    size = len(zlib.compress(b'{"texto":"' + b"x" * 100 + b'"}'))
+    cache = ResultCache(str(tmp_path / "cache.db"), max_bytes=size * 2)
+    try:
+        cache.set("result", "a", entry)
+        cache.set("result", "b", entry)
+        # Acesso a "a": passa a ser "b" a entrada menos usada
+        assert cache.get("result", "a") == entry
+        cache.set("result", "c", entry)
+        assert cache.get("result", "b") is None
+        assert cache.get("result", "a") == entry
+        assert cache.get("result", "c") == entry
+    finally:
+        cache.close()
+
+
+def test_counters_are_exact_under_concurrent_access(cache):
+    cache.set("result", "abc", {"npj": "1"})
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        list(pool.map(lambda i: cache.get("result", "abc" if i % 2 else "nao_existe"), range(400)))
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"]) == ({"result": 200}, {"result": 200})
+
+
+def test_close_closes_connections_of_every_thread(cache):
+    opened = []
+
+    def use_cache():
+        cache.get("result", "abc")
+        opened.append(cache._local.conn)
+
+    threads = [threading.Thread(target=use_cache) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    cache.close()
+
+    assert len(opened) == 3
+    for conn in opened:
+        with pytest.raises(sqlite3.ProgrammingError):
+            conn.execute("SELECT 1")
@@ -0,0 +1,115 @@
+import asyncio
+import datetime
+
+import pytest
+
+from scheduler import JobScheduler, SchedulerSaturatedError
+
+
+def days_from_today(days: int) -> datetime.date:
+    return datetime.date.today() + datetime.timedelta(days=days)
+
+
+async def dispatch_order(scheduler: JobScheduler, jobs) -> list:
+    """
+    Ocupa a única vaga, põe `jobs` (job_id, tenant, prazo) na fila e devolve a ordem em que correram.
+    """
+    order = []
+    gate = asyncio.Event()
+
+    async def blocker():
+        async with scheduler.slot("blocker", "a"):
+            await gate.wait()
+
+    async def job(job_id, tenant, deadline):
+        async with scheduler.slot(job_id, tenant, deadline):
+            order.append(job_id)
+
+    first = asyncio.create_task(blocker())
+    await asyncio.sleep(0)
+    tasks = [asyncio.create_task(job(*spec)) for spec in jobs]
+    await asyncio.sleep(0)
+    gate.set()
+    await asyncio.gather(first, *tasks)
+    return order
+
+
+def test_urgent_deadlines_run_first():
+    order = asyncio.run(dispatch_order(JobScheduler(concurrency=1), [
+        ("normal", "a", None),
+        ("soon", "a", days_from_today(5)),
+        ("overdue", "a", days_from_today(-1)),
+        ("urgent", "a", days_from_today(1)),
+    ]))
+    # Dentro da mesma urgência, o prazo mais cedo passa à frente
+    assert order == ["overdue", "urgent", "soon", "normal"]
+
+
+def test_tenants_share_slots_within_the_same_urgency():
+    order = asyncio.run(dispatch_order(JobScheduler(concurrency=1), [
+        ("a1", "a", None), ("a2", "a", None), ("a3", "a", None), ("b1", "b", None),
+    ]))
+    assert order == ["a1", "b1", "a2", "a3"]
+
+
+def test_group_limit_caps_parallel_jobs_of_a_batch():
+    scheduler = JobScheduler(concurrency=4)
+    peak = 0
+
+    async def job(job_id):
+        nonlocal peak
+        async with scheduler.slot(job_id, "a", group="lote", group_limit=2):
+            peak = max(peak, scheduler.stats()["running"])
+            await asyncio.sleep(0.01)
+
+    async def main():
+        await asyncio.gather(*(job(f"j{i}") for i in range(6)))
+
+    asyncio.run(main())
+    assert peak == 2
+    assert scheduler.running == 0
+
+
+def test_admission_rejects_when_queue_is_full():
+    scheduler = JobScheduler(concurrency=1, max_queue=3)
+    scheduler.check_admission(2)
+    with pytest.raises(SchedulerSaturatedError) as raised:
+        scheduler.check_admission(2)
+    assert raised.value.retry_after >= 1
+    scheduler.check_admission()
+    assert (scheduler.admitted, scheduler.rejected) == (3, 2)
+
+
+def test_released_admission_frees_the_reservation():
+    scheduler = JobScheduler(concurrency=1, max_queue=1)
+    scheduler.check_admission()
+    with pytest.raises(SchedulerSaturatedError):
+        scheduler.check_admission()
+    scheduler.release_admission()
+    scheduler.check_admission()
+    assert scheduler.stats()["reserved"] == 1
+
+
+def test_reservation_moves_into_the_queue():
+    scheduler = JobScheduler(concurrency=1, max_queue=2)
+
+    async def main():
+        scheduler.check_admission(2)
+        gate = asyncio.Event()
+
+        async def job(job_id):
+            async with scheduler.slot(job_id, "a", reserved=True):
+                await gate.wait()
+
+        tasks = [asyncio.create_task(job(f"j{i}")) for i in range(2)]
+        await asyncio.sleep(0)
+        stats = scheduler.stats()
+        # Um job em curso e outro na fila: as duas reservas foram consumidas, sem lugar para um terceiro
+        assert (stats["reserved"], stats["queue_depth"], stats["running"]) == (0, 1, 1)
+        with pytest.raises(SchedulerSaturatedError):
+            scheduler.check_admission(2)
+        gate.set()
+        await asyncio.gather(*tasks)
+
+    asyncio.run(main())
+    assert scheduler.stats()["reserved"] == 0
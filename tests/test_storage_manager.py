@@ -0,0 +1,63 @@
+import os
+import time
+
+import pytest
+
+from storage_manager import TMP_FILE_GRACE_SECONDS, StorageManager
+
+
+def write_file(path, size: int = 10, age: float = 0.0):
+    with open(path, "wb") as f:
+        f.write(b"x" * size)
+    mtime = time.time() - age
+    os.utime(path, (mtime, mtime))
+
+
+@pytest.fixture
+def storage(tmp_path):
+    return StorageManager(str(tmp_path / "output"), ttl_seconds=3600, max_bytes=1000)
+
+
+def test_resolve_returns_existing_file(storage):
+    write_file(os.path.join(storage.folder, "autodispensa_abc.pdf"))
+    assert storage.resolve("autodispensa_abc.pdf") == os.path.join(storage.folder, "autodispensa_abc.pdf")
+    assert storage.resolve("autodispensa_xyz.pdf") is None
+
+
+@pytest.mark.parametrize("file_name", [
+    "../segredo.txt",
+    "../output/autodispensa_abc.pdf",
+    "sub/autodispensa_abc.pdf",
+    "/etc/passwd",
+    "..",
+    ".env",
+    "autodispensa_abc.pdf.123.tmp",
+])
+def test_resolve_rejects_names_outside_the_folder(storage, tmp_path, file_name):
+    write_file(tmp_path / "segredo.txt")
+    write_file(os.path.join(storage.folder, "autodispensa_abc.pdf"))
+    write_file(os.path.join(storage.folder, ".env"))
+    write_file(os.path.join(storage.folder, "autodispensa_abc.pdf.123.tmp"))
+    os.makedirs(os.path.join(storage.folder, "sub"))
+    write_file(os.path.join(storage.folder, "sub", "autodispensa_abc.pdf"))
+    assert storage.resolve(file_name) is None
+
+
+def test_sweep_removes_expired_files(storage):
+    folder = storage.folder
+    write_file(os.path.join(folder, "recente.pdf"), age=60)
+    write_file(os.path.join(folder, "expirado.pdf"), age=7200)
+    write_file(os.path.join(folder, "a_meio.pdf.1.tmp"), age=60)
+    write_file(os.path.join(folder, "abandonado.pdf.1.tmp"), age=TMP_FILE_GRACE_SECONDS + 60)
+
+    assert storage.sweep() == {"removed": 2, "bytes": 10}
+    assert sorted(os.listdir(folder)) == ["a_meio.pdf.1.tmp", "recente.pdf"]
+
+
+def test_sweep_evicts_least_recently_used_over_budget(storage):
+    folder = storage.folder
+    for name, age in (("antigo.pdf", 300), ("medio.pdf", 200), ("novo.pdf", 100)):
+        write_file(os.path.join(folder, name), size=400, age=age)
+
+    assert storage.sweep() == {"removed": 1, "bytes": 800}
+    assert sorted(os.listdir(folder)) == ["medio.pdf", "novo.pdf"]
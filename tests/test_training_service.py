@@ -0,0 +1,79 @@
+import asyncio
+import json
+import sqlite3
+
+import pytest
+from fastapi import HTTPException
+
+import training_service
+from feedback_writer import FeedbackWriter, init_feedback_db
+
+
+class TrackedConnection(sqlite3.Connection):
+    opened = []
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        TrackedConnection.opened.append(self)
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+        super().close()
+
+
+@pytest.fixture
+def db_file(tmp_path, monkeypatch):
+    path = str(tmp_path / "feedback.db")
+    connect = sqlite3.connect
+    TrackedConnection.opened = []
+    monkeypatch.setattr(training_service, "DB_FILE", path)
+    monkeypatch.setattr(sqlite3, "connect", lambda *args, **kwargs: connect(*args, factory=TrackedConnection, **kwargs))
+    return path
+
+
+def export(**kwargs):
+    params = {"form_type": None, "since_id": 0, "since": None, "until": None, "gzip": False, **kwargs}
+    return training_service.get_training_data(**params)
+
+
+async def collect(response) -> str:
+    return "".join([chunk async for chunk in response.body_iterator])
+
+
+def test_database_errors_close_the_connection(db_file):
+    # Base sem a tabela feedback: a consulta inicial falha
+    with pytest.raises(HTTPException) as raised:
+        export()
+    assert raised.value.status_code == 500
+    assert [conn.closed for conn in TrackedConnection.opened] == [True]
+
+
+def test_empty_export_closes_the_connection(db_file):
+    init_feedback_db(db_file)
+    TrackedConnection.opened = []
+    with pytest.raises(HTTPException) as raised:
+        export()
+    assert raised.value.status_code == 404
+    assert [conn.closed for conn in TrackedConnection.opened] == [True]
+
+
+def test_export_streams_the_corrected_responses(db_file):
+    init_feedback_db(db_file)
+
+    async def write_feedback():
+        writer = FeedbackWriter(db_file)
+        await writer.start()
+        writer.submit("autodispensa", "política", {"npj": "1", "reu_s": "Banco"}, {"npj": "2", "reu_s": "Banco"})
+        await writer.close()
+
+    asyncio.run(write_feedback())
+    TrackedConnection.opened = []
+    response = export()
+    assert response.headers["X-Export-Cursor"] == "1"
+    lines = asyncio.run(collect(response)).splitlines()
+    assert len(lines) == 1
+    example = json.loads(lines[0])
+    assert example["input"] == "política"
+    assert json.loads(example["output"]) == {"npj": "2", "reu_s": "Banco"}
+    assert [conn.closed for conn in TrackedConnection.opened] == [True]
@@ -0,0 +1,59 @@
+import json
+import os
+import shutil
+
+import numpy as np
+
+from vector_index import (CHUNKS_FILE, INDEX_FILE, MANIFEST_FILE, METADATA_FILE, OFFSETS_FILE, VectorIndex,
+                          write_index)
+
+LEGACY_FILES = (INDEX_FILE, CHUNKS_FILE, OFFSETS_FILE, METADATA_FILE)
+
+
+def write(directory, texts):
+    vectors = np.eye(len(texts), 4, dtype="float32") + 0.1
+    return write_index(str(directory), vectors, texts, None, "modelo-teste")
+
+
+def make_legacy_store(directory, texts):
+    """
+    Base vetorial no formato antigo: ficheiros e manifest na raiz, sem pastas de versão.
+    """
+    staging = directory.parent / "staging"
+    write(staging, texts)
+    version_dir = staging / json.loads((staging / MANIFEST_FILE).read_text())["path"]
+    os.makedirs(directory)
+    for name in LEGACY_FILES + (MANIFEST_FILE,):
+        shutil.copy(version_dir / name, directory / name)
+    shutil.rmtree(staging)
+
+
+def version_dirs(directory):
+    return sorted(name for name in os.listdir(directory) if (directory / name).is_dir())
+
+
+def test_each_write_publishes_a_new_version_directory(tmp_path):
+    store = tmp_path / "vector_store"
+    first = write(store, ["a", "b"])
+    second = write(store, ["a", "b", "c"])
+    index = VectorIndex.load(str(store))
+    assert index.version == second["version"] != first["version"]
+    assert [index.get_text(i) for i in range(len(index))] == ["a", "b", "c"]
+    # A versão anterior fica para os leitores que já a resolveram; as mais antigas são removidas
+    write(store, ["d"])
+    assert len(version_dirs(store)) == 2
+
+
+def test_legacy_files_survive_the_first_versioned_write(tmp_path):
+    store = tmp_path / "vector_store"
+    make_legacy_store(store, ["antigo 1", "antigo 2"])
+    assert VectorIndex.load(str(store)).get_text(0) == "antigo 1"
+
+    write(store, ["novo"])
+    # Um leitor que resolveu o formato antigo antes da troca ainda encontra os ficheiros
+    assert all((store / name).exists() for name in LEGACY_FILES)
+    assert VectorIndex.load(str(store)).get_text(0) == "novo"
+
+    write(store, ["mais novo"])
+    assert not any((store / name).exists() for name in LEGACY_FILES)
+    assert VectorIndex.load(str(store)).get_text(0) == "mais novo"
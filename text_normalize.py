@@ -0,0 +1,25 @@
+# text_normalize.py
+# Normalização de texto partilhada pela pesquisa lexical (hybrid_retriever.py) e pelos assistentes.
+# Só usa a biblioteca padrão: importá-lo não puxa o numpy nem o FAISS para o processo da API.
+
+import re
+import unicodedata
+from typing import List
+
+_STOPWORDS = frozenset(
+    "a ao aos as com como da das de do dos e em entre na nas no nos o os ou para pela pelas pelo pelos por "
+    "que se sem sua suas seu seus um uma umas uns nao ser foi sao ja mais".split()
+)
+
+
+def normalize(text: str) -> str:
+    """
+    Minúsculas, sem acentos e sem pontuação (ex: "Anexo I – Hipóteses" -> "anexo i hipoteses").
+    """
+    text = unicodedata.normalize("NFKD", text)
+    text = "".join(char for char in text if not unicodedata.combining(char)).lower()
+    return " ".join(re.findall(r"\w+", text))
+
+
+def tokenize(text: str) -> List[str]:
+    return [token for token in normalize(text).split() if len(token) > 1 and token not in _STOPWORDS]
@@ -1,12 +1,18 @@
 # training_service.py
 # Versão 1.0 - Serviço para preparar dados para Fine-Tuning do Gemini
 
+import datetime
+import os
 import sqlite3
 import json
-from fastapi import FastAPI, HTTPException
+import zlib
+from fastapi import FastAPI, HTTPException, Query
 from fastapi.responses import StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
-import io
+from typing import Iterator, List, Optional
+
+import metrics
+from feedback_writer import init_feedback_db, load_corrected_response
 
 # --- Inicialização da Aplicação FastAPI ---
 app = FastAPI(
@@ -23,57 +29,131 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+metrics.install(app)
 
 # --- Constantes ---
 DB_FILE = "feedback.db"
+# Nº de linhas lidas da base de dados por cada consulta durante a exportação
+EXPORT_CHUNK_SIZE = int(os.getenv("EXPORT_CHUNK_SIZE", "500"))
+
+# Garante o esquema atual (a base pode ainda não ter sido migrada pela API).
+@app.on_event("startup")
+def startup_event():
+    init_feedback_db(DB_FILE)
 
 # --- Endpoints da API ---
 @app.get("/")
 def read_root():
     return {"message": "Serviço de Treinamento está ativo e pronto para preparar os dados."}
 
-@app.get("/api/v1/training-data")
-def get_training_data():
+def build_filters(form_type: Optional[str], since: Optional[str], until: Optional[str]):
     """
-    Extrai os dados de feedback e os formata no padrão JSONL para fine-tuning.
-    Cada linha do JSONL será um par de 'prompt' e 'completion'.
+    Cláusulas WHERE (e respetivos parâmetros) comuns à contagem e à leitura dos dados.
     """
+    clauses: List[str] = []
+    params: list = []
+    if form_type:
+        clauses.append("f.form_type = ?")
+        params.append(form_type)
+    # Os timestamps são gravados em ISO 8601, pelo que a comparação de texto respeita a ordem cronológica.
+    for value, operator in ((since, ">="), (until, "<")):
+        if value:
+            try:
+                datetime.datetime.fromisoformat(value)
+            except ValueError:
+                raise HTTPException(status_code=400, detail=f"Data inválida: '{value}'. Use o formato ISO 8601.")
+            clauses.append(f"f.timestamp {operator} ?")
+            params.append(value)
+    return clauses, params
+
+def iter_training_examples(conn: sqlite3.Connection, clauses: List[str], params: list, since_id: int, max_id: int) -> Iterator[str]:
+    """
+    Lê o feedback em blocos de EXPORT_CHUNK_SIZE linhas (paginação por id) e produz uma linha JSONL por exemplo.
+    """
+    last_id = since_id
     try:
-        conn = sqlite3.connect(DB_FILE)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        cursor.execute("SELECT rag_context, original_response, corrected_response FROM feedback")
-        feedback_entries = cursor.fetchall()
+        while True:
+            # O rag_context vem da tabela rag_contexts (linhas novas) ou da própria linha (linhas antigas).
+            rows = conn.execute(
+                "SELECT f.id, COALESCE(f.rag_context, c.content) AS rag_context, "
+                "f.original_response, f.corrected_response, f.corrected_diff "
+                "FROM feedback f LEFT JOIN rag_contexts c ON c.hash = f.rag_context_hash "
+                f"WHERE {' AND '.join(clauses + ['f.id > ?', 'f.id <= ?'])} ORDER BY f.id LIMIT ?",
+                (*params, last_id, max_id, EXPORT_CHUNK_SIZE)
+            ).fetchall()
+            if not rows:
+                break
+            for entry in rows:
+                # O 'prompt' é o contexto do RAG que a IA usou.
+                # A 'completion' (ou 'output') é a resposta corrigida pelo humano.
+                # O fine-tuning ensinará o modelo: "Quando ver um contexto como este, gere uma resposta como esta".
+                try:
+                    corrected_data = load_corrected_response(
+                        entry['original_response'], entry['corrected_response'], entry['corrected_diff']
+                    )
+                except (TypeError, json.JSONDecodeError):
+                    print(f"AVISO: feedback {entry['id']} ignorado (resposta corrigida inválida).")
+                    continue
+                training_example = {
+                    "input": entry['rag_context'],
+                    "output": json.dumps(corrected_data, ensure_ascii=False)
+                }
+                yield json.dumps(training_example, ensure_ascii=False) + '\n'
+            last_id = rows[-1]['id']
+    finally:
         conn.close()
 
-        if not feedback_entries:
-            raise HTTPException(status_code=404, detail="Nenhum dado de feedback encontrado para gerar o arquivo de treinamento.")
+def gzip_stream(lines: Iterator[str]) -> Iterator[bytes]:
+    compressor = zlib.compressobj(wbits=31)  # 31 = formato gzip
+    for line in lines:
+        chunk = compressor.compress(line.encode("utf-8"))
+        if chunk:
+            yield chunk
+    yield compressor.flush()
 
-        # Usa um buffer de texto em memória para criar o arquivo JSONL
-        string_io = io.StringIO()
-        for entry in feedback_entries:
-            # O 'prompt' é o contexto do RAG que a IA usou.
-            # A 'completion' (ou 'output') é a resposta corrigida pelo humano.
-            # O fine-tuning ensinará o modelo: "Quando ver um contexto como este, gere uma resposta como esta".
-            prompt_text = entry['rag_context']
-            corrected_data = json.loads(entry['corrected_response'])
+@app.get("/api/v1/training-data")
+def get_training_data(
+    form_type: Optional[str] = None,
+    since_id: int = Query(0, ge=0, description="Exporta apenas o feedback com id superior a este (cursor da exportação anterior)."),
+    since: Optional[str] = Query(None, description="Timestamp ISO 8601 mínimo (inclusive)."),
+    until: Optional[str] = Query(None, description="Timestamp ISO 8601 máximo (exclusive)."),
+    gzip: bool = False,
+):
+    """
+    Extrai os dados de feedback e os formata no padrão JSONL para fine-tuning.
+    Cada linha do JSONL será um par de 'prompt' e 'completion'.
 
-            # Formata a saída como um único objeto JSON por linha
-            training_example = {
-                "input": prompt_text,
-                "output": json.dumps(corrected_data, ensure_ascii=False)
-            }
-            string_io.write(json.dumps(training_example, ensure_ascii=False) + '\n')
+    A exportação é feita em streaming. O cabeçalho X-Export-Cursor contém o id do último registo incluído:
+    basta passá-lo como `since_id` na exportação seguinte para obter apenas o feedback novo.
+    """
+    clauses, params = build_filters(form_type, since, until)
+    conn = None
+    try:
+        conn = sqlite3.connect(DB_FILE, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        # Fixa o fim da exportação: linhas inseridas durante o download ficam para a próxima.
+        max_id = conn.execute(
+            f"SELECT MAX(f.id) FROM feedback f WHERE {' AND '.join(clauses + ['f.id > ?'])}",
+            (*params, since_id)
+        ).fetchone()[0]
+    except sqlite3.OperationalError:
+        # A ligação só passa para o gerador da exportação se a consulta inicial tiver sucesso.
+        if conn is not None:
+            conn.close()
+        raise HTTPException(status_code=500, detail=f"Erro ao aceder à base de dados '{DB_FILE}'. Verifique se o arquivo existe e se o serviço tem permissão de leitura.")
 
-        # Retorna o conteúdo do buffer como um arquivo para download
-        string_io.seek(0)
-        return StreamingResponse(
-            string_io,
-            media_type="application/jsonl",
-            headers={"Content-Disposition": "attachment; filename=training_data.jsonl"}
+    if max_id is None:
+        conn.close()
+        raise HTTPException(
+            status_code=404,
+            detail="Nenhum dado de feedback encontrado para gerar o arquivo de treinamento.",
+            headers={"X-Export-Cursor": str(since_id)}
         )
 
-    except sqlite3.OperationalError:
-         raise HTTPException(status_code=500, detail=f"Erro ao aceder à base de dados '{DB_FILE}'. Verifique se o arquivo existe e se o serviço tem permissão de leitura.")
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Ocorreu um erro inesperado: {e}")
\ No newline at end of file
+    lines = iter_training_examples(conn, clauses, params, since_id, max_id)
+    headers = {"X-Export-Cursor": str(max_id)}
+    if gzip:
+        headers["Content-Disposition"] = "attachment; filename=training_data.jsonl.gz"
+        return StreamingResponse(gzip_stream(lines), media_type="application/gzip", headers=headers)
+    headers["Content-Disposition"] = "attachment; filename=training_data.jsonl"
+    return StreamingResponse(lines, media_type="application/jsonl", headers=headers)
@@ -0,0 +1,106 @@
+# upload_spool.py
+# Receção dos PDFs enviados para análise sem os manter em memória.
+#
+# O ficheiro é copiado em blocos para uma pasta de spool (calculando o hash pelo caminho),
+# com limite de tamanho (413) e verificação da assinatura %PDF logo no primeiro bloco (400).
+# A análise abre depois o PDF a partir do caminho, e o ficheiro é apagado quando o job termina.
+
+import hashlib
+import os
+import tempfile
+import zipfile
+from typing import BinaryIO, List, Tuple
+
+from fastapi import HTTPException
+
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(50 * 1024 * 1024)))
+UPLOAD_SPOOL_DIR = os.getenv("UPLOAD_SPOOL_DIR", os.path.join(tempfile.gettempdir(), "monsterfactory-uploads"))
+SPOOL_BLOCK_SIZE = 1024 * 1024
+PDF_MAGIC = b"%PDF-"
+
+
+def check_content_length(content_length: str | None, max_bytes: int = MAX_UPLOAD_BYTES):
+    """
+    Rejeita logo pelo cabeçalho Content-Length, antes de ler o corpo, os pedidos claramente grandes demais.
+    """
+    if content_length and content_length.isdigit() and int(content_length) > max_bytes:
+        raise HTTPException(status_code=413, detail=f"Ficheiro demasiado grande (máximo {max_bytes // (1024 * 1024)} MB).")
+
+
+def spool_upload(source: BinaryIO, max_bytes: int = MAX_UPLOAD_BYTES, directory: str = UPLOAD_SPOOL_DIR) -> Tuple[str, str, int]:
+    """
+    Copia o upload para a pasta de spool. Retorna (caminho, sha256, tamanho).
+    Lança HTTPException 400 se não for um PDF e 413 se exceder `max_bytes`.
+    """
+    os.makedirs(directory, exist_ok=True)
+    digest = hashlib.sha256()
+    size = 0
+    fd, path = tempfile.mkstemp(suffix=".pdf", dir=directory)
+    try:
+        with os.fdopen(fd, "wb") as spool:
+            while True:
+                block = source.read(SPOOL_BLOCK_SIZE)
+                if not block:
+                    break
+                if size == 0 and not block.startswith(PDF_MAGIC):
+                    raise HTTPException(status_code=400, detail="Tipo de arquivo inválido.")
+                size += len(block)
+                if size > max_bytes:
+                    raise HTTPException(status_code=413, detail=f"Ficheiro demasiado grande (máximo {max_bytes // (1024 * 1024)} MB).")
+                digest.update(block)
+                spool.write(block)
+        if size == 0:
+            raise HTTPException(status_code=400, detail="O arquivo enviado está vazio.")
+    except BaseException:
+        remove_spooled(path)
+        raise
+    return path, digest.hexdigest(), size
+
+
+def remove_spooled(path: str | None):
+    if path:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def spool_batch(uploads: List[Tuple[str, BinaryIO]], archive: BinaryIO | None, max_files: int,
+                max_bytes: int = MAX_UPLOAD_BYTES) -> List[Tuple[str, str | None, str | None, str | None]]:
+    """
+    Copia para o spool os PDFs de um lote (ficheiros multipart e/ou os PDFs dentro de um ZIP).
+    Retorna (nome, caminho, sha256, erro) por documento: um ficheiro inválido não invalida o lote.
+    """
+    items = []
+
+    def add(name: str, source: BinaryIO):
+        if len(items) >= max_files:
+            raise HTTPException(status_code=413, detail=f"O lote excede o máximo de {max_files} documentos.")
+        try:
+            path, digest, _ = spool_upload(source, max_bytes)
+            items.append((name, path, digest, None))
+        except HTTPException as e:
+            items.append((name, None, None, e.detail))
+
+    try:
+        for name, source in uploads:
+            add(name, source)
+        if archive is not None:
+            try:
+                zip_file = zipfile.ZipFile(archive)
+            except zipfile.BadZipFile:
+                raise HTTPException(status_code=400, detail="O arquivo ZIP é inválido.")
+            with zip_file:
+                for member in zip_file.infolist():
+                    base_name = os.path.basename(member.filename)
+                    if member.is_dir() or member.filename.startswith("__MACOSX/") or base_name.startswith(".") \
+                            or not base_name.lower().endswith(".pdf"):
+                        continue
+                    # Leitura descomprimida em blocos: o limite de tamanho também trava "zip bombs".
+                    with zip_file.open(member) as source:
+                        add(member.filename, source)
+    except BaseException:
+        for _, path, _, _ in items:
+            remove_spooled(path)
+        raise
+    return items
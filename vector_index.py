@@ -0,0 +1,222 @@
+# vector_index.py
+# Formato nativo e versionado da base vetorial da Política Recursal.
+#
+# Substitui o antigo vector_store.pkl (pickle do wrapper FAISS do LangChain). Estrutura em disco:
+#   <diretório>/manifest.json          -> ponteiro para a versão atual: o manifest dessa versão + "path"
+#   <diretório>/v<versão>-<sufixo>/    -> uma versão completa e imutável da base:
+#       manifest.json    -> versão do formato, modelo de embeddings, dimensão, nº de chunks e versão do conteúdo
+#       index.faiss      -> índice FAISS nativo (produto interno sobre vetores normalizados = cosseno)
+#       chunks.bin       -> texto de todos os chunks em UTF-8, concatenado
+#       chunks.offsets   -> offsets uint64 (count + 1) de cada chunk em chunks.bin
+#       chunks.meta.json -> metadados de cada chunk (fonte, página, secção...)
+#
+# Cada reindexação grava uma pasta nova e só depois substitui o ponteiro (os.replace, atómico). Um leitor
+# resolve o ponteiro uma vez e lê tudo dessa pasta, pelo que nunca mistura ficheiros de versões diferentes.
+# Bases antigas, com os ficheiros diretamente em <diretório>/, continuam a ser lidas.
+#
+# Na leitura, o índice e os textos são mapeados em memória (mmap): vários workers partilham as
+# mesmas páginas através da cache do sistema operativo, e nada é desserializado com pickle.
+
+import hashlib
+import json
+import mmap
+import os
+import shutil
+import tempfile
+from typing import Any, Callable, Dict, List, Sequence
+
+import faiss
+import numpy as np
+
+from retrieval import Chunk
+
+FORMAT_VERSION = 1
+MANIFEST_FILE = "manifest.json"
+INDEX_FILE = "index.faiss"
+CHUNKS_FILE = "chunks.bin"
+OFFSETS_FILE = "chunks.offsets"
+METADATA_FILE = "chunks.meta.json"
+
+
+def compute_version(model_name: str, texts: Sequence[str]) -> str:
+    """
+    Versão do conteúdo da base: muda sempre que o modelo ou o texto de algum chunk muda.
+    """
+    digest = hashlib.sha256(model_name.encode("utf-8"))
+    for text in texts:
+        digest.update(hashlib.sha256(text.encode("utf-8")).digest())
+    return digest.hexdigest()[:16]
+
+
+def _replace_file(path: str, data: bytes):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def _read_json(path: str):
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def resolve_version_dir(directory: str) -> tuple:
+    """
+    Lê o ponteiro (manifest.json de topo) uma única vez. Retorna (pasta da versão atual, manifest).
+    """
+    manifest = _read_json(os.path.join(directory, MANIFEST_FILE))
+    path = manifest.pop("path", None)
+    return (os.path.join(directory, path) if path else directory), manifest
+
+
+def _remove_old_versions(directory: str, keep: List[str], keep_legacy: bool = False):
+    for name in os.listdir(directory):
+        path = os.path.join(directory, name)
+        if name.startswith("v") and os.path.isdir(path) and name not in keep:
+            shutil.rmtree(path, ignore_errors=True)
+    if keep_legacy:
+        return
+    # Ficheiros do formato antigo (sem pastas de versão): ficam enquanto forem a versão anterior
+    # e são removidos na escrita seguinte, como as pastas de versão fora de `keep`.
+    for name in (INDEX_FILE, CHUNKS_FILE, OFFSETS_FILE, METADATA_FILE):
+        path = os.path.join(directory, name)
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def write_index(directory: str, vectors: np.ndarray, texts: Sequence[str], metadatas: Sequence[Dict[str, Any]] | None,
+                model_name: str, extra: Dict[str, Any] | None = None) -> Dict[str, Any]:
+    """
+    Grava a base vetorial no formato nativo, numa pasta de versão nova, e aponta o manifest de topo
+    para ela. Até essa substituição (atómica) os leitores continuam a ver a versão anterior inteira.
+    `extra` acrescenta campos ao manifest (ex: hashes dos documentos de origem).
+    """
+    if len(vectors) != len(texts):
+        raise ValueError("O número de vetores não corresponde ao número de chunks.")
+    os.makedirs(directory, exist_ok=True)
+    metadatas = list(metadatas) if metadatas is not None else [{} for _ in texts]
+    manifest = {
+        "format_version": FORMAT_VERSION,
+        "model_name": model_name,
+        "dimension": int(vectors.shape[1]),
+        "count": len(texts),
+        "metric": "cosine",
+        "version": compute_version(model_name, texts),
+        **(extra or {}),
+    }
+    # Nome único: duas reindexações com o mesmo conteúdo não escrevem na mesma pasta.
+    version_dir = tempfile.mkdtemp(prefix=f"v{manifest['version']}-", dir=directory)
+    os.chmod(version_dir, 0o755)
+
+    vectors = np.ascontiguousarray(vectors, dtype="float32")
+    faiss.normalize_L2(vectors)
+    index = faiss.IndexFlatIP(vectors.shape[1])
+    index.add(vectors)
+    faiss.write_index(index, os.path.join(version_dir, INDEX_FILE))
+
+    encoded = [text.encode("utf-8") for text in texts]
+    offsets = np.zeros(len(encoded) + 1, dtype="<u8")
+    offsets[1:] = np.cumsum([len(chunk) for chunk in encoded], dtype="<u8")
+    with open(os.path.join(version_dir, CHUNKS_FILE), "wb") as f:
+        f.write(b"".join(encoded))
+    with open(os.path.join(version_dir, OFFSETS_FILE), "wb") as f:
+        f.write(offsets.tobytes())
+    with open(os.path.join(version_dir, METADATA_FILE), "wb") as f:
+        f.write(json.dumps(metadatas, ensure_ascii=False).encode("utf-8"))
+    with open(os.path.join(version_dir, MANIFEST_FILE), "wb") as f:
+        f.write(json.dumps(manifest, indent=2).encode("utf-8"))
+
+    previous, previous_is_legacy = None, False
+    if os.path.exists(os.path.join(directory, MANIFEST_FILE)):
+        previous = _read_json(os.path.join(directory, MANIFEST_FILE)).get("path")
+        previous_is_legacy = previous is None
+    pointer = {**manifest, "path": os.path.basename(version_dir)}
+    _replace_file(os.path.join(directory, MANIFEST_FILE), json.dumps(pointer, indent=2).encode("utf-8"))
+    # A versão anterior fica no disco: um leitor pode tê-la resolvido há instantes e ainda a estar a abrir.
+    _remove_old_versions(directory, keep=[os.path.basename(version_dir), previous], keep_legacy=previous_is_legacy)
+    return manifest
+
+
+class VectorIndex:
+    """
+    Base vetorial carregada em modo só de leitura, com índice e textos mapeados em memória.
+    """
+
+    def __init__(self, directory: str, manifest: Dict[str, Any], index, offsets: np.ndarray, blob: mmap.mmap | bytes,
+                 metadatas: List[Dict[str, Any]]):
+        self.directory = directory
+        self.manifest = manifest
+        self.index = index
+        self.offsets = offsets
+        self.blob = blob
+        self.metadatas = metadatas
+        self.embed_query: Callable[[str], Sequence[float]] | None = None
+
+    @classmethod
+    def load(cls, directory: str) -> "VectorIndex":
+        version_dir, manifest = resolve_version_dir(directory)
+        if manifest.get("format_version") != FORMAT_VERSION:
+            raise ValueError(f"Formato da base vetorial não suportado: {manifest.get('format_version')}.")
+
+        index = faiss.read_index(os.path.join(version_dir, INDEX_FILE), faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+        if index.d != manifest["dimension"] or index.ntotal != manifest["count"]:
+            raise ValueError("O índice FAISS não corresponde ao manifest da base vetorial.")
+
+        offsets = np.memmap(os.path.join(version_dir, OFFSETS_FILE), dtype="<u8", mode="r")
+        chunks_path = os.path.join(version_dir, CHUNKS_FILE)
+        if len(offsets) != manifest["count"] + 1 or int(offsets[-1]) != os.path.getsize(chunks_path):
+            raise ValueError("Os textos dos chunks não correspondem ao manifest da base vetorial.")
+        if os.path.getsize(chunks_path) > 0:
+            with open(chunks_path, "rb") as f:
+                blob = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            blob = b""
+        metadatas = _read_json(os.path.join(version_dir, METADATA_FILE))
+        if len(metadatas) != manifest["count"]:
+            raise ValueError("Os metadados dos chunks não correspondem ao manifest da base vetorial.")
+        return cls(version_dir, manifest, index, offsets, blob, metadatas)
+
+    @property
+    def version(self) -> str:
+        return self.manifest["version"]
+
+    @property
+    def model_name(self) -> str:
+        return self.manifest["model_name"]
+
+    def __len__(self) -> int:
+        return self.manifest["count"]
+
+    def get_text(self, i: int) -> str:
+        return self.blob[int(self.offsets[i]):int(self.offsets[i + 1])].decode("utf-8")
+
+    def get_chunk(self, i: int, score: float = 0.0) -> Chunk:
+        return Chunk(page_content=self.get_text(i), metadata=self.metadatas[i], score=score)
+
+    def get_vectors(self) -> np.ndarray:
+        """
+        Vetores (normalizados) de todos os chunks, para reaproveitar numa reindexação.
+        """
+        if len(self) == 0:
+            return np.zeros((0, self.manifest["dimension"]), dtype="float32")
+        return self.index.reconstruct_n(0, len(self))
+
+    def search_ids(self, vector: Sequence[float], k: int = 4) -> List[tuple]:
+        """
+        Pesquisa por vetor; retorna pares (posição do chunk, similaridade), do mais para o menos semelhante.
+        """
+        query = np.asarray(vector, dtype="float32").reshape(1, -1).copy()
+        faiss.normalize_L2(query)
+        scores, ids = self.index.search(query, min(k, len(self)))
+        return [(int(i), float(s)) for s, i in zip(scores[0], ids[0]) if i >= 0]
+
+    def search_by_vector(self, vector: Sequence[float], k: int = 4) -> List[Chunk]:
+        return [self.get_chunk(i, score) for i, score in self.search_ids(vector, k)]
+
+    def similarity_search(self, query: str, k: int = 4) -> List[Chunk]:
+        """
+        Pesquisa por texto (mesma interface do FAISS do LangChain). Requer `embed_query` configurado.
+        """
+        if self.embed_query is None:
+            raise RuntimeError("Nenhuma função de embedding configurada para a base vetorial.")
+        return self.search_by_vector(self.embed_query(query), k)